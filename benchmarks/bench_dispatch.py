@@ -0,0 +1,119 @@
+"""Benchmark the Hark machine instruction dispatch loop
+
+Runs some CPU-bound Hark programs on the in-memory controller in the current
+thread, and reports the number of machine steps executed per second.
+
+Usage:
+  PYTHONPATH=src python benchmarks/bench_dispatch.py [REPEATS]
+"""
+import sys
+import time
+
+from hark_lang.controllers.local import DataController
+from hark_lang.executors.thread import Invoker
+from hark_lang.load import compile_text
+from hark_lang.machine import types as mt
+from hark_lang.machine.machine import TlMachine
+
+PROGRAM = """
+fn fib(n) {
+  if n < 2 {
+    n
+  }
+  else {
+    fib(n - 1) + fib(n - 2)
+  }
+}
+
+fn count_tr(n, acc) {
+  if n == 0 {
+    acc
+  }
+  else {
+    count_tr(n - 1, acc + n % 7)
+  }
+}
+
+fn run_fib(n) {
+  fib(n)
+}
+
+fn run_loop(n) {
+  count_tr(n, 0)
+}
+
+fn build_tr(n, acc) {
+  if n == 0 {
+    acc
+  }
+  else {
+    build_tr(n - 1, append(acc, n))
+  }
+}
+
+fn sum_tr(lst, acc) {
+  if nullp(lst) {
+    acc
+  }
+  else {
+    sum_tr(rest(lst), acc + first(lst))
+  }
+}
+
+fn run_lists(n) {
+  sum_tr(build_tr(n, []), 0)
+}
+
+fn hash_tr(n, acc) {
+  if n == 0 {
+    get(acc, 1)
+  }
+  else {
+    hash_tr(n - 1, set(acc, n, n * 2))
+  }
+}
+
+fn run_hash(n) {
+  hash_tr(n, hash())
+}
+"""
+
+CASES = [
+    ("run_fib", [mt.TlInt(16)]),
+    ("run_loop", [mt.TlInt(20000)]),
+    ("run_lists", [mt.TlInt(10000)]),
+    ("run_hash", [mt.TlInt(5000)]),
+]
+
+
+def run_once(exe, function, args):
+    """Run FUNCTION to completion, returning (steps, seconds)"""
+    controller = DataController()
+    controller.set_executable(exe)
+    invoker = Invoker(controller)
+    vmid = controller.toplevel_machine(exe.bindings[function], args)
+    machine = TlMachine(vmid, invoker)
+    start = time.perf_counter()
+    machine.run()
+    elapsed = time.perf_counter() - start
+    if controller.broken:
+        raise RuntimeError(controller.get_state(vmid).error_msg)
+    return machine._steps, elapsed
+
+
+def main(repeats=3):
+    exe = compile_text(PROGRAM)
+    for function, args in CASES:
+        best = min(
+            (run_once(exe, function, args) for _ in range(repeats)),
+            key=lambda r: r[1],
+        )
+        steps, elapsed = best
+        print(
+            f"{function:9} {steps:10d} steps  {elapsed:8.3f}s  "
+            f"{steps / elapsed:12,.0f} steps/s"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
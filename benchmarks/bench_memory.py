@@ -0,0 +1,115 @@
+"""Benchmark the memory footprint of Hark machine data
+
+Runs some Hark programs on the in-memory controller, and reports the peak
+memory allocated while running, and the memory still held by the controller
+(thread states, activation records, futures) once the program has finished.
+
+Usage:
+  PYTHONPATH=src python benchmarks/bench_memory.py
+"""
+import gc
+import time
+import tracemalloc
+
+from hark_lang.controllers.local import DataController
+from hark_lang.executors.thread import Invoker
+from hark_lang.load import compile_text
+from hark_lang.machine import types as mt
+from hark_lang.machine.machine import TlMachine
+
+PROGRAM = """
+fn sum_to(n) {
+  if n == 0 {
+    0
+  }
+  else {
+    n + sum_to(n - 1)
+  }
+}
+
+fn run_deep(n) {
+  sum_to(n)
+}
+
+fn build_tr(n, acc) {
+  if n == 0 {
+    acc
+  }
+  else {
+    build_tr(n - 1, append(acc, n))
+  }
+}
+
+fn run_list(n) {
+  length(build_tr(n, []))
+}
+
+fn child(x) {
+  x * 2
+}
+
+fn spawn_tr(n, acc) {
+  if n == 0 {
+    acc
+  }
+  else {
+    spawn_tr(n - 1, append(acc, async child(n)))
+  }
+}
+
+fn wait_tr(futures, acc) {
+  if nullp(futures) {
+    acc
+  }
+  else {
+    wait_tr(rest(futures), acc + await first(futures))
+  }
+}
+
+fn run_threads(n) {
+  wait_tr(spawn_tr(n, []), 0)
+}
+"""
+
+# (function, argument, what the argument counts)
+CASES = [
+    ("run_deep", 2000, "frames"),
+    ("run_list", 50000, "items"),
+    ("run_threads", 500, "threads"),
+]
+
+
+def run_once(exe, function, arg):
+    """Run FUNCTION to completion, returning (peak bytes, retained bytes)"""
+    gc.collect()
+    tracemalloc.start()
+    controller = DataController()
+    controller.set_executable(exe)
+    invoker = Invoker(controller)
+    vmid = controller.toplevel_machine(exe.bindings[function], [mt.TlInt(arg)])
+    TlMachine(vmid, invoker).run()
+    while not controller.all_stopped():
+        time.sleep(0.01)
+    invoker.shutdown()
+    if controller.broken:
+        raise RuntimeError(controller.get_state(vmid).error_msg)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del controller
+    return peak, retained
+
+
+def main():
+    exe = compile_text(PROGRAM)
+    for function, arg, unit in CASES:
+        peak, retained = run_once(exe, function, arg)
+        print(
+            f"{function:11} {arg:6d} {unit:7}  peak {peak / 1024:9,.0f} KiB  "
+            f"retained {retained / 1024:9,.0f} KiB  "
+            f"({retained / arg:6,.0f} B/{unit[:-1]})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -202,7 +202,8 @@ def get_input(question: str) -> str:
 
 def print_outputs(success_result: dict):
     errors = success_result["errors"]
-    output = success_result["output"]
+    # Output is stored by thread - show it in the order it was written
+    output = sorted(success_result["output"], key=itemgetter("time"))
 
     if output:
         table = Texttable(max_width=100)
@@ -218,6 +219,21 @@ def print_outputs(success_result: dict):
 
         print("\n" + table.draw() + "\n")
 
+    _print_thread_errors(errors)
+
+
+def print_output_stream(pages):
+    """Print pages of output (see HarkInstanceApi.follow_stdout) as they arrive"""
+    errors = []
+    for page in pages:
+        for o in sorted(page["output"], key=itemgetter("time")):
+            thread = dim(f"[{o['thread']}]")
+            print(f"{thread} {o['text']}", end="", flush=True)
+        errors = page["errors"]
+    _print_thread_errors(errors)
+
+
+def _print_thread_errors(errors):
     for idx, item in enumerate(errors):
         if item:
             print(bad(f"\nException in Thread {idx}"))
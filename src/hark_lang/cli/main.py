@@ -6,10 +6,10 @@ Usage:
   hark [options] asm FILE
   hark [options] deploy
   hark [options] destroy
-  hark [options] invoke [-f FUNCTION] [--async] [ARG...]
+  hark [options] invoke [-f FUNCTION] [-p MODE] [--async] [ARG...]
   hark [options] events [--unified | --json] [SESSION_ID]
-  hark [options] stdout [--json] [SESSION_ID]
-  hark [options] FILE [-f FUNCTION] [-s MODE] [-c MODE] [ARG...]
+  hark [options] stdout [--json] [--follow] [SESSION_ID]
+  hark [options] FILE [-f FUNCTION] [-s MODE] [-c MODE] [-p MODE] [ARG...]
   hark --version
   hark -h | --help
 
@@ -34,11 +34,13 @@ Options:
   --config=CONFIG  Config file to use  [default: hark.toml]
 
   -f FUNCTION, --function=FUNCTION  Target function      [default: main]
-  -s MODE, --storage=MODE           memory | dynamodb    [default: memory]
+  -s MODE, --storage=MODE           memory | dynamodb | sqlite  [default: memory]
   -c MODE, --concurrency=MODE       processes | threads  [default: threads]
+  -p MODE, --probe=MODE             off | calls | sampled[:N] | full
 
   -u, --unified  Merge events into one table
   -j, --json     Print as json
+  --follow       Print output as it's written, until the session finishes
 
 Hark cloud options:
   --project=ID  Hark Cloud Project ID
@@ -117,6 +119,7 @@ def _run(args):
     sys.path.append(".")
 
     fn_args = args["ARG"]
+    probe_mode = args["--probe"]
 
     LOG.info(f"Running `{fn}` in {filename} ({len(fn_args)} args)...")
 
@@ -130,7 +133,7 @@ def _run(args):
         # default. Maybe it should be None.
         timeout = 60
 
-    supported_storages = ["memory", "dynamodb"]
+    supported_storages = ["memory", "dynamodb", "sqlite"]
 
     if args["--storage"] not in supported_storages:
         exit_problem(
@@ -139,23 +142,28 @@ def _run(args):
         )
 
     if args["--storage"] == "memory":
-        if args["--concurrency"] == "processes":
-            exit_problem(
-                "Can't use processes with in-memory storage",
-                "Processes can only be used with a thread-safe memory store, like dynamodb",
-            )
-
-        from ..run.local import run_local
+        from ..run.local import run_local, run_local_processes
 
-        result = run_local(filename, fn, fn_args, timeout)
+        if args["--concurrency"] == "processes":
+            result = run_local_processes(filename, fn, fn_args, timeout, probe_mode)
+        else:
+            result = run_local(filename, fn, fn_args, timeout, probe_mode)
 
     elif args["--storage"] == "dynamodb":
         from ..run.dynamodb import run_ddb_local, run_ddb_processes
 
         if args["--concurrency"] == "processes":
-            result = run_ddb_processes(filename, fn, fn_args, timeout)
+            result = run_ddb_processes(filename, fn, fn_args, timeout, probe_mode)
         else:
-            result = run_ddb_local(filename, fn, fn_args, timeout)
+            result = run_ddb_local(filename, fn, fn_args, timeout, probe_mode)
+
+    elif args["--storage"] == "sqlite":
+        from ..run.sqlite import run_sqlite_local, run_sqlite_processes
+
+        if args["--concurrency"] == "processes":
+            result = run_sqlite_processes(filename, fn, fn_args, timeout, probe_mode)
+        else:
+            result = run_sqlite_local(filename, fn, fn_args, timeout, probe_mode)
 
     else:
         raise ValueError(args["--storage"])
@@ -290,7 +298,9 @@ def _invoke(args, cfg):
     api = _get_instance_api(cfg)
 
     with spin(str(primary(f"{hark_fn}(...)"))) as sp:
-        session = api.invoke(hark_fn, hark_args, timeout, wait_for_finish)
+        session = api.invoke(
+            hark_fn, hark_args, timeout, wait_for_finish, args["--probe"]
+        )
 
         sp.text += " " + dim(session.session_id)
         utils.save_last_session_id(cfg, session.session_id)
@@ -340,7 +350,16 @@ def _stdout(args, cfg):
     sid = utils.get_session_id(args, cfg)
     api = _get_instance_api(cfg)
 
-    if args["--json"]:
+    if args["--follow"]:
+        pages = api.follow_stdout(sid)
+        if args["--json"]:
+            # One entry per line, so it can be piped as it arrives
+            for page in pages:
+                for item in page["output"]:
+                    print(json.dumps(item), flush=True)
+        else:
+            ui.print_output_stream(pages)
+    elif args["--json"]:
         data = api.get_stdout(sid)
         print(json.dumps(data, indent=2))
     else:
@@ -1,6 +1,7 @@
 """The HTTP API interface to a Hark Instance"""
 
 import logging
+import time
 from pathlib import Path
 from typing import List, Any
 from dataclasses import dataclass
@@ -66,7 +67,7 @@ class HarkInstanceApi:
             raise UnexpectedError("set_exe returned an unexpected result")
 
     def invoke(
-        self, function: str, args: List[str], timeout, wait_for_finish
+        self, function: str, args: List[str], timeout, wait_for_finish, probe_mode=None
     ) -> SessionInfo:
         """Invoke (call) a Hark function"""
         payload = {
@@ -76,20 +77,52 @@ class HarkInstanceApi:
             "timeout": timeout,
             "wait_for_finish": wait_for_finish,
         }
+        if probe_mode:
+            payload["probe"] = probe_mode
         data = _call_cloud_api(self._deploy_config, FnEventHandler, payload)
         return SessionInfo(**data)
 
     def get_stdout(self, session_id: str) -> dict:
         # TODO structure this result
-        return _call_cloud_api(
-            self._deploy_config, FnGetOutput, {"session_id": session_id}
-        )
+        pages = list(self._get_pages(FnGetOutput, session_id))
+        output = [item for page in pages for item in page["output"]]
+        return dict(output=output, errors=pages[-1]["errors"])
+
+    def follow_stdout(self, session_id: str, poll_period=1.0):
+        """Generate pages of new standard output until the session finishes
+
+        Each page is a dict like get_stdout's - thread errors are in the last.
+        """
+        cursor = {}
+        while True:
+            data = _call_cloud_api(
+                self._deploy_config,
+                FnGetOutput,
+                {"session_id": session_id, "cursor": cursor},
+            )
+            cursor = data["cursor"]
+            yield data
+            if data["finished"]:
+                return
+            if not data["output"]:
+                time.sleep(poll_period)
 
     def get_events(self, session_id: str):
         # TODO structure this result
-        return _call_cloud_api(
-            self._deploy_config, FnGetEvents, {"session_id": session_id}
-        )
+        pages = self._get_pages(FnGetEvents, session_id)
+        return dict(events=[item for page in pages for item in page["events"]])
+
+    def _get_pages(self, cls, session_id: str):
+        """Get every page of a paginated result (see run/aws.py getoutput)"""
+        after = None
+        while True:
+            data = _call_cloud_api(
+                self._deploy_config, cls, {"session_id": session_id, "after": after}
+            )
+            yield data
+            after = data.get("next")
+            if after is None:
+                return
 
     def get_logs(self, session_id: str):
         raise NotImplementedError
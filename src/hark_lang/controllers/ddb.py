@@ -6,7 +6,8 @@ session.
 
 Data per session:
 - futures (resolved, value, chain, continuations - machine, offset)
-- machines (probe logs, state - ip, stopped flag, stacks, and bindings)
+- machines (probe logs, state - ip, stacks, and bindings, and stopped flag)
+- standard output, probe logs and probe events (an item per entry)
 
 Data exchange points:
 - machine forks (State of new machine set to point at the fork IP)
@@ -16,15 +17,25 @@ Data exchange points:
 - top level machine finishes (Controller sets session result)
 - machine stops (upload the State)
 - machine continues (download the State)
+
+There are no locks. Counters and lists shared by threads are changed with
+atomic update expressions, and IDs are leased in blocks (see _new_id). Where a
+write depends on what was read (eg, resolving a future, which must see all of
+its continuations), the item's version number is checked and bumped (see
+ddb_model.versioned_update), and the read-modify-write is retried if another
+thread got there first.
 """
-import functools
+import contextlib
 import logging
 import sys
+import threading
 import time
 import warnings
+from collections import Counter
 from typing import List, Tuple
 
 from ..machine import future as fut
+from ..machine import types as mt
 from ..machine.controller import Controller, ControllerError
 from . import ddb_model as db
 from .ddb_model import (
@@ -36,10 +47,11 @@ from .ddb_model import (
     STATE,
     STDOUT,
     PLUGINS_HASH_KEY,
+    RUNNING,
+    THREAD,
 )
 
 try:
-    from ..machine.executable import Executable
     from ..machine.probe import ProbeEvent, ProbeLog
     from ..machine.state import State
     from ..machine.stdout_item import StdoutItem
@@ -51,15 +63,35 @@ except ModuleNotFoundError:
 
 LOG = logging.getLogger(__name__)
 
+# Seconds between checks in wait_finished, for threads in other processes
+FINISHED_POLL_INTERVAL = 0.1
+
+# Number of thread or arec IDs to lease at a time (see _new_id)
+ID_LEASE_SIZE = 64
+
+# Standard output is written in batches of up to this many items, and whatever
+# is left when the thread is flushed (eg when it waits or stops)
+OUTPUT_BATCH_SIZE = 25
+
+# Number of stdout/probe items read per query (see _stream)
+STREAM_PAGE_SIZE = 500
+
+# Missing stdout entries are skipped by get_stdout_since after this long
+# (seconds) - whatever was writing them probably died
+STREAM_GAP_TIMEOUT = 10.0
+
+# The item attribute holding each stream's entries
+STREAM_ATTRS = {STDOUT: "stdout", PLOGS: "plogs", PEVENTS: "pevents"}
+
 
 class DataController(Controller):
     supports_plugins = True
 
     @classmethod
-    def with_new_session(cls):
+    def with_new_session(cls, probe_mode=None):
         """Create a data controller for a new session"""
         base_session = db.init_base_session()
-        this_session = db.new_session()
+        this_session = db.new_session(probe_mode)
         LOG.info("Created new session, %s", this_session.session_id)
         return cls(this_session, base_session)
 
@@ -67,19 +99,36 @@ class DataController(Controller):
     def with_session_id(cls, session_id: str, db_cls=db.SessionItem):
         try:
             base_session = db.init_base_session()
-            this_session = db_cls.get(session_id, META)
+            this_session = db.get_meta(session_id, db_cls)
         except db_cls.DoesNotExist as exc:
             raise ControllerError("Session does not exist") from exc
         LOG.info("Reloaded session %s", session_id)
         return cls(this_session, base_session, db_cls=db_cls)
 
+    @property
+    def open_args(self):
+        return (type(self), self.session_id)
+
     def __init__(self, this_session, base_session, db_cls=db.SessionItem):
         self.SI = db_cls
+        self._stopped_changed = threading.Condition()
+        self._finished = False  # whether set_stopped saw the session finish
+        self._lease_lock = threading.Lock()
+        self._leases = {}  # META counter -> [next ID, end of lease]
+        # Write-behind cache (see begin), shared by the threads of this process
+        self._cache_lock = threading.Lock()  # for the three below
+        self._running = {}  # vmid -> State (None until loaded)
+        self._arecs = {}  # ptr -> ActivationRecord, of machines running here
+        self._unsaved_arecs = set()  # ptrs of cached arecs not in the DB yet
+        self._buffer_lock = threading.Lock()  # for the write buffers below
+        self._dead_arecs = []  # ptrs of arecs to delete from the DB
+        self._output = {}  # vmid -> stdout items not in the DB yet
         self.session_id = this_session.session_id
+        self.probe_mode = this_session.meta.probe_mode
         if base_session.meta.exe:
-            self.executable = Executable.deserialise(base_session.meta.exe)
+            self.executable = base_session.meta.exe
         elif this_session.meta.exe:
-            self.executable = Executable.deserialise(this_session.meta.exe)
+            self.executable = this_session.meta.exe
         else:
             self.executable = None
             # It's allowed to initialise a controller with no executable, as
@@ -95,45 +144,99 @@ class DataController(Controller):
                 f"Item {_key} does not exist in {self.session_id}"
             ) from exc
 
-    @functools.lru_cache
-    def _lock_item(self, group: str, item_id=None) -> db.SessionLocker:
-        """Get a context manager that locks the specified group:item_id"""
-        item = self._qry(group, item_id)
-        return db.SessionLocker(item)
+    def _item(self, group, item_id=None):
+        """Get group:item_id, without reading it - just for updates"""
+        _key = f"{group}:{item_id}" if item_id is not None else group
+        return self.SI(self.session_id, _key)
 
     def set_executable(self, exe):
-        self.executable = exe
-        s = self._qry(META)
-        s.meta.exe = exe.serialise()
-        s.save()
+        digest = db.executable_hash(exe)
+        self.executable = db.cache_executable(digest, exe)
+        self._item(META).update(
+            actions=[self.SI.meta.exe.set(exe), self.SI.meta.exe_hash.set(digest)]
+        )
         LOG.info("Updated session code")
 
     def set_entrypoint(self, fn_name: str):
-        s = self._qry(META)
-        s.meta.entrypoint = fn_name
-        s.save()
+        self._item(META).update(actions=[self.SI.meta.entrypoint.set(fn_name)])
+
+    ## IDs
+    #
+    # Thread and arec IDs are leased from the META counters in blocks, so that
+    # forking many threads (or making many arecs) doesn't update META each time.
+    # IDs in unused blocks are simply never used. The top level thread gets ID
+    # 0, being the first thread created in the session.
+
+    def _new_id(self, counter: str) -> int:
+        return self._new_ids(counter, 1)[0]
+
+    def _new_ids(self, counter: str, count: int) -> List[int]:
+        ids = []
+        with self._lease_lock:
+            lease = self._leases.get(counter)
+            while len(ids) < count:
+                if lease is None or lease[0] == lease[1]:
+                    size = max(ID_LEASE_SIZE, count - len(ids))
+                    attr = getattr(self.SI.meta, counter)
+                    s = self._item(META)
+                    s.update(actions=[attr.set(attr + size)])
+                    end = getattr(s.meta, counter)
+                    lease = self._leases[counter] = [end - size, end]
+                start = lease[0]
+                lease[0] = min(lease[1], start + count - len(ids))
+                ids.extend(range(start, lease[0]))
+        return ids
 
     ## Threads
 
     def new_thread(self) -> int:
         """Create a new thread, returning the thead ID"""
-        with self._lock_item(META):
-            s = self._qry(META)
-            vmid = s.meta.num_threads
-            s.meta.num_threads += 1
-            s.meta.stopped.append(False)
-            s.save()
-
-        db.new_session_item(self.session_id, f"{STATE}:{vmid}", state=State([])).save()
-        db.new_session_item(
-            self.session_id, f"{FUTURE}:{vmid}", future=fut.Future()
-        ).save()
+        vmid = self._new_id("num_threads")
+        sid = self.session_id
+        with self.SI.batch_write() as batch:
+            batch.save(db.new_session_item(sid, f"{STATE}:{vmid}", state=State([])))
+            batch.save(
+                db.new_session_item(sid, f"{FUTURE}:{vmid}", future=fut.Future())
+            )
+            # Stopped until _init_thread starts it (see set_stopped)
+            batch.save(db.new_session_item(sid, f"{THREAD}:{vmid}", stopped=True))
         return vmid
 
+    def thread_machines(self, caller_arec_ptr, caller_ip, fn_ptr, args_list):
+        """Create many threads at once, with batched writes"""
+        count = len(args_list)
+        vmids = self._new_ids("num_threads", count)
+        ptrs = self._new_ids("num_arecs", count)
+        sid = self.session_id
+        with self.SI.batch_write() as batch:
+            for vmid, ptr, args in zip(vmids, ptrs, args_list):
+                arec = self._thread_arec(vmid, caller_arec_ptr, caller_ip, fn_ptr)
+                state = self._thread_state(fn_ptr, args, arec, ptr)
+                for item in [
+                    db.new_session_item(sid, f"{AREC}:{ptr}", arec=arec),
+                    db.new_session_item(sid, f"{STATE}:{vmid}", state=state),
+                    db.new_session_item(sid, f"{FUTURE}:{vmid}", future=fut.Future()),
+                    # Already started - see set_stopped
+                    db.new_session_item(sid, f"{THREAD}:{vmid}", stopped=False),
+                ]:
+                    batch.save(item)
+        if count:
+            self._update_ref(caller_arec_ptr, count)
+        shards = Counter(vmid % db.RUNNING_SHARDS for vmid in vmids)
+        for shard, started in shards.items():
+            self._item(RUNNING, shard).update(actions=[self.SI.running.add(started)])
+        return vmids
+
     def get_thread_ids(self) -> List[int]:
         """Get a list of thread IDs in this session"""
-        s = self._qry(META)
-        return list(range(s.meta.num_threads))
+        prefix = f"{THREAD}:"
+        items = self.SI.query(
+            self.session_id,
+            self.SI.item_id.startswith(prefix),
+            consistent_read=True,
+            attributes_to_get=["item_id"],
+        )
+        return sorted(int(s.item_id[len(prefix) :]) for s in items)
 
     def get_top_level_future(self):
         return self.get_future(0)
@@ -141,24 +244,115 @@ class DataController(Controller):
     def is_top_level(self, vmid):
         return vmid == 0
 
+    # Each thread has a THREAD item with its stopped flag, and the number of
+    # running threads is counted in RUNNING_SHARDS items (thread N is counted in
+    # shard N % RUNNING_SHARDS). A thread is only ever started by another
+    # running thread, before that one stops, so the count only reaches zero
+    # when the session has finished.
+
     def all_stopped(self):
-        s = self._qry(META)
-        return all(s.meta.stopped)
+        keys = [
+            (self.session_id, f"{RUNNING}:{shard}")
+            for shard in range(db.RUNNING_SHARDS)
+        ]
+        # Read the shards at one point in time, or a thread starting in one
+        # shard and another stopping in a shard read earlier could be missed
+        return sum(s.running for s in db.get_consistent(keys, self.SI)) == 0
 
     def set_stopped(self, vmid, stopped: bool):
-        with self._lock_item(META):
-            s = self._qry(META)
-            s.meta.stopped[vmid] = stopped
-            s.save()
+        SI = self.SI
+        try:
+            db.conditional_update(
+                self._item(THREAD, vmid),
+                [SI.stopped.set(stopped)],
+                SI.stopped != stopped,
+            )
+        except db.Conflict:
+            return  # already in that state
+        self._count_running(vmid, -1 if stopped else 1)
+
+    def _count_running(self, vmid, delta):
+        shard = self._item(RUNNING, vmid % db.RUNNING_SHARDS)
+        shard.update(actions=[self.SI.running.add(delta)])
+        # Once finished, the session stays finished - a thread that saw others
+        # still running mustn't clear the flag after the last one has set it
+        if delta < 0 and shard.running == 0 and self.all_stopped():
+            with self._stopped_changed:
+                self._finished = True
+                self._stopped_changed.notify_all()
+
+    def wait_finished(self, timeout=None, poll_interval=None) -> bool:
+        """Wait for the session to finish
+
+        Without a poll_interval, the threads must be running in this process
+        (e.g. on the thread invoker), and set_stopped notifies waiters when the
+        last one stops. Threads in other processes or Lambdas can't do that, so
+        with a poll_interval the RUNNING counts are read every poll_interval
+        seconds instead.
+        """
+        if poll_interval is None:
+            with self._stopped_changed:
+                return self._stopped_changed.wait_for(lambda: self._finished, timeout)
+        return super().wait_finished(timeout, poll_interval)
 
     def set_state(self, vmid, state):
         # NOTE: no locking required, no inter-thread state access allowed
-        s = self._qry(STATE, vmid)
-        s.state = state
-        s.save()
+        with self._cache_lock:
+            if vmid in self._running:
+                self._running[vmid] = state
+                return
+        self._item(STATE, vmid).update(actions=[self.SI.state.set(state)])
 
     def get_state(self, vmid):
-        return self._qry(STATE, vmid).state
+        with self._cache_lock:
+            state = self._running.get(vmid)
+        if state is None:
+            state = self._qry(STATE, vmid).state
+            with self._cache_lock:
+                if vmid in self._running:
+                    self._running[vmid] = state
+        return state
+
+    ## Write-behind cache
+    #
+    # The state of a machine running in this process, and the activation
+    # records it creates, are private to it until it stops or forks. So they
+    # are kept in memory, and written in one batch. Arecs are still cached
+    # after being written, but changes to their reference counts go to the
+    # database, as they're shared with the child threads from then on.
+
+    def begin(self, vmid):
+        with self._cache_lock:
+            self._running[vmid] = None
+
+    def flush(self, vmid):
+        self._write_output(vmid)
+        self._delete_dead_arecs()
+        with self._cache_lock:
+            unsaved = {
+                ptr: self._arecs[ptr]
+                for ptr in self._unsaved_arecs
+                if self._arecs[ptr].vmid == vmid
+            }
+        if not unsaved:
+            return
+        with self.SI.batch_write() as batch:
+            for ptr, rec in unsaved.items():
+                batch.save(
+                    db.new_session_item(self.session_id, f"{AREC}:{ptr}", arec=rec)
+                )
+        with self._cache_lock:
+            self._unsaved_arecs.difference_update(unsaved)
+
+    def release(self, vmid):
+        self.flush(vmid)
+        with self._cache_lock:
+            state = self._running.pop(vmid, None)
+            for ptr in [p for p, rec in self._arecs.items() if rec.vmid == vmid]:
+                del self._arecs[ptr]
+        if state is not None:
+            s = db.new_session_item(self.session_id, f"{STATE}:{vmid}", state=state)
+            s.save()
 
     ## controller properties
 
@@ -169,22 +363,7 @@ class DataController(Controller):
 
     @broken.setter
     def broken(self, value):
-        try:
-            with self._lock_item(META):
-                s = self._qry(META)
-                s.meta.broken = True
-                s.save()
-        except db.LockTimeout:
-            # If a thread dies while updating META, this will timeout. However,
-            # in that case, broken is True and we *should* ignore the lock and
-            # carry on. If it's broken, the lock doesn't matter anyway.
-            # Hopefully this isn't a genuine race condition.
-            if value:
-                s = self._qry(META)
-                s.meta.broken = True
-                s.save()
-            else:
-                raise
+        self._item(META).update(actions=[self.SI.meta.broken.set(value)])
 
     @property
     def result(self):
@@ -193,68 +372,218 @@ class DataController(Controller):
 
     @result.setter
     def result(self, value):
-        with self._lock_item(META):
-            s = self._qry(META)
-            s.meta.result = value
-            s.save()
+        self._item(META).update(actions=[self.SI.meta.result.set(value)])
 
     ## arecs
 
     def new_arec(self):
-        with self._lock_item(META):
-            s = self._qry(META)
-            ptr = s.meta.num_arecs
-            s.meta.num_arecs += 1
-            s.save()
-        return ptr
+        return self._new_id("num_arecs")
 
     def set_arec(self, ptr, rec):
-        try:
-            s = self._qry(AREC, ptr)
-            s.arec = rec
-        except ControllerError:
-            s = db.new_session_item(self.session_id, f"{AREC}:{ptr}", arec=rec)
-        s.save()
+        with self._cache_lock:
+            if rec.vmid in self._running:
+                self._arecs[ptr] = rec
+                self._unsaved_arecs.add(ptr)
+                return
+        db.new_session_item(self.session_id, f"{AREC}:{ptr}", arec=rec).save()
 
     def get_arec(self, ptr):
-        return self._qry(AREC, ptr).arec
+        with self._cache_lock:
+            rec = self._arecs.get(ptr)
+        if rec is None:
+            rec = self._qry(AREC, ptr).arec
+        return rec
+
+    def _update_ref(self, ptr, delta):
+        with self._cache_lock:
+            if ptr in self._unsaved_arecs:
+                rec = self._arecs[ptr]
+                rec.ref_count += delta
+                return rec
+        s = self._item(AREC, ptr)
+        s.update(
+            actions=[self.SI.arec.ref_count.set(self.SI.arec.ref_count + delta)]
+        )
+        with self._cache_lock:
+            rec = self._arecs.get(ptr)
+            if rec is None:
+                return s.arec
+            rec.ref_count = s.arec.ref_count
+            return rec
 
     def increment_ref(self, ptr):
-        s = self._qry(AREC, ptr)
-        s.update(actions=[self.SI.arec.ref_count.set(self.SI.arec.ref_count + 1)])
+        self._update_ref(ptr, 1)
 
     def decrement_ref(self, ptr):
-        s = self._qry(AREC, ptr)
-        s.update(actions=[self.SI.arec.ref_count.set(self.SI.arec.ref_count - 1)])
-        return s.arec
+        return self._update_ref(ptr, -1)
 
     def delete_arec(self, ptr):
-        s = self._qry(AREC, ptr)
-        s.arec.deleted = True
+        with self._cache_lock:
+            self._arecs.pop(ptr, None)
+            if ptr in self._unsaved_arecs:
+                # Never written, so nothing to delete
+                self._unsaved_arecs.discard(ptr)
+                return
+        # Deleted in batches, by flush. Nothing refers to it any more, so it
+        # doesn't matter when.
+        with self._buffer_lock:
+            self._dead_arecs.append(ptr)
+
+    def _delete_dead_arecs(self):
+        with self._buffer_lock:
+            ptrs, self._dead_arecs = self._dead_arecs, []
+        if not ptrs:
+            return
+        with self.SI.batch_write() as batch:
+            for ptr in ptrs:
+                batch.delete(self._item(AREC, ptr))
 
     def lock_arec(self, ptr):
-        return self._lock_item(AREC, ptr)
+        # Reference counts are changed atomically (see _update_ref)
+        return contextlib.nullcontext()
 
     ## probes
 
     def set_probe_data(self, vmid, probe):
-        # FIXME - 400k limit on item size is quite easy to break with events and
-        # logs.
-        events = [item.serialise() for item in probe.events]
-        s = self._qry(PEVENTS)
-        s.update(actions=[self.SI.pevents.set(self.SI.pevents.append(events))])
-
-        logs = [item.serialise() for item in probe.logs]
-        s = self._qry(PLOGS)
-        s.update(actions=[self.SI.plogs.set(self.SI.plogs.append(logs))])
+        self._write_stream(PEVENTS, vmid, probe.events)
+        self._write_stream(PLOGS, vmid, probe.logs)
+
+    def get_probe_logs(self, after=None):
+        for s in self._stream(PLOGS, after):
+            yield ProbeLog.deserialise(s.plogs.as_dict())
+
+    def get_probe_events(self, after=None):
+        for s in self._stream(PEVENTS, after):
+            yield ProbeEvent.deserialise(s.pevents.as_dict())
+
+    ## streams
+    #
+    # Standard output, probe logs and probe events are stored with an item per
+    # entry, keyed (session_id, <group>:<vmid>:<seq>). Entries are numbered per
+    # thread, in the order they're written, by the <group>_seq counter in the
+    # THREAD item - so threads don't contend on a shared counter. Numbers are
+    # reserved a batch at a time, just before writing the batch.
+
+    @staticmethod
+    def _stream_key(group, vmid, seq):
+        return f"{group}:{vmid}:{seq:020d}"
+
+    def _write_stream(self, group, vmid, entries):
+        if not entries:
+            return
+        count = len(entries)
+        attr = STREAM_ATTRS[group]
+        counter = self._item(THREAD, vmid)
+        counter.update(actions=[getattr(self.SI, f"{attr}_seq").add(count)])
+        first = getattr(counter, f"{attr}_seq") - count + 1
+        with self.SI.batch_write() as batch:
+            for seq, entry in enumerate(entries, first):
+                batch.save(
+                    db.new_session_item(
+                        self.session_id,
+                        self._stream_key(group, vmid, seq),
+                        **{attr: entry.serialise()},
+                    )
+                )
 
-    def get_probe_logs(self):
-        s = self._qry(PLOGS)
-        return [ProbeLog.deserialise(item) for item in s.plogs]
+    def _stream(self, group, after=None, limit=None):
+        """Query the items of a stream, a page at a time
+
+        Starts after the item with item_id `after`, if given.
+        """
+        last_key = None
+        if after is not None:
+            last_key = {
+                "session_id": {"S": self.session_id},
+                "item_id": {"S": after},
+            }
+        return self.SI.query(
+            self.session_id,
+            self.SI.item_id.startswith(f"{group}:"),
+            consistent_read=True,
+            last_evaluated_key=last_key,
+            limit=limit,
+            page_size=STREAM_PAGE_SIZE,
+        )
 
-    def get_probe_events(self):
-        s = self._qry(PEVENTS)
-        return [ProbeEvent.deserialise(item) for item in s.pevents]
+    def get_page(self, group, after=None, limit=STREAM_PAGE_SIZE) -> Tuple[list, str]:
+        """Get up to `limit` serialised entries of a stream (eg STDOUT)
+
+        Returns the entries, and the `after` key for the next page (None if
+        there are no more).
+        """
+        self._write_output()
+        attr = STREAM_ATTRS[group]
+        items = self._stream(group, after, limit)
+        entries = [getattr(s, attr).as_dict() for s in items]
+        last_key = items.last_evaluated_key
+        return entries, last_key["item_id"]["S"] if last_key else None
+
+    def get_stdout_since(self, cursor: dict, limit=STREAM_PAGE_SIZE, skip_gaps=False):
+        """Get up to `limit` serialised stdout entries newer than the cursor
+
+        `cursor` is {} at first, and then as returned by the previous call.
+        Returns the entries, the new cursor, and whether there are no more
+        entries yet.
+
+        The cursor holds the number of the last entry returned from each thread
+        (keyed by thread ID as a string, for JSON). Each poll makes a query
+        from there up to the next thread in the cursor, which also finds the
+        entries of new threads in between, plus one for any before the first.
+
+        Entries can be written out of order (numbers are reserved before
+        writing), so only entries following on from a thread's cursor are
+        returned. A gap is skipped once it has been open for
+        STREAM_GAP_TIMEOUT, or if skip_gaps (eg the session has finished, so it
+        won't be filled).
+        """
+        self._write_output()
+        seqs = dict(cursor.get("seq", {}))
+        gaps = dict(cursor.get("gap_since", {}))
+        # In item_id order. A thread's prefix sorts after the entries of every
+        # thread before it, and before its own entries.
+        known = sorted(seqs, key=lambda vmid: f"{vmid}:")
+        lows = [f"{STDOUT}:"]
+        lows += [self._stream_key(STDOUT, vmid, seqs[vmid] + 1) for vmid in known]
+        highs = [f"{STDOUT}:{vmid}:" for vmid in known] + [f"{STDOUT};"]
+        entries = []
+        caught_up = True
+        for low, high in zip(lows, highs):
+            if len(entries) >= limit:
+                caught_up = False
+                break
+            items = self.SI.query(
+                self.session_id,
+                self.SI.item_id.between(low, high),
+                consistent_read=True,
+                limit=limit - len(entries),
+                page_size=STREAM_PAGE_SIZE,
+            )
+            at_gap = set()
+            for s in items:
+                _, vmid, seq = s.item_id.split(":")
+                if vmid in at_gap:
+                    continue
+                seq, last = int(seq), seqs.get(vmid, 0)
+                if seq != last + 1:
+                    now = time.time()
+                    gap_since = gaps.setdefault(vmid, now)
+                    if not skip_gaps and now - gap_since < STREAM_GAP_TIMEOUT:
+                        at_gap.add(vmid)
+                        caught_up = False
+                        continue
+                    LOG.warning(
+                        "Skipping missing stdout %d to %d of thread %s",
+                        last + 1,
+                        seq - 1,
+                        vmid,
+                    )
+                entries.append(s.stdout.as_dict())
+                seqs[vmid] = seq
+                gaps.pop(vmid, None)
+            if items.last_evaluated_key is not None:
+                caught_up = False
+        return entries, dict(seq=seqs, gap_since=gaps), caught_up
 
     ## futures
 
@@ -263,45 +592,177 @@ class DataController(Controller):
         return s.future
 
     def set_future(self, vmid, future: fut.Future):
-        s = self._qry(FUTURE, vmid)
-        s.future = future
-        s.save()
+        SI = self.SI
+        actions = [
+            SI.future.resolved.set(future.resolved),
+            SI.future.continuations.set(future.continuations),
+            SI.future.gathers.set(future.gathers),
+            # Bump the version, so that concurrent versioned updates try again
+            SI.version.add(1),
+        ]
+        for attr, value in [
+            (SI.future.value, future.value),
+            (SI.future.chain, future.chain),
+        ]:
+            actions.append(attr.remove() if value is None else attr.set(value))
+        self._item(FUTURE, vmid).update(actions=actions)
 
     def add_continuation(self, fut_ptr, vmid):
-        s = self._qry(FUTURE, fut_ptr)
-        s.update(
-            actions=[
-                self.SI.future.continuations.set(
-                    self.SI.future.continuations.append([vmid])
-                )
-            ]
-        )
+        SI = self.SI
+        action = SI.future.continuations.set(SI.future.continuations.append([vmid]))
+        self._item(FUTURE, fut_ptr).update(actions=[action])
 
     def set_future_chain(self, fut_ptr, chain):
-        s = self._qry(FUTURE, fut_ptr)
-        s.update(actions=[self.SI.future.chain.set(chain)])
+        self._item(FUTURE, fut_ptr).update(actions=[self.SI.future.chain.set(chain)])
 
     def lock_future(self, ptr):
-        return self._lock_item(FUTURE, ptr)
+        # Futures are changed with conditional writes instead (see below)
+        return contextlib.nullcontext()
+
+    def resolve_future(self, vmid, value):
+        """Resolve a machine future, and any dependent futures"""
+        if isinstance(value, mt.TlFuturePtr):
+            raise TypeError(value)
+        SI = self.SI
+
+        def _resolve():
+            # Conditional on the version, so continuations added (or a chain
+            # set) since reading the future make this fail and try again.
+            s = self._qry(FUTURE, vmid)
+            future = s.future
+            actions = [
+                SI.future.resolved.set(True),
+                SI.future.value.set(value),
+                # The waiters are continued now - readers only need the value
+                SI.future.continuations.set([]),
+                SI.future.gathers.set([]),
+            ]
+            if not self.is_top_level(vmid):
+                db.versioned_update(s, actions)
+                return future
+            with db.transaction() as t:
+                t.update(
+                    s, actions + [SI.version.add(1)], condition=db.version_condition(s)
+                )
+                t.update(
+                    self._item(META), [SI.meta.result.set(mt.to_py_type(value))]
+                )
+            return future
+
+        future = db.retry("resolve_future", _resolve)
+        continuations = future.continuations + self._ready_gathers(future.gathers)
+        if future.chain is not None:
+            continuations += self.resolve_future(future.chain, value)
+
+        LOG.info("Resolved %s to %s. Continuations: %s", vmid, value, continuations)
+        return continuations
+
+    def _unless_resolved(self, future_id, action) -> bool:
+        """Update a future unless it has resolved. Return whether it was updated."""
+        s = self._item(FUTURE, future_id)
+        try:
+            db.conditional_update(
+                s, [action, self.SI.version.add(1)], self.SI.future.resolved == False
+            )
+        except db.Conflict:
+            return False
+        return True
+
+    def add_gather(self, future_id, vmid) -> bool:
+        SI = self.SI
+        action = SI.future.gathers.set(SI.future.gathers.append([vmid]))
+        return self._unless_resolved(future_id, action)
+
+    def add_pending(self, vmid, delta) -> int:
+        s = self._item(THREAD, vmid)
+        s.update(actions=[self.SI.pending.add(delta)])
+        return s.pending
+
+    def stop_gathering(self, vmid) -> bool:
+        SI = self.SI
+        # The pending count is in the THREAD item too, so this is atomic
+        try:
+            db.conditional_update(
+                self._item(THREAD, vmid),
+                [SI.stopped.set(True), SI.pending.add(-1)],
+                SI.pending > 1,
+            )
+        except db.Conflict:
+            self.add_pending(vmid, -1)
+            return False
+        # Counted as running until now, so the count only reaches zero once this
+        # thread has stopped, even if it has been continued already
+        self._count_running(vmid, -1)
+        return True
+
+    def get_futures(self, ids) -> list:
+        keys = {f"{FUTURE}:{i}": i for i in ids}
+        items = self.SI.batch_get(
+            [(self.session_id, key) for key in keys], consistent_read=True
+        )
+        futures = {keys[s.item_id]: s.future for s in items}
+        try:
+            return [futures[i] for i in ids]
+        except KeyError as exc:
+            raise ControllerError(
+                f"Future {exc} does not exist in {self.session_id}"
+            ) from exc
+
+    def chain_future(self, future_id, vmid):
+        SI = self.SI
+        if self._unless_resolved(future_id, SI.future.chain.set(vmid)):
+            LOG.info("Chaining %s to %s", vmid, future_id)
+            return False, None
+        return True, self.get_future(future_id).value
+
+    def get_or_wait(self, vmid, future_ptr):
+        if not isinstance(future_ptr, mt.TlFuturePtr):
+            raise TypeError(future_ptr)
+
+        if type(vmid) is not int:
+            raise TypeError(vmid)
+
+        SI = self.SI
+        action = SI.future.continuations.set(SI.future.continuations.append([vmid]))
+        if self._unless_resolved(future_ptr.vmid, action):
+            LOG.info("%d waiting on %s", vmid, future_ptr)
+            return False, None
+        value = self.get_future(future_ptr.vmid).value
+        LOG.info("%s has resolved: %s", future_ptr, value)
+        return True, value
 
     ## stdout
 
-    def get_stdout(self):
-        s = self._qry(STDOUT)
-        return [StdoutItem.deserialise(item) for item in s.stdout]
+    def get_stdout(self, after=None):
+        self._write_output()
+        for s in self._stream(STDOUT, after):
+            yield StdoutItem.deserialise(s.stdout.as_dict())
 
     def write_stdout(self, item):
         # Avoid empty strings (DynamoDB can't handle them)
-        if item.text:
-            sys.stdout.write(item.text)
-            s = self._qry(STDOUT)
-            s.update(
-                actions=[self.SI.stdout.set(self.SI.stdout.append([item.serialise()]))]
-            )
+        if not item.text:
+            return
+        sys.stdout.write(item.text)
+        with self._buffer_lock:
+            buffered = self._output.setdefault(item.thread, [])
+            buffered.append(item)
+            due = len(buffered) >= OUTPUT_BATCH_SIZE
+        if due:
+            self._write_output(item.thread)
+
+    def _write_output(self, vmid=None):
+        """Write the buffered stdout items of a thread, or all (see write_stdout)"""
+        with self._buffer_lock:
+            if vmid is None:
+                output, self._output = self._output, {}
+            else:
+                output = {vmid: self._output.pop(vmid, [])}
+        for vmid, items in output.items():
+            self._write_stream(STDOUT, vmid, items)
 
     @property  # Legacy. TODO: remove
     def stdout(self):
-        return self.get_stdout()
+        return list(self.get_stdout())
 
     ## plugin API
 
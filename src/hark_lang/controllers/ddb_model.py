@@ -1,18 +1,20 @@
 """DB interaction layer for AWS"""
 
 import base64
-import dataclasses
+import hashlib
 import logging
 import os
+import random
 import threading
 import time
 import uuid
-from contextlib import AbstractContextManager
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List
+from typing import Callable, List, Optional
 
-from botocore.exceptions import ClientError
 from pynamodb.attributes import (
+    Attribute,
     BooleanAttribute,
     JSONAttribute,
     ListAttribute,
@@ -21,13 +23,21 @@ from pynamodb.attributes import (
     UnicodeAttribute,
     UTCDateTimeAttribute,
 )
-from pynamodb.exceptions import UpdateError, TableDoesNotExist
+from pynamodb.constants import BINARY, STRING_SHORT
+from pynamodb.connection import Connection
+from pynamodb.exceptions import (
+    PynamoDBException,
+    TableDoesNotExist,
+    TransactWriteError,
+    UpdateError,
+)
 from pynamodb.models import Model
+from pynamodb.transactions import TransactGet, TransactWrite
 
 from ..exceptions import HarkError
+from ..machine import codec
 from ..machine.arec import ActivationRecord
 from ..machine.future import Future
-from ..machine.state import State
 
 LOG = logging.getLogger(__name__)
 
@@ -53,62 +63,143 @@ AREC = "arec"
 STATE = "state"
 PLOGS = "plogs"
 PEVENTS = "pevents"
-STDOUT = "stdout"
+STDOUT = "stdout"  # stdout, plogs and pevents have an item per entry
+THREAD = "thread"
+RUNNING = "running"
+
+# The count of running threads is split over this many items (see new_session)
+RUNNING_SHARDS = 8
+
+
+class HarkDataAttribute(Attribute):
+    """Hark machine data (a State, Tl value, slots, etc), encoded by the codec
+
+    See machine/codec.py.
+    """
+
+    attr_type = BINARY
+
+    def serialize(self, value):
+        return codec.get_codec().encode(value)
+
+    def deserialize(self, value):
+        return codec.decode(raw_bytes(value))
+
+
+def raw_bytes(value) -> bytes:
+    """Get stored binary data as bytes
+
+    pynamodb only decodes top-level binary attributes - nested ones (e.g. in a
+    MapAttribute) are read as the base64 string sent over the wire.
+    """
+    return base64.b64decode(value) if isinstance(value, str) else value
+
+
+# Deserialised executables, by content hash (see MetaAttribute). Executables
+# never change once stored, and every invocation in a session loads the same
+# one. So they (and the code and foreign functions the machine links to them)
+# are kept for the life of the process, and warm Lambda containers don't fetch
+# or decode the program again.
+_EXECUTABLES = OrderedDict()
+_EXECUTABLES_LOCK = threading.Lock()
+MAX_CACHED_EXECUTABLES = 16
+
+
+def content_hash(value: bytes) -> str:
+    """Hash stored (raw) attribute data"""
+    return hashlib.sha256(value).hexdigest()
+
+
+def executable_hash(exe) -> str:
+    """Get the content hash to store with an executable"""
+    return content_hash(codec.get_codec().encode(exe))
+
+
+def cached_executable(digest: Optional[str]):
+    """Get a deserialised executable by content hash, if it's cached"""
+    with _EXECUTABLES_LOCK:
+        exe = _EXECUTABLES.get(digest)
+        if exe is not None:
+            _EXECUTABLES.move_to_end(digest)
+        return exe
+
+
+def cache_executable(digest: str, exe):
+    """Cache a deserialised executable, returning the cached one"""
+    with _EXECUTABLES_LOCK:
+        exe = _EXECUTABLES.setdefault(digest, exe)
+        _EXECUTABLES.move_to_end(digest)
+        while len(_EXECUTABLES) > MAX_CACHED_EXECUTABLES:
+            _EXECUTABLES.popitem(last=False)
+        return exe
+
+
+def _fields_dict(obj) -> dict:
+    # NOTE: Not serialise(), which converts the values too
+    return {name: getattr(obj, name) for name in obj.__slots__}
 
 
 class FutureAttribute(MapAttribute):
     resolved = BooleanAttribute(default=False)
     continuations = ListAttribute(default=list)
     chain = NumberAttribute(null=True)
-    value = JSONAttribute(null=True)
+    value = HarkDataAttribute(null=True)
+    gathers = ListAttribute(default=list)
 
     def serialize(self, value):
-        return super().serialize(value.serialise())
+        return super().serialize(
+            dict(
+                resolved=value.resolved,
+                continuations=value.continuations,
+                chain=value.chain,
+                value=value.value,
+                gathers=value.gathers,
+            )
+        )
 
     def deserialize(self, value):
-        return Future.deserialise(super().deserialize(value).as_dict())
+        return Future(**super().deserialize(value).as_dict())
 
 
 class ARecAttribute(MapAttribute):
     ref_count = NumberAttribute()
-    function = ListAttribute(null=True)
+    function = HarkDataAttribute(null=True)
     dynamic_chain = NumberAttribute(null=True)
     vmid = NumberAttribute(null=True)
     call_site = NumberAttribute(null=True)
-    bindings = MapAttribute(default=dict)
+    bindings = HarkDataAttribute(default=list)
     deleted = BooleanAttribute(default=False)
 
     def serialize(self, value):
-        return super().serialize(value.serialise())
+        return super().serialize(_fields_dict(value))
 
     def deserialize(self, value):
-        return ActivationRecord.deserialise(super().deserialize(value).as_dict())
+        return ActivationRecord(**super().deserialize(value).as_dict())
 
 
 class MetaAttribute(MapAttribute):
+    # The next thread and arec IDs to lease out (see DataController._new_id)
     num_threads = NumberAttribute(default=0)
     num_arecs = NumberAttribute(default=0)
     entrypoint = UnicodeAttribute(null=True)
-    stopped = ListAttribute(default=list)
-    exe = MapAttribute(null=True)
+    exe = HarkDataAttribute(null=True)
+    exe_hash = UnicodeAttribute(null=True)  # executable_hash(exe)
     result = JSONAttribute(null=True)
     broken = BooleanAttribute(default=False)
-
-
-class HarkDataAttribute(JSONAttribute):
-    """General purpose JSON-able Hark type"""
-
-    value_cls = None
-
-    def serialize(self, value):
-        return super().serialize(value.serialise())
-
-    def deserialize(self, value):
-        return self.value_cls.deserialise(super().deserialize(value))
-
-
-class StateAttribute(HarkDataAttribute):
-    value_cls = State
+    probe_mode = UnicodeAttribute(null=True)
+
+    def deserialize(self, values):
+        # Don't decode the executable if it's already been loaded
+        digest = values.get("exe_hash", {}).get(STRING_SHORT)
+        exe = cached_executable(digest)
+        if exe is not None:
+            values = {k: v for k, v in values.items() if k != "exe"}
+        meta = super().deserialize(values)
+        if exe is not None:
+            meta.exe = exe
+        elif digest is not None and meta.exe is not None:
+            meta.exe = cache_executable(digest, meta.exe)
+        return meta
 
 
 class SessionItem(Model):
@@ -119,7 +210,7 @@ class SessionItem(Model):
 
     session_id = UnicodeAttribute(hash_key=True)
     item_id = UnicodeAttribute(range_key=True)
-    locked = BooleanAttribute(default=False)
+    version = NumberAttribute(null=True)  # see versioned_update
     # TODO create LSI on created_at
     created_at = UTCDateTimeAttribute()
     updated_at = UTCDateTimeAttribute()
@@ -129,22 +220,51 @@ class SessionItem(Model):
     new_session_record = UnicodeAttribute(null=True)
     plugin_future_session = UnicodeAttribute(null=True)
     meta = MetaAttribute(null=True)
-    stdout = ListAttribute(null=True)
-    plogs = ListAttribute(null=True)
-    pevents = ListAttribute(null=True)
+    stdout = MapAttribute(null=True)
+    stopped = BooleanAttribute(null=True)
+    pending = NumberAttribute(null=True)
+    running = NumberAttribute(null=True)
+    # Entry counters of a thread's streams, kept in its THREAD item
+    stdout_seq = NumberAttribute(null=True)
+    plogs_seq = NumberAttribute(null=True)
+    pevents_seq = NumberAttribute(null=True)
+    plogs = MapAttribute(null=True)
+    pevents = MapAttribute(null=True)
     arec = ARecAttribute(null=True)
     future = FutureAttribute(null=True)
-    state = StateAttribute(null=True)
+    state = HarkDataAttribute(null=True)
 
 
 ###
 
 
+# What get_meta reads first - everything but the executable is loaded lazily
+META_SUMMARY = ["session_id", "item_id", "meta.probe_mode", "meta.exe_hash"]
+
+
+def get_meta(session_id, cls=SessionItem) -> SessionItem:
+    """Get the META item of a session, for loading a controller
+
+    Only the attributes in META_SUMMARY are read, and the executable is only
+    fetched if it isn't already cached (see MetaAttribute).
+    """
+    s = cls.get(
+        session_id, META, consistent_read=True, attributes_to_get=META_SUMMARY
+    )
+    if s.meta is None:  # None of the meta attributes have been set
+        s.meta = MetaAttribute()
+    exe = cached_executable(s.meta.exe_hash)
+    if exe is None and s.meta.exe_hash is not None:
+        return cls.get(session_id, META, consistent_read=True)
+    s.meta.exe = exe
+    return s
+
+
 def init_base_session() -> SessionItem:
     LOG.info("DB %s (%s)", SessionItem.Meta.host, SessionItem.Meta.region)
     LOG.info("DB table %s", SessionItem.Meta.table_name)
     try:
-        s = SessionItem.get(BASE_SESSION_HASH_KEY, META)
+        s = get_meta(BASE_SESSION_HASH_KEY)
     except SessionItem.DoesNotExist as exc:
         LOG.info("Creating base session")
         s = SessionItem(
@@ -161,7 +281,8 @@ def init_base_session() -> SessionItem:
 
 def set_base_exe(exe):
     base_session = SessionItem.get(BASE_SESSION_HASH_KEY, META)
-    base_session.meta.exe = exe.serialise()
+    base_session.meta.exe = exe
+    base_session.meta.exe_hash = executable_hash(exe)
     base_session.save()
 
 
@@ -180,17 +301,17 @@ def new_session_item(sid, item_id, **extra) -> SessionItem:
     )
 
 
-def new_session() -> SessionItem:
+def new_session(probe_mode=None) -> SessionItem:
     """Create a new session, returning the 'meta' item for it"""
     base_session = SessionItem.get(BASE_SESSION_HASH_KEY, META)
     sid = str(uuid.uuid4())
 
-    s = new_session_item(sid, META, meta=MetaAttribute())
+    s = new_session_item(sid, META, meta=MetaAttribute(probe_mode=probe_mode))
     s.save()
-    # Create the empty placeholders for the collections
-    new_session_item(sid, PLOGS, plogs=[]).save()
-    new_session_item(sid, PEVENTS, pevents=[]).save()
-    new_session_item(sid, STDOUT, stdout=[]).save()
+    # Threads start and stop very often, so don't count them in one hot item
+    with SessionItem.batch_write() as batch:
+        for shard in range(RUNNING_SHARDS):
+            batch.save(new_session_item(sid, f"{RUNNING}:{shard}", running=0))
 
     # Record the new session for cheap retrieval later
     SessionItem(
@@ -224,82 +345,116 @@ def list_sessions(cls=SessionItem) -> List[str]:
 ###
 
 
-def try_lock(session, thread_lock) -> bool:
-    """Try to acquire a lock on an item, returning True if successful"""
-    if not thread_lock.acquire(blocking=False):
-        return False
+# Optimistic concurrency: items that several threads write (futures) have
+# a version number, bumped by writes that change what other writers read. Writes
+# that depend on what was read are conditional on the version being unchanged,
+# and retried (after reading the item again) if it has changed.
+
+# Retry backoff bounds (seconds), and the maximum number of attempts
+RETRY_MIN_DELAY = 0.005
+RETRY_MAX_DELAY = 0.5
+RETRY_MAX_ATTEMPTS = 12
+
+# Contention metrics: number of attempts and of conflicts, by operation
+ATTEMPTS = Counter()
+CONFLICTS = Counter()
+
+_CONFLICT_CODES = (
+    "ConditionalCheckFailedException",
+    "TransactionCanceledException",
+    "TransactionConflictException",
+)
+
+
+class Conflict(HarkError):
+    """A conditional write failed - the item was changed by someone else"""
+
+
+def is_conflict(exc: PynamoDBException) -> bool:
+    return exc.cause_response_code in _CONFLICT_CODES
 
+
+def version_condition(item: SessionItem):
+    """Condition that item hasn't been written since it was read"""
+    if item.version is None:
+        return SessionItem.version.does_not_exist()
+    return SessionItem.version == item.version
+
+
+def conditional_update(item: SessionItem, actions: list, condition):
+    """Update item if condition holds, raising Conflict if it doesn't"""
     try:
-        session.update(
-            [SessionItem.locked.set(True)], condition=(SessionItem.locked == False)
-        )
-        return True
-
-    except UpdateError as e:
-        thread_lock.release()
-        if isinstance(e.cause, ClientError):
-            code = e.cause.response["Error"].get("Code")
-            LOG.info("Failed to lock: %s", code)
-            if code == "ConditionalCheckFailedException":
-                return False
-            raise
+        item.update(actions=actions, condition=condition)
+    except UpdateError as exc:
+        if is_conflict(exc):
+            raise Conflict(str(item.item_id)) from exc
         raise
 
 
-class LockTimeout(HarkError):
-    """Timeout trying to lock item"""
+def versioned_update(item: SessionItem, actions: list):
+    """Update item if it hasn't changed since it was read, bumping the version
 
+    Raises Conflict if it has changed.
+    """
+    actions = actions + [SessionItem.version.add(1)]
+    conditional_update(item, actions, version_condition(item))
 
-class SessionLocker(AbstractContextManager):
-    """Lock an item for modification (re-entrant for chain_resolve)
 
-    https://docs.python.org/3/library/contextlib.html#reentrant-context-managers
-    """
+_connection = None
+
 
-    def __init__(self, session, timeout=2.0):
-        self.session = session
-        self.timeout = timeout
-        self._thread_lock = threading.Lock()
-        self.lock_count = {}
-
-    def __enter__(self):
-        tid = threading.get_native_id()
-
-        # re-lock if this thread has already got one lock
-        if self._thread_lock.locked() and self.lock_count.get(tid, 0) > 0:
-            t = time.time() % 1000.0
-            self.lock_count[tid] += 1
-            LOG.debug(f"{t:.3f} :: acquire re-entrant %d", self.lock_count[tid])
-            return
-
-        start = time.time()
-        while not try_lock(self.session, self._thread_lock):
-            time.sleep(0.01)
-            if time.time() - start > self.timeout:
-                t = time.time() % 1000.0
-                LOG.debug(f"{t:.3f} :: Timeout getting lock")
-                raise LockTimeout
-
-        self.lock_count[tid] = 1
-
-        t = time.time() % 1000.0
-        LOG.debug(f"{t:.3f} :: Thread {tid} Locked %s", self.session)
-
-    def __exit__(self, *exc):
-        """Release the lock"""
-        tid = threading.get_native_id()
-
-        if self._thread_lock.locked() and self.lock_count.get(tid, 0) > 1:
-            self.lock_count[tid] -= 1
-            t = time.time() % 1000.0
-            LOG.debug(f"{t:.3f} :: release re-entrant %d", self.lock_count[tid])
-            return
-
-        self.lock_count[tid] -= 1
-        assert self.lock_count[tid] == 0
-
-        LOG.debug(f"%d :: Releasing %s...", time.time() % 1000.0, self.session)
-        self.session.update(
-            [SessionItem.locked.set(False)], condition=(SessionItem.locked == True)
+def _get_connection() -> Connection:
+    """Get a connection for transactions"""
+    global _connection
+    if _connection is None:
+        _connection = Connection(
+            region=SessionItem.Meta.region, host=SessionItem.Meta.host
         )
-        self._thread_lock.release()
+    return _connection
+
+
+@contextmanager
+def transaction():
+    """Write several items atomically (TransactWriteItems)
+
+    Raises Conflict if any of the conditions fail.
+    """
+    try:
+        with TransactWrite(connection=_get_connection()) as t:
+            yield t
+    except TransactWriteError as exc:
+        if is_conflict(exc):
+            raise Conflict("transaction") from exc
+        raise
+
+
+def retry(name: str, fn: Callable):
+    """Call fn until it doesn't raise Conflict, backing off exponentially
+
+    Raises Conflict if it still does after RETRY_MAX_ATTEMPTS.
+    """
+    delay = RETRY_MIN_DELAY
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        ATTEMPTS[name] += 1
+        try:
+            return fn()
+        except Conflict:
+            CONFLICTS[name] += 1
+            LOG.debug("%s: conflict on attempt %d", name, attempt + 1)
+            # "Full jitter" - spread out the retries of competing writers
+            time.sleep(random.uniform(0, delay))
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+    LOG.warning("%s: giving up after %d conflicts", name, RETRY_MAX_ATTEMPTS)
+    raise Conflict(f"Too much contention in {name}")
+
+
+def contention_stats() -> dict:
+    """Get {operation: (attempts, conflicts)} for this process"""
+    return {name: (ATTEMPTS[name], CONFLICTS[name]) for name in ATTEMPTS}
+
+
+def get_consistent(keys: list, cls=SessionItem) -> List[SessionItem]:
+    """Read up to 100 items as of a single point in time (TransactGetItems)"""
+    with TransactGet(connection=_get_connection()) as t:
+        futures = [t.get(cls, hash_key, range_key) for hash_key, range_key in keys]
+    return [f.get() for f in futures]
@@ -15,21 +15,24 @@ LOG = logging.getLogger(__name__)
 
 
 class DataController(Controller):
-    def __init__(self):
+    def __init__(self, probe_mode=None):
         self._machine_future = {}
         self._machine_state = {}
-        self._machine_stopped = {}
+        self._machine_running = set()
+        self._machine_pending = {}
         self._machine_idx = 0  # always increasing machine counter
         self._arec_idx = 0  # always increasing arec counter
         self._probe_logs = []
         self._probe_events = []
         self._arecs = {}
         self._lock = threading.RLock()
+        self._stopped_changed = threading.Condition(self._lock)
         self.session_id = 0  # constant for local
         self.executable = None
         self.stdout = []  # shared standard output
         self.broken = False
         self.result = None
+        self.probe_mode = probe_mode
 
     def set_executable(self, exe):
         self.executable = exe
@@ -54,10 +57,35 @@ class DataController(Controller):
         return vmid == 0
 
     def all_stopped(self):
-        return all(self._machine_stopped.values())
+        return not self._machine_running
 
     def set_stopped(self, vmid, stopped: bool):
-        self._machine_stopped[vmid] = stopped
+        with self._stopped_changed:
+            if stopped:
+                self._machine_running.discard(vmid)
+                self._stopped_changed.notify_all()
+            else:
+                self._machine_running.add(vmid)
+
+    def add_pending(self, vmid, delta) -> int:
+        with self._lock:
+            pending = self._machine_pending.get(vmid, 0) + delta
+            if pending:
+                self._machine_pending[vmid] = pending
+            else:
+                self._machine_pending.pop(vmid, None)
+            return pending
+
+    def stop_gathering(self, vmid) -> bool:
+        with self._lock:
+            if self.add_pending(vmid, -1) == 0:
+                return False
+            self.set_stopped(vmid, True)
+            return True
+
+    def wait_finished(self, timeout=None, poll_interval=None) -> bool:
+        with self._stopped_changed:
+            return self._stopped_changed.wait_for(self.all_stopped, timeout)
 
     def get_state(self, vmid):
         return self._machine_state[vmid]
@@ -87,7 +115,7 @@ class DataController(Controller):
         return self._arecs[ptr]
 
     def delete_arec(self, ptr):
-        self._arecs[ptr].deleted = True
+        del self._arecs[ptr]
 
     def lock_arec(self, _):
         return self._lock
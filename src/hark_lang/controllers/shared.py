@@ -0,0 +1,486 @@
+"""Shared memory storage, for running threads in several local processes
+
+Session data lives in a server process (a multiprocessing manager), which
+every process using the session connects to. Controllers call methods on the
+session held by the server (see SharedSession), each of which is done
+atomically - the server serves each connection in its own thread, and takes the
+lock for the item being changed (items are spread over LOCK_STRIPES locks). So
+there's no locking in the controller: e.g. resolving a future and taking its
+list of waiting threads is one call.
+
+Machine data is encoded by the codec (see machine/codec.py) before being sent
+to the server, which only stores it.
+
+The server is started by the first session created in a process, and stops when
+that process exits. Sessions are freed by DataController.close, and aren't
+durable - see controllers/sqlite.py for that.
+"""
+import contextlib
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import uuid
+from multiprocessing.managers import BaseManager, RemoteError
+from typing import List, Tuple
+
+from ..machine import codec
+from ..machine import types as mt
+from ..machine.controller import Controller, ControllerError
+from ..machine.future import Future
+from ..machine.probe import ProbeEvent, ProbeLog
+from ..machine.stdout_item import StdoutItem
+
+LOG = logging.getLogger(__name__)
+
+# Number of locks that the items of a session are spread over
+LOCK_STRIPES = 64
+
+
+class SharedSession:
+    """The data of a session, in the server process
+
+    Machine data (states, arecs, future values, the executable) is stored as
+    encoded by the controller.
+    """
+
+    def __init__(self, session_id, probe_mode=None):
+        self.session_id = session_id
+        self.probe_mode = probe_mode
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._meta_lock = threading.Lock()
+        self._meta = dict(exe=None, entrypoint=None, result=None, broken=False)
+        self._counters = dict(num_threads=0, num_arecs=0)
+        self._states = {}
+        self._running = set()
+        self._pending = {}
+        self._arecs = {}  # ptr -> [data, ref_count]
+        self._futures = {}  # vmid -> dict, see set_future
+        self._streams = dict(stdout=[], probe_logs=[], probe_events=[])
+
+    def _lock(self, key):
+        return self._locks[hash(key) % LOCK_STRIPES]
+
+    def get_probe_mode(self):
+        return self.probe_mode
+
+    def get_meta(self, name):
+        return self._meta[name]
+
+    def set_meta(self, name, value):
+        self._meta[name] = value
+
+    def new_ids(self, counter, count) -> list:
+        with self._meta_lock:
+            start = self._counters[counter]
+            self._counters[counter] = start + count
+        return list(range(start, start + count))
+
+    ## threads
+
+    def get_thread_ids(self) -> list:
+        return list(range(self._counters["num_threads"]))
+
+    def get_state(self, vmid):
+        return self._states[vmid]
+
+    def set_state(self, vmid, data):
+        self._states[vmid] = data
+
+    def all_stopped(self) -> bool:
+        return not self._running
+
+    def set_stopped(self, vmid, stopped):
+        with self._meta_lock:
+            if stopped:
+                self._running.discard(vmid)
+            else:
+                self._running.add(vmid)
+
+    def add_pending(self, vmid, delta) -> int:
+        with self._lock(("thread", vmid)):
+            pending = self._pending.get(vmid, 0) + delta
+            if pending:
+                self._pending[vmid] = pending
+            else:
+                self._pending.pop(vmid, None)
+            return pending
+
+    def stop_gathering(self, vmid) -> bool:
+        with self._lock(("thread", vmid)):
+            if self._pending[vmid] == 1:
+                del self._pending[vmid]
+                return False
+            self._pending[vmid] -= 1
+            self.set_stopped(vmid, True)
+            return True
+
+    ## arecs
+
+    def set_arec(self, ptr, data, ref_count):
+        with self._lock(("arec", ptr)):
+            self._arecs[ptr] = [data, ref_count]
+
+    def get_arec(self, ptr) -> tuple:
+        data, ref_count = self._arecs[ptr]
+        return data, ref_count
+
+    def update_ref(self, ptr, delta) -> tuple:
+        with self._lock(("arec", ptr)):
+            rec = self._arecs[ptr]
+            rec[1] += delta
+            return rec[0], rec[1]
+
+    def delete_arec(self, ptr):
+        with self._lock(("arec", ptr)):
+            self._arecs.pop(ptr, None)
+
+    ## futures
+
+    def get_future(self, vmid) -> dict:
+        with self._lock(("future", vmid)):
+            return dict(self._futures[vmid])
+
+    def get_futures(self, ids) -> list:
+        return [self.get_future(i) for i in ids]
+
+    def set_future(self, vmid, future: dict):
+        """future: dict of resolved, value, chain, continuations and gathers"""
+        with self._lock(("future", vmid)):
+            self._futures[vmid] = future
+
+    def add_waiter(self, vmid, kind, waiter) -> bool:
+        """Add waiter to the continuations or gathers (kind) of a future, or set
+        the chain (kind="chain") to it, unless the future has resolved"""
+        with self._lock(("future", vmid)):
+            future = self._futures[vmid]
+            if future["resolved"]:
+                return False
+            if kind == "chain":
+                future["chain"] = waiter
+            else:
+                future[kind] = future[kind] + [waiter]
+            return True
+
+    def resolve(self, vmid, value) -> dict:
+        """Resolve a future, returning it as it was (with its waiters)"""
+        with self._lock(("future", vmid)):
+            future = self._futures[vmid]
+            # The waiters are continued now - readers only need the value
+            self._futures[vmid] = dict(
+                future, resolved=True, value=value, continuations=[], gathers=[]
+            )
+            return future
+
+    ## stdout and probes
+
+    def append(self, stream, entries):
+        self._streams[stream].extend(entries)
+
+    def get_stream(self, stream) -> list:
+        return list(self._streams[stream])
+
+    def close(self):
+        """Free the session. Proxies may outlive it, so empty it too."""
+        _SESSIONS.pop(self.session_id, None)
+        for data in [
+            self._states,
+            self._running,
+            self._pending,
+            self._arecs,
+            self._futures,
+            *self._streams.values(),
+        ]:
+            data.clear()
+        self._meta["exe"] = None
+
+
+# Sessions in the server process, until they're closed. Proxies don't keep them
+# alive - the session has to outlive all the processes using it.
+_SESSIONS = {}
+
+
+def _new_session(session_id, probe_mode):
+    _SESSIONS[session_id] = SharedSession(session_id, probe_mode)
+    return _SESSIONS[session_id]
+
+
+def _get_session(session_id):
+    return _SESSIONS[session_id]
+
+
+class SessionManager(BaseManager):
+    pass
+
+
+SessionManager.register("new_session", _new_session)
+SessionManager.register("get_session", _get_session)
+
+
+# The server started by this process, and its authentication key
+_server = None
+_server_authkey = None
+_server_lock = threading.Lock()
+
+
+def get_server() -> Tuple[SessionManager, bytes]:
+    """Get this process's server and its key, starting the server if necessary"""
+    global _server, _server_authkey
+    with _server_lock:
+        if _server is None:
+            _server_authkey = os.urandom(32)
+            # Spawned, like the multiprocess executor's workers
+            _server = SessionManager(
+                authkey=_server_authkey, ctx=multiprocessing.get_context("spawn")
+            )
+            _server.start()
+            LOG.info("Started session server at %s", _server.address)
+        return _server, _server_authkey
+
+
+def _encode(value):
+    return None if value is None else codec.get_codec().encode(value)
+
+
+def _decode(data):
+    return None if data is None else codec.decode(data)
+
+
+class DataController(Controller):
+    @classmethod
+    def with_new_session(cls, probe_mode=None):
+        """Create a data controller for a new session, in this process's server"""
+        server, authkey = get_server()
+        session_id = str(uuid.uuid4())
+        session = server.new_session(session_id, probe_mode)
+        LOG.info("Created new session, %s", session_id)
+        return cls(session_id, session, server.address, authkey)
+
+    @classmethod
+    def with_session_id(cls, session_id: str, address, authkey: bytes):
+        """Connect to a session in a (possibly another process's) server"""
+        manager = SessionManager(address, authkey)
+        manager.connect()
+        try:
+            session = manager.get_session(session_id)
+        except RemoteError:
+            # The server's exception is only available as text
+            raise ControllerError(f"Session {session_id} does not exist") from None
+        LOG.info("Connected to session %s", session_id)
+        return cls(session_id, session, address, authkey)
+
+    def __init__(self, session_id, session, address, authkey):
+        self.session_id = session_id
+        self._session = session
+        self._address = address
+        self._authkey = authkey
+        self.probe_mode = session.get_probe_mode()
+        # It's allowed to initialise a controller with no executable, as long
+        # as the user calls set_executable before creating a machine.
+        self.executable = _decode(session.get_meta("exe"))
+
+    @property
+    def open_args(self):
+        return (type(self), self.session_id, self._address, self._authkey)
+
+    def close(self):
+        """Free the session in the server - it can't be used after this"""
+        self._session.close()
+        LOG.info("Closed session %s", self.session_id)
+
+    def set_executable(self, exe):
+        self.executable = exe
+        self._session.set_meta("exe", _encode(exe))
+
+    def set_entrypoint(self, fn_name: str):
+        self._session.set_meta("entrypoint", fn_name)
+
+    ## Threads
+
+    def new_thread(self) -> int:
+        (vmid,) = self._session.new_ids("num_threads", 1)
+        return vmid
+
+    def get_thread_ids(self) -> List[int]:
+        return self._session.get_thread_ids()
+
+    def get_top_level_future(self):
+        return self.get_future(0)
+
+    def is_top_level(self, vmid):
+        return vmid == 0
+
+    def all_stopped(self):
+        return self._session.all_stopped()
+
+    def set_stopped(self, vmid, stopped: bool):
+        self._session.set_stopped(vmid, stopped)
+
+    def add_pending(self, vmid, delta) -> int:
+        return self._session.add_pending(vmid, delta)
+
+    def stop_gathering(self, vmid) -> bool:
+        return self._session.stop_gathering(vmid)
+
+    def get_state(self, vmid):
+        return _decode(self._session.get_state(vmid))
+
+    def set_state(self, vmid, state):
+        self._session.set_state(vmid, _encode(state))
+
+    ## controller properties
+
+    @property
+    def broken(self):
+        return self._session.get_meta("broken")
+
+    @broken.setter
+    def broken(self, value):
+        self._session.set_meta("broken", value)
+
+    @property
+    def result(self):
+        return self._session.get_meta("result")
+
+    @result.setter
+    def result(self, value):
+        self._session.set_meta("result", value)
+
+    ## arecs
+
+    def new_arec(self):
+        (ptr,) = self._session.new_ids("num_arecs", 1)
+        return ptr
+
+    def set_arec(self, ptr, rec):
+        self._session.set_arec(ptr, _encode(rec), rec.ref_count)
+
+    @staticmethod
+    def _arec(data, ref_count):
+        rec = _decode(data)
+        # The count is only kept up to date by the server
+        rec.ref_count = ref_count
+        return rec
+
+    def get_arec(self, ptr):
+        return self._arec(*self._session.get_arec(ptr))
+
+    def increment_ref(self, ptr):
+        self._session.update_ref(ptr, 1)
+
+    def decrement_ref(self, ptr):
+        return self._arec(*self._session.update_ref(ptr, -1))
+
+    def delete_arec(self, ptr):
+        self._session.delete_arec(ptr)
+
+    def lock_arec(self, ptr):
+        # Reference counts are changed atomically by the server
+        return contextlib.nullcontext()
+
+    ## probes
+
+    def set_probe_data(self, vmid, probe):
+        if probe.logs:
+            self._session.append("probe_logs", [l.serialise() for l in probe.logs])
+        if probe.events:
+            self._session.append(
+                "probe_events", [e.serialise() for e in probe.events]
+            )
+
+    def get_probe_logs(self):
+        return [ProbeLog(**l) for l in self._session.get_stream("probe_logs")]
+
+    def get_probe_events(self):
+        return [ProbeEvent(**e) for e in self._session.get_stream("probe_events")]
+
+    ## futures
+
+    @staticmethod
+    def _future(data):
+        return Future(**dict(data, value=_decode(data["value"])))
+
+    def get_future(self, vmid):
+        if not isinstance(vmid, int):
+            raise TypeError(vmid)
+        return self._future(self._session.get_future(vmid))
+
+    def get_futures(self, ids) -> list:
+        return [self._future(data) for data in self._session.get_futures(ids)]
+
+    def set_future(self, vmid, future: Future):
+        self._session.set_future(
+            vmid,
+            dict(
+                resolved=future.resolved,
+                value=_encode(future.value),
+                chain=future.chain,
+                continuations=list(future.continuations),
+                gathers=list(future.gathers),
+            ),
+        )
+
+    def add_continuation(self, fut_ptr, vmid):
+        self._session.add_waiter(fut_ptr, "continuations", vmid)
+
+    def set_future_chain(self, fut_ptr, chain):
+        self._session.add_waiter(fut_ptr, "chain", chain)
+
+    def lock_future(self, ptr):
+        # Futures are changed atomically by the server (see below)
+        return contextlib.nullcontext()
+
+    def resolve_future(self, vmid, value):
+        """Resolve a machine future, and any dependent futures"""
+        if isinstance(value, mt.TlFuturePtr):
+            raise TypeError(value)
+
+        future = self._session.resolve(vmid, _encode(value))
+        continuations = future["continuations"] + self._ready_gathers(
+            future["gathers"]
+        )
+        if future["chain"] is not None:
+            continuations += self.resolve_future(future["chain"], value)
+
+        if self.is_top_level(vmid):
+            self.result = mt.to_py_type(value)
+
+        LOG.info("Resolved %d to %s. Continuations: %s", vmid, value, continuations)
+        return continuations
+
+    def add_gather(self, future_id, vmid) -> bool:
+        return self._session.add_waiter(future_id, "gathers", vmid)
+
+    def chain_future(self, future_id, vmid):
+        if self._session.add_waiter(future_id, "chain", vmid):
+            LOG.info("Chaining %s to %s", vmid, future_id)
+            return False, None
+        return True, self.get_future(future_id).value
+
+    def get_or_wait(self, vmid, future_ptr):
+        if not isinstance(future_ptr, mt.TlFuturePtr):
+            raise TypeError(future_ptr)
+
+        if type(vmid) is not int:
+            raise TypeError(vmid)
+
+        if self._session.add_waiter(future_ptr.vmid, "continuations", vmid):
+            LOG.info("%d waiting on %s", vmid, future_ptr)
+            return False, None
+        value = self.get_future(future_ptr.vmid).value
+        LOG.info("%s has resolved: %s", future_ptr, value)
+        return True, value
+
+    ## stdout
+
+    def get_stdout(self):
+        return [StdoutItem(**item) for item in self._session.get_stream("stdout")]
+
+    def write_stdout(self, item):
+        sys.stdout.write(item.text)
+        self._session.append("stdout", [item.serialise()])
+
+    @property  # Legacy. TODO: remove
+    def stdout(self):
+        return self.get_stdout()
@@ -0,0 +1,519 @@
+"""SQLite backed storage, for durable sessions on a single machine
+
+All sessions are stored in one database file, which any number of threads and
+processes can use at once. Each thread (in each process) has its own
+connection. The database is in WAL mode, so reads don't block the writer, and
+the writer doesn't block reads.
+
+Each kind of session data has its own table - threads (with their state),
+activation records, futures (with the threads waiting for them), standard
+output, and probe logs and events. Machine data is encoded by the codec (see
+machine/codec.py).
+
+Where a write depends on what was read (e.g. resolving a future, which must see
+all of its continuations), it's done in an IMMEDIATE transaction. SQLite only
+runs one of those at a time, across all processes, so lock_future and
+lock_arec are transactions. They nest - an inner one just joins the outer.
+
+Sessions outlive the process that created them, and can be reopened with
+with_session_id.
+"""
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from typing import List
+
+from ..machine import codec
+from ..machine.controller import Controller, ControllerError
+from ..machine.future import Future
+from ..machine.probe import ProbeEvent, ProbeLog
+from ..machine.stdout_item import StdoutItem
+
+LOG = logging.getLogger(__name__)
+
+# The database file used if none is given (override with HARK_SQLITE_DB)
+DEFAULT_DB_PATH = "hark.db"
+
+# How long to wait for another connection's write transaction (seconds)
+BUSY_TIMEOUT = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    probe_mode TEXT,
+    entrypoint TEXT,
+    exe BLOB,
+    result TEXT,
+    broken INTEGER NOT NULL DEFAULT 0,
+    num_threads INTEGER NOT NULL DEFAULT 0,
+    num_arecs INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS threads (
+    session_id TEXT NOT NULL,
+    vmid INTEGER NOT NULL,
+    state BLOB,
+    stopped INTEGER NOT NULL DEFAULT 1,
+    pending INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (session_id, vmid)
+);
+CREATE INDEX IF NOT EXISTS running_threads ON threads (session_id)
+    WHERE stopped = 0;
+CREATE TABLE IF NOT EXISTS arecs (
+    session_id TEXT NOT NULL,
+    ptr INTEGER NOT NULL,
+    arec BLOB NOT NULL,
+    ref_count INTEGER NOT NULL,
+    PRIMARY KEY (session_id, ptr)
+);
+CREATE TABLE IF NOT EXISTS futures (
+    session_id TEXT NOT NULL,
+    vmid INTEGER NOT NULL,
+    resolved INTEGER NOT NULL DEFAULT 0,
+    value BLOB,
+    chain INTEGER,
+    PRIMARY KEY (session_id, vmid)
+);
+CREATE TABLE IF NOT EXISTS waiters (
+    session_id TEXT NOT NULL,
+    future INTEGER NOT NULL,
+    vmid INTEGER NOT NULL,
+    gather INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS waiters_future ON waiters (session_id, future);
+CREATE TABLE IF NOT EXISTS stdout (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    thread INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stdout_session ON stdout (session_id, id);
+CREATE TABLE IF NOT EXISTS probe_logs (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    thread INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS probe_logs_session ON probe_logs (session_id, id);
+CREATE TABLE IF NOT EXISTS probe_events (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    thread INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS probe_events_session ON probe_events (session_id, id);
+"""
+
+
+def get_db_path() -> str:
+    return os.getenv("HARK_SQLITE_DB", DEFAULT_DB_PATH)
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """Open the database, creating the tables if necessary"""
+    # Autocommit - transactions are started explicitly (see _transaction)
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # In WAL mode, this is still safe if the process crashes
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _encode(value):
+    return None if value is None else codec.get_codec().encode(value)
+
+
+def _decode(data):
+    return None if data is None else codec.decode(data)
+
+
+class DataController(Controller):
+    @classmethod
+    def with_new_session(cls, probe_mode=None, db_path=None):
+        """Create a data controller for a new session"""
+        db_path = db_path or get_db_path()
+        session_id = str(uuid.uuid4())
+        conn = connect(db_path)
+        conn.execute(
+            "INSERT INTO sessions (session_id, created_at, probe_mode) "
+            "VALUES (?, ?, ?)",
+            (session_id, time.time(), probe_mode),
+        )
+        conn.close()
+        LOG.info("Created new session, %s", session_id)
+        return cls(session_id, db_path)
+
+    @classmethod
+    def with_session_id(cls, session_id: str, db_path=None):
+        LOG.info("Reloading session %s", session_id)
+        return cls(session_id, db_path or get_db_path())
+
+    def __init__(self, session_id, db_path):
+        self.session_id = session_id
+        self.db_path = db_path
+        # Connections can't be shared between threads or processes
+        self._local = threading.local()
+        row = self._run(
+            "SELECT probe_mode, exe FROM sessions WHERE session_id = :sid"
+        ).fetchone()
+        if row is None:
+            raise ControllerError("Session does not exist")
+        self.probe_mode = row[0]
+        # It's allowed to initialise a controller with no executable, as long
+        # as the user calls set_executable before creating a machine.
+        self.executable = _decode(row[1])
+
+    @property
+    def open_args(self):
+        return (type(self), self.session_id, self.db_path)
+
+    def _conn(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            # New thread, or a forked process - don't use the parent's
+            local.conn = connect(self.db_path)
+            local.pid = os.getpid()
+            local.depth = 0
+        return local.conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """A write transaction, or part of the one already started"""
+        conn = self._conn()
+        local = self._local
+        if local.depth:
+            local.depth += 1
+            try:
+                yield conn
+            finally:
+                local.depth -= 1
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            local.depth = 0
+
+    def _run(self, sql, **params) -> sqlite3.Cursor:
+        """Execute a statement, with :sid bound to the session ID"""
+        return self._conn().execute(sql, dict(params, sid=self.session_id))
+
+    def _get_one(self, sql, **params):
+        row = self._run(sql, **params).fetchone()
+        if row is None:
+            raise ControllerError(f"Not found in {self.session_id}: {params}")
+        return row
+
+    def set_executable(self, exe):
+        self.executable = exe
+        self._run(
+            "UPDATE sessions SET exe = :exe WHERE session_id = :sid", exe=_encode(exe)
+        )
+        LOG.info("Updated session code")
+
+    def set_entrypoint(self, fn_name: str):
+        self._run(
+            "UPDATE sessions SET entrypoint = :name WHERE session_id = :sid",
+            name=fn_name,
+        )
+
+    def _new_id(self, counter: str) -> int:
+        with self._transaction():
+            self._run(
+                f"UPDATE sessions SET {counter} = {counter} + 1 WHERE session_id = :sid"
+            )
+            (count,) = self._get_one(
+                f"SELECT {counter} FROM sessions WHERE session_id = :sid"
+            )
+        return count - 1
+
+    ## Threads
+
+    def new_thread(self) -> int:
+        """Create a new thread, returning the thead ID"""
+        with self._transaction():
+            vmid = self._new_id("num_threads")
+            self._run(
+                "INSERT INTO threads (session_id, vmid) VALUES (:sid, :vmid)",
+                vmid=vmid,
+            )
+        return vmid
+
+    def get_thread_ids(self) -> List[int]:
+        rows = self._run(
+            "SELECT vmid FROM threads WHERE session_id = :sid ORDER BY vmid"
+        )
+        return [vmid for (vmid,) in rows]
+
+    def get_top_level_future(self):
+        return self.get_future(0)
+
+    def is_top_level(self, vmid):
+        return vmid == 0
+
+    def all_stopped(self):
+        running = self._run(
+            "SELECT 1 FROM threads WHERE session_id = :sid AND stopped = 0 LIMIT 1"
+        )
+        return running.fetchone() is None
+
+    def set_stopped(self, vmid, stopped: bool):
+        self._run(
+            "UPDATE threads SET stopped = :stopped "
+            "WHERE session_id = :sid AND vmid = :vmid",
+            stopped=stopped,
+            vmid=vmid,
+        )
+
+    def add_pending(self, vmid, delta) -> int:
+        with self._transaction():
+            self._run(
+                "UPDATE threads SET pending = pending + :delta "
+                "WHERE session_id = :sid AND vmid = :vmid",
+                delta=delta,
+                vmid=vmid,
+            )
+            (pending,) = self._get_one(
+                "SELECT pending FROM threads WHERE session_id = :sid AND vmid = :vmid",
+                vmid=vmid,
+            )
+        return pending
+
+    def stop_gathering(self, vmid) -> bool:
+        with self._transaction():
+            self._run(
+                "UPDATE threads SET pending = pending - 1, stopped = pending > 1 "
+                "WHERE session_id = :sid AND vmid = :vmid",
+                vmid=vmid,
+            )
+            (stopped,) = self._get_one(
+                "SELECT stopped FROM threads WHERE session_id = :sid AND vmid = :vmid",
+                vmid=vmid,
+            )
+        return bool(stopped)
+
+    def get_state(self, vmid):
+        (data,) = self._get_one(
+            "SELECT state FROM threads WHERE session_id = :sid AND vmid = :vmid",
+            vmid=vmid,
+        )
+        return _decode(data)
+
+    def set_state(self, vmid, state):
+        self._run(
+            "UPDATE threads SET state = :state "
+            "WHERE session_id = :sid AND vmid = :vmid",
+            state=_encode(state),
+            vmid=vmid,
+        )
+
+    ## controller properties
+
+    @property
+    def broken(self):
+        (broken,) = self._get_one("SELECT broken FROM sessions WHERE session_id = :sid")
+        return bool(broken)
+
+    @broken.setter
+    def broken(self, value):
+        self._run(
+            "UPDATE sessions SET broken = :broken WHERE session_id = :sid",
+            broken=value,
+        )
+
+    @property
+    def result(self):
+        (result,) = self._get_one("SELECT result FROM sessions WHERE session_id = :sid")
+        return None if result is None else json.loads(result)
+
+    @result.setter
+    def result(self, value):
+        self._run(
+            "UPDATE sessions SET result = :result WHERE session_id = :sid",
+            result=json.dumps(value),
+        )
+
+    ## arecs
+
+    def new_arec(self):
+        return self._new_id("num_arecs")
+
+    def set_arec(self, ptr, rec):
+        self._run(
+            "INSERT OR REPLACE INTO arecs VALUES (:sid, :ptr, :arec, :ref_count)",
+            ptr=ptr,
+            arec=_encode(rec),
+            ref_count=rec.ref_count,
+        )
+
+    def get_arec(self, ptr):
+        data, ref_count = self._get_one(
+            "SELECT arec, ref_count FROM arecs WHERE session_id = :sid AND ptr = :ptr",
+            ptr=ptr,
+        )
+        rec = _decode(data)
+        # The count is only kept up to date in its column
+        rec.ref_count = ref_count
+        return rec
+
+    def _update_ref(self, ptr, delta):
+        self._run(
+            "UPDATE arecs SET ref_count = ref_count + :delta "
+            "WHERE session_id = :sid AND ptr = :ptr",
+            delta=delta,
+            ptr=ptr,
+        )
+
+    def increment_ref(self, ptr):
+        self._update_ref(ptr, 1)
+
+    def decrement_ref(self, ptr):
+        with self._transaction():
+            self._update_ref(ptr, -1)
+            return self.get_arec(ptr)
+
+    def delete_arec(self, ptr):
+        self._run("DELETE FROM arecs WHERE session_id = :sid AND ptr = :ptr", ptr=ptr)
+
+    def lock_arec(self, ptr):
+        return self._transaction()
+
+    ## probes
+
+    def set_probe_data(self, vmid, probe):
+        sid = self.session_id
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO probe_logs (session_id, thread, time, text) "
+                "VALUES (?, ?, ?, ?)",
+                [(sid, log.thread, log.time, log.text) for log in probe.logs],
+            )
+            conn.executemany(
+                "INSERT INTO probe_events (session_id, thread, time, event, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (sid, e.thread, e.time, e.event, json.dumps(e.data, default=str))
+                    for e in probe.events
+                ],
+            )
+
+    def get_probe_logs(self):
+        rows = self._run(
+            "SELECT thread, time, text FROM probe_logs "
+            "WHERE session_id = :sid ORDER BY id"
+        )
+        return [ProbeLog(*row) for row in rows]
+
+    def get_probe_events(self):
+        rows = self._run(
+            "SELECT thread, time, event, data FROM probe_events "
+            "WHERE session_id = :sid ORDER BY id"
+        )
+        return [
+            ProbeEvent(thread, time_, event, json.loads(data))
+            for thread, time_, event, data in rows
+        ]
+
+    ## futures
+    #
+    # The threads waiting for a future (its continuations and gathers) have a
+    # row each in the waiters table, so adding one is just an insert.
+
+    def get_future(self, vmid):
+        if not isinstance(vmid, int):
+            raise TypeError(vmid)
+        resolved, value, chain = self._get_one(
+            "SELECT resolved, value, chain FROM futures "
+            "WHERE session_id = :sid AND vmid = :vmid",
+            vmid=vmid,
+        )
+        waiters = self._run(
+            "SELECT vmid, gather FROM waiters "
+            "WHERE session_id = :sid AND future = :vmid",
+            vmid=vmid,
+        ).fetchall()
+        return Future(
+            continuations=[w for w, gather in waiters if not gather],
+            gathers=[w for w, gather in waiters if gather],
+            chain=chain,
+            resolved=bool(resolved),
+            value=_decode(value),
+        )
+
+    def set_future(self, vmid, future: Future):
+        sid = self.session_id
+        with self._transaction() as conn:
+            self._run(
+                "INSERT OR REPLACE INTO futures "
+                "VALUES (:sid, :vmid, :resolved, :value, :chain)",
+                vmid=vmid,
+                resolved=future.resolved,
+                value=_encode(future.value),
+                chain=future.chain,
+            )
+            self._run(
+                "DELETE FROM waiters WHERE session_id = :sid AND future = :vmid",
+                vmid=vmid,
+            )
+            conn.executemany(
+                "INSERT INTO waiters VALUES (?, ?, ?, ?)",
+                [(sid, vmid, w, False) for w in future.continuations]
+                + [(sid, vmid, w, True) for w in future.gathers],
+            )
+
+    def add_continuation(self, fut_ptr, vmid):
+        self._run(
+            "INSERT INTO waiters VALUES (:sid, :future, :vmid, 0)",
+            future=fut_ptr,
+            vmid=vmid,
+        )
+
+    def set_future_chain(self, fut_ptr, chain):
+        self._run(
+            "UPDATE futures SET chain = :chain "
+            "WHERE session_id = :sid AND vmid = :vmid",
+            chain=chain,
+            vmid=fut_ptr,
+        )
+
+    def lock_future(self, ptr):
+        return self._transaction()
+
+    ## stdout
+
+    def get_stdout(self):
+        rows = self._run(
+            "SELECT thread, text, time FROM stdout WHERE session_id = :sid ORDER BY id"
+        )
+        return [StdoutItem(*row) for row in rows]
+
+    def write_stdout(self, item):
+        sys.stdout.write(item.text)
+        self._run(
+            "INSERT INTO stdout (session_id, thread, time, text) "
+            "VALUES (:sid, :thread, :time, :text)",
+            thread=item.thread,
+            time=item.time,
+            text=item.text,
+        )
+
+    @property  # Legacy. TODO: remove
+    def stdout(self):
+        return self.get_stdout()
@@ -1,29 +1,142 @@
 """Invoke hark thread in a new lambda"""
+import io
 import json
 import logging
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 import botocore
 
+from ..exceptions import UnexpectedError
+
 # Hark "resume" lambda handler name. Should be set by the Hark deployment scripts.
-RESUME_FN_NAME = os.environ["RESUME_FN_NAME"]
+RESUME_FN_NAME = os.environ.get("RESUME_FN_NAME")
 
 
 LOG = logging.getLogger(__name__)
 
+# Maximum number of concurrent invocations made by invoke_many (and so the
+# number of connections the client keeps open)
+MAX_CONCURRENT_INVOKES = 32
+
+# Continuations are only run in the current invocation while at least this
+# fraction of its time remains (so each one gets at least that much time)
+INLINE_MIN_FRACTION = float(os.getenv("HARK_INLINE_MIN_FRACTION", "0.5"))
+
+# Retries of failed invocations, with "full jitter" exponential backoff
+MAX_ATTEMPTS = 5
+RETRY_MIN_DELAY = 0.05
+RETRY_MAX_DELAY = 2.0
+
+# Errors that are worth retrying
+RETRY_CODES = (
+    "TooManyRequestsException",
+    "ServiceException",
+    "EC2ThrottledException",
+    "ResourceConflictException",
+)
+RETRY_EXCEPTIONS = (
+    botocore.exceptions.ConnectionError,
+    botocore.exceptions.HTTPClientError,
+)
+
+
+class InvokeError(UnexpectedError):
+    """A thread couldn't be invoked"""
+
+
+class LocalLambda:
+    """A stand-in for the Lambda client, for testing without AWS
+
+    "Invokes" the handler with each event in a new Python thread, and responds
+    like Lambda does to asynchronous invocations. Install it with
+    set_lambda_client.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        event = json.loads(Payload)
+        threading.Thread(target=self.handler, args=(event, None)).start()
+        return dict(StatusCode=202, Payload=io.BytesIO(b""))
+
+
+# The client is shared by all invokers in this process (clients are
+# thread-safe), so connections are reused between invocations
+_client = None
+_client_lock = threading.Lock()
+
+# Used by invoke_many, created when first needed
+_pool = None
+
 
 def get_lambda_client():
-    return boto3.client(
-        "lambda", config=botocore.config.Config(retries={"max_attempts": 0}),
-    )
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = boto3.client(
+                "lambda",
+                config=botocore.config.Config(
+                    # Retried by Invoker.invoke
+                    retries={"max_attempts": 0},
+                    max_pool_connections=MAX_CONCURRENT_INVOKES,
+                ),
+            )
+        return _client
+
+
+def set_lambda_client(client):
+    """Use a different client (e.g. a LocalLambda). None resets it."""
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def _get_pool():
+    global _pool
+    with _client_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                MAX_CONCURRENT_INVOKES, thread_name_prefix="hark-invoke"
+            )
+        return _pool
+
+
+def _should_retry(exc) -> bool:
+    if isinstance(exc, botocore.exceptions.ClientError):
+        return exc.response.get("Error", {}).get("Code") in RETRY_CODES
+    return isinstance(exc, RETRY_EXCEPTIONS)
 
 
 class Invoker:
-    def __init__(self, data_controller):
+    """Invoke machines in new Lambda invocations
+
+    If given the Lambda context, the last continuation of a finished thread is
+    run in the current invocation instead, while there's enough time left (see
+    INLINE_MIN_FRACTION). That saves an invocation, and loading the session.
+    """
+
+    def __init__(self, data_controller, context=None):
+        if not RESUME_FN_NAME:
+            raise InvokeError("RESUME_FN_NAME is not set")
         self.data_controller = data_controller
         self.resume_fn_name = RESUME_FN_NAME
         self.exception = None
+        self._remaining_ms = None
+        if context is not None:
+            self._remaining_ms = context.get_remaining_time_in_millis
+            self._min_remaining_ms = INLINE_MIN_FRACTION * self._remaining_ms()
+
+    @property
+    def inline_continuations(self):
+        if self._remaining_ms is None:
+            return False
+        return self._remaining_ms() >= self._min_remaining_ms
 
     def invoke(self, vmid, run_async=True):
         client = get_lambda_client()
@@ -32,13 +145,35 @@ class Invoker:
             session_id=self.data_controller.session_id,
             vmid=vmid,
         )
-        res = client.invoke(
-            # --
-            FunctionName=self.resume_fn_name,
-            InvocationType="Event",
-            Payload=json.dumps(event),
-        )
-        if res["StatusCode"] != 202 or "FunctionError" in res:
-            err = res["Payload"].read()
-            # TODO retry!
-            raise Exception(f"Invoke lambda {self.resume_fn_name} failed {err}")
+        delay = RETRY_MIN_DELAY
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                res = client.invoke(
+                    # --
+                    FunctionName=self.resume_fn_name,
+                    InvocationType="Event",
+                    Payload=json.dumps(event),
+                )
+            except Exception as exc:
+                if attempt == MAX_ATTEMPTS or not _should_retry(exc):
+                    raise InvokeError(
+                        f"Invoke lambda {self.resume_fn_name} failed: {exc}"
+                    ) from exc
+                LOG.warning("Invoking thread %s failed (%s), retrying", vmid, exc)
+                time.sleep(random.uniform(0, delay))
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+                continue
+
+            if res["StatusCode"] != 202 or "FunctionError" in res:
+                err = res["Payload"].read()
+                raise InvokeError(f"Invoke lambda {self.resume_fn_name} failed {err}")
+            return
+
+    def invoke_many(self, vmids):
+        """Invoke several threads concurrently"""
+        if len(vmids) < 2:
+            for vmid in vmids:
+                self.invoke(vmid)
+            return
+        # list() to wait for them all, and re-raise any errors here
+        list(_get_pool().map(self.invoke, vmids))
@@ -1,30 +1,157 @@
-"""Run with multiple processes - sort of emulates AWS Lambda"""
+"""Run with multiple processes - sort of emulates AWS Lambda
+
+Machines run in a pool of long-lived worker processes, which take invocations
+from a shared queue - like warm Lambda containers. Each worker keeps the
+controllers (and so the executables) of the sessions it has seen, so only the
+first invocation in a session pays for loading them.
+
+The storage must be usable from several processes. Workers reopen sessions with
+the controller's open_args, a picklable (controller class, session_id, *args)
+tuple - they call controller_class.with_session_id(session_id, *args).
+
+Unexpected errors in a worker stop the machine (so waiters find out) and are
+sent back to the parent process, where they're available as invoker.exception.
+"""
+import logging
 import multiprocessing
+import os
+import sys
+import threading
+import traceback
+
+from ..exceptions import UnexpectedError
+from ..machine.machine import run_inline
 
-from ..controllers import ddb as ddb_controller
-from ..machine.machine import TlMachine
+LOG = logging.getLogger(__name__)
+
+# Maximum number of controllers cached by each worker
+MAX_SESSIONS = 16
+
+
+class WorkerError(UnexpectedError):
+    """An unexpected error in a worker process"""
 
 
 class Invoker:
-    def __init__(self, data_controller):
+    # Only continuations of machines running in workers are run inline (see
+    # WorkerInvoker) - the parent process should hand work to the pool.
+    inline_continuations = False
+
+    def __init__(self, data_controller, num_workers=None):
+        self.data_controller = data_controller
+        self.pool = WorkerPool.get(num_workers)
+
+    @property
+    def exception(self):
+        return self.pool.errors.get(self.data_controller.session_id)
+
+    def invoke(self, vmid, run_async=True):
+        self.pool.submit(self.data_controller.open_args, vmid)
+
+    def invoke_many(self, vmids):
+        for vmid in vmids:
+            self.invoke(vmid)
+
+    def shutdown(self, wait=True):
+        """Nothing to do - the pool is shared by every run in this process"""
+
+
+class WorkerInvoker:
+    """The invoker used by machines running in a worker process"""
+
+    inline_continuations = True
+    exception = None
+
+    def __init__(self, data_controller, tasks):
         self.data_controller = data_controller
-        self.exception = None
+        self._tasks = tasks
 
     def invoke(self, vmid, run_async=True):
-        event = dict(
-            # --
-            session_id=self.data_controller.session_id,
-            vmid=vmid,
+        self._tasks.put((self.data_controller.open_args, vmid))
+
+    def invoke_many(self, vmids):
+        for vmid in vmids:
+            self.invoke(vmid)
+
+
+class WorkerPool:
+    """A pool of warm worker processes, shared by all sessions in this process"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, num_workers=None):
+        """Get the pool, starting it if necessary"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(num_workers)
+            return cls._instance
+
+    def __init__(self, num_workers=None):
+        self.num_workers = num_workers or int(
+            os.getenv("HARK_MAX_PROCESSES", os.cpu_count() or 1)
         )
-        p = multiprocessing.Process(target=resume_handler, args=(event,))
-        p.start()
-
-
-def resume_handler(event):
-    # TODO catch exceptions and send them back!
-    session_id = event["session_id"]
-    vmid = event["vmid"]
-    controller = ddb_controller.DataController.with_session_id(session_id)
-    invoker = Invoker(controller)
-    machine = TlMachine(vmid, invoker)
-    machine.run()
+        self.errors = {}
+        # Workers are spawned, not forked, so that they don't inherit open
+        # database connections (SQLite connections can't survive a fork)
+        context = multiprocessing.get_context("spawn")
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._workers = [
+            context.Process(
+                target=worker_main, args=(self._tasks, self._results), daemon=True
+            )
+            for _ in range(self.num_workers)
+        ]
+        for p in self._workers:
+            p.start()
+        threading.Thread(target=self._collect_errors, daemon=True).start()
+        LOG.info("Started %d worker processes", self.num_workers)
+
+    def submit(self, open_args: tuple, vmid: int):
+        self._tasks.put((open_args, vmid))
+
+    def _collect_errors(self):
+        while True:
+            session_id, vmid, tb = self._results.get()
+            LOG.error("Thread %s in session %s died:\n%s", vmid, session_id, tb)
+            self.errors[session_id] = WorkerError(
+                f"Thread {vmid} died in a worker process:\n{tb}"
+            )
+
+
+def worker_main(tasks, results):
+    """Run invocations from the tasks queue until the parent exits"""
+    controllers = {}
+    while True:
+        open_args, vmid = tasks.get()
+        cls, session_id, *args = open_args
+        # The thread that failed (maybe a continuation run inline)
+        failed = [vmid]
+        try:
+            controller = controllers.get(open_args)
+            if controller is None:
+                if len(controllers) >= MAX_SESSIONS:
+                    del controllers[next(iter(controllers))]
+                controller = cls.with_session_id(session_id, *args)
+                controllers[open_args] = controller
+            run_inline(vmid, WorkerInvoker(controller, tasks), failed.append)
+        except Exception:
+            tb = "".join(traceback.format_exception(*sys.exc_info()))
+            _stop_broken(controllers.get(open_args), failed[-1], tb)
+            results.put((session_id, failed[-1], tb))
+
+
+def _stop_broken(controller, vmid, tb):
+    """Record an unexpected error, so that waiting machines find out"""
+    if controller is None:
+        return
+    try:
+        state = controller.get_state(vmid)
+        state.error_msg = tb
+        controller.set_state(vmid, state)
+        controller.release(vmid)
+        controller.stop(vmid, finished_ok=False)
+    except Exception:
+        LOG.exception("Couldn't stop thread %s", vmid)
@@ -1,29 +1,56 @@
+"""Run Hark threads on a pool of Python threads"""
 import logging
-import threading
-import time
-import traceback
-import warnings
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-from ..machine.machine import TlMachine
+from ..machine.machine import run_inline
 
 LOG = logging.getLogger(__name__)
 
+# Default maximum number of Python threads (override with HARK_MAX_THREADS)
+DEFAULT_MAX_WORKERS = 32
+
 
 class Invoker:
-    def __init__(self, data_controller):
+    """Run machines on a bounded pool of Python threads
+
+    Invocations are queued and run by up to max_workers threads. Machines don't
+    hold on to a thread while waiting for a future (they stop, and are resumed
+    as a continuation when it resolves), so any number of Hark threads can run
+    on a small pool.
+    """
+
+    # Run the last continuation of a finished thread on the same Python thread
+    inline_continuations = True
+
+    def __init__(self, data_controller, max_workers=None):
         self.data_controller = data_controller
         self.exception = None
-        threading.excepthook = self._threading_excepthook
-
-    def _threading_excepthook(self, args):
-        self.exception = args
+        self.max_workers = max_workers or int(
+            os.getenv("HARK_MAX_THREADS", DEFAULT_MAX_WORKERS)
+        )
+        self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="hark")
 
     def invoke(self, vmid, run_async=True):
-        LOG.info(f"Invoking {vmid} (new thread? {run_async})")
-        m = TlMachine(vmid, self)
+        LOG.info(f"Invoking {vmid} (in the pool? {run_async})")
         if run_async:
-            thread = threading.Thread(target=m.run)
-            LOG.info(f"New thread: {thread}")
-            thread.start()
+            self._pool.submit(self._run, vmid)
         else:
-            m.run()
+            run_inline(vmid, self)
+
+    def invoke_many(self, vmids):
+        for vmid in vmids:
+            self._pool.submit(self._run, vmid)
+
+    def _run(self, vmid):
+        try:
+            run_inline(vmid, self)
+        except Exception as exc:
+            # The machine catches errors in Hark code, so this is unexpected.
+            # Keep it for the waiter to report (see run.common).
+            LOG.exception("Thread %s died", vmid)
+            self.exception = exc
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads once all queued machines have run"""
+        self._pool.shutdown(wait)
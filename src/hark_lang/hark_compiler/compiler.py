@@ -1,4 +1,5 @@
 """Optimise and compile an AST into executable code"""
+import dataclasses
 import itertools
 import logging
 from functools import singledispatch, singledispatchmethod, wraps
@@ -69,6 +70,50 @@ def optimise_tailcall(n: nodes.N_Definition):
     return n
 
 
+def assigned_names(node):
+    """Find the names assigned (with `=') in node, excluding nested functions"""
+    if isinstance(node, list):
+        for item in node:
+            yield from assigned_names(item)
+
+    elif isinstance(node, nodes.Node) and not isinstance(
+        node, (nodes.N_Definition, nodes.N_Lambda)
+    ):
+        if (
+            isinstance(node, nodes.N_Binop)
+            and node.op == "="
+            and isinstance(node.lhs, nodes.N_Id)
+        ):
+            yield node.lhs.name
+        for field in dataclasses.fields(node):
+            yield from assigned_names(getattr(node, field.name))
+
+
+def local_slots(n) -> Dict[str, int]:
+    """Allocate a local variable slot for each parameter and assigned name"""
+    names = dict.fromkeys(list(n.paramlist) + list(assigned_names(n.body)))
+    return {name: slot for slot, name in enumerate(names)}
+
+
+def toplevel_names(exprs: list):
+    """Find the global names defined by toplevel expressions
+
+    Badly formed expressions are ignored here (compile_toplevel reports them).
+    """
+    for n in exprs:
+        if isinstance(n, nodes.N_Definition):
+            yield n.name
+        elif (
+            isinstance(n, nodes.N_Call)
+            and isinstance(n.fn, nodes.N_Id)
+            and n.fn.name == "import"
+            and len(n.args) in (3, 4)
+        ):
+            name_node = n.args[-1] if len(n.args) == 4 else n.args[0]
+            if isinstance(name_node.value, nodes.N_Id):
+                yield name_node.value.name
+
+
 def replace_gotos(code: list):
     """Replace Labels and Gotos with Jumps"""
     labels = {}
@@ -96,10 +141,15 @@ class CompileToplevel:
     def __init__(self, exprs):
         """Compile a toplevel list of expressions"""
         self.functions = {}
+        self.num_locals = {}
         self.attributes = {}
         self.bindings = {}
         self.labels = {}
         self.instruction_idx = 0
+        # Globals can be referenced before they're defined, so find them first
+        self.global_names = set(toplevel_names(exprs))
+        # Local name -> slot for the function being compiled
+        self.scope = {}
         for e in exprs:
             self.compile_toplevel(e)
 
@@ -108,7 +158,13 @@ class CompileToplevel:
         count = len(self.functions)
         identifier = f"#{count}:{name}"
         start_label = nodes.N_Label.from_node(n, START_LABEL)
-        code = self.compile_function(optimise_tailcall(n))
+        outer_scope = self.scope
+        self.scope = local_slots(n)
+        try:
+            code = self.compile_function(optimise_tailcall(n))
+            self.num_locals[identifier] = len(self.scope)
+        finally:
+            self.scope = outer_scope
         fn_code = replace_gotos([start_label] + code)
         self.functions[identifier] = fn_code
         # self.attributes[identifier] = parse_attribute(n.attribute)
@@ -118,7 +174,7 @@ class CompileToplevel:
         """Compile a function into executable code"""
         bindings = flatten(
             [
-                [mi.Bind.from_node(n, mt.TlSymbol(arg)), mi.Pop.from_node(n)]
+                [mi.BindL.from_node(n, mt.TlInt(self.scope[arg])), mi.Pop.from_node(n)]
                 for arg in reversed(n.paramlist)
             ]
         )
@@ -129,13 +185,25 @@ class CompileToplevel:
         """Wrap a foreign function in a Hark function"""
         fn_code = [
             # args will already be on the stack, ready
-            mi.PushB.from_node(n, mt.TlSymbol(qualified_name)),
+            mi.PushG.from_node(n, mt.TlSymbol(qualified_name)),
             mi.Call.from_node(n, mt.TlInt(num_args)),
             mi.Return.from_node(n),
         ]
         count = len(self.functions)
         identifier = f"#F:{qualified_name}"
         self.functions[identifier] = fn_code
+        self.num_locals[identifier] = 0
+
+    def compile_name(self, n: nodes.Node, name: str):
+        """Push the value of name. Precedence: local -> global -> builtin"""
+        if name in self.scope:
+            return mi.PushL.from_node(n, mt.TlInt(self.scope[name]))
+        elif name in self.global_names:
+            return mi.PushG.from_node(n, mt.TlSymbol(name))
+        elif name in mi.BUILTINS:
+            return mi.PushV.from_node(n, mt.TlInstruction(name))
+        else:
+            raise HarkCompileError(n, f"'{name}' is not defined")
 
     ## At the toplevel, no executable code is created - only bindings
 
@@ -218,7 +286,7 @@ class CompileToplevel:
 
     @compile_expr.register
     def _(self, n: nodes.N_Id):
-        return [mi.PushB.from_node(n, mt.TlSymbol(n.name))]
+        return [self.compile_name(n, n.name)]
 
     @compile_expr.register
     def _(self, n: nodes.N_Progn):
@@ -274,7 +342,8 @@ class CompileToplevel:
         if n.op == "=":
             if not isinstance(n.lhs, nodes.N_Id):
                 raise ValueError(f"Can't assign to non-identifier {n.lhs}")
-            return rhs + [mi.Bind.from_node(n, mt.TlSymbol(str(n.lhs.name)))]
+            slot = self.scope[n.lhs.name]
+            return rhs + [mi.BindL.from_node(n, mt.TlInt(slot))]
 
         else:
             lhs = self.compile_expr(n.lhs)
@@ -283,7 +352,7 @@ class CompileToplevel:
                 rhs
                 + lhs
                 + [
-                    mi.PushB.from_node(n, mt.TlSymbol(str(n.op))),
+                    self.compile_name(n, str(n.op)),
                     mi.Call.from_node(n, mt.TlInt(2)),
                 ]
             )
@@ -337,4 +406,10 @@ def tl_compile(top_nodes: list) -> Executable:
         location_offset += len(fn_code)
         code += fn_code
 
-    return Executable(collection.bindings, locations, code, collection.attributes)
+    return Executable(
+        collection.bindings,
+        locations,
+        code,
+        collection.attributes,
+        collection.num_locals,
+    )
@@ -1,44 +1,125 @@
 """Activation Records"""
 
-from dataclasses import dataclass
-from typing import Dict, Union
+from typing import List, Optional, Union
 
 from ..machine import types as mt
-from .hark_serialisable import HarkSerialisable
 
 ARecPtr = int
 
 
-@dataclass
-class ActivationRecord(HarkSerialisable):
+class ActivationRecord:
     """Like a stack frame, but more general.
 
     NOTE static_chain: ARecPtr: Not needed - we don't have nested lexical scopes
 
     """
 
-    function: mt.TlFunctionPtr  # ....... Owner function
-    vmid: int  # ......................
-    # parameters: List[mt.TlType]  # ...... Function parameters
-    bindings: Dict[str, mt.TlType]  # ... Local bindings
-    # result: mt.TlType  # ................ Function return value
-    ref_count: int  # ................ Number of places this AR is used
-    dynamic_chain: Union[ARecPtr, None] = None  # caller activation record
-    call_site: Union[int, None] = None
-    deleted: bool = False
+    __slots__ = (
+        "function",  # ......... Owner function
+        "vmid",
+        "bindings",  # ......... Local variable slots
+        "ref_count",  # ........ Number of places this AR is used
+        "dynamic_chain",  # .... Caller activation record
+        "call_site",
+        "deleted",
+    )
+
+    def __init__(
+        self,
+        function: mt.TlFunctionPtr,
+        vmid: int,
+        bindings: List[Optional[mt.TlType]],
+        ref_count: int,
+        dynamic_chain: Union[ARecPtr, None] = None,
+        call_site: Union[int, None] = None,
+        deleted: bool = False,
+    ):
+        self.function = function
+        self.vmid = vmid
+        self.bindings = bindings
+        self.ref_count = ref_count
+        self.dynamic_chain = dynamic_chain
+        self.call_site = call_site
+        self.deleted = deleted
+
+    def __eq__(self, other):
+        return isinstance(other, ActivationRecord) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self):
+        return (
+            f"<ActivationRecord {self.function} vmid={self.vmid} "
+            f"ref_count={self.ref_count} dynamic_chain={self.dynamic_chain}>"
+        )
 
     def serialise(self):
-        d = super().serialise()
-        d["function"] = d["function"].serialise()
-        d["bindings"] = {
-            name: value.serialise() for name, value in d["bindings"].items()
-        }
-        return d
+        return dict(
+            function=self.function.serialise(),
+            vmid=self.vmid,
+            bindings=mt.serialise_slots(self.bindings),
+            ref_count=self.ref_count,
+            dynamic_chain=self.dynamic_chain,
+            call_site=self.call_site,
+            deleted=self.deleted,
+        )
 
     @classmethod
     def deserialise(cls, d):
         d["function"] = mt.TlType.deserialise(d["function"])
-        d["bindings"] = {
-            name: mt.TlType.deserialise(value) for name, value in d["bindings"].items()
-        }
-        return super().deserialise(d)
+        d["bindings"] = mt.deserialise_slots(d["bindings"])
+        return cls(**d)
+
+
+class Frame:
+    """A call frame, kept in the State of the thread that made the call
+
+    Ordinary function calls only push a Frame. The frame is also stored in the
+    controller, as an ActivationRecord, only when another thread needs to refer
+    to it (i.e. when it forks a thread - see TlMachine ACall). ptr is the
+    pointer to that record, or None.
+    """
+
+    __slots__ = ("function", "call_site", "bindings", "ptr")
+
+    def __init__(
+        self,
+        function: mt.TlFunctionPtr,
+        call_site: Optional[int],
+        bindings: List[Optional[mt.TlType]],
+        ptr: Optional[ARecPtr] = None,
+    ):
+        self.function = function
+        self.call_site = call_site
+        self.bindings = bindings  # ... Local variable slots
+        self.ptr = ptr
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Frame)
+            and self.function == other.function
+            and self.call_site == other.call_site
+            and self.bindings == other.bindings
+            and self.ptr == other.ptr
+        )
+
+    def __repr__(self):
+        return f"<Frame {self.function} call_site={self.call_site} ptr={self.ptr}>"
+
+    def serialise(self):
+        return [
+            self.function.serialise(),
+            self.call_site,
+            mt.serialise_slots(self.bindings),
+            self.ptr,
+        ]
+
+    @classmethod
+    def deserialise(cls, data):
+        function, call_site, bindings, ptr = data
+        return cls(
+            mt.TlType.deserialise(function),
+            call_site,
+            mt.deserialise_slots(bindings),
+            ptr,
+        )
@@ -0,0 +1,505 @@
+"""Encoding machine data for storage
+
+Codecs turn machine data (thread State, ActivationRecord, Future, Executable
+and Tl values) into bytes and back. They are used by the controllers to store
+the data.
+
+Codecs:
+
+- binary:      compact binary format (see below), the default
+- binary+zlib: binary, zlib-compressed if big enough to be worth it
+- binary+zstd: as binary+zlib, with zstd (needs the zstandard package)
+- json:        the serialise() form as JSON, for debugging
+
+The default codec can be set with the HARK_CODEC environment variable. Data is
+always decoded according to its header, so changing the codec doesn't affect
+existing data.
+
+All data starts with a 4 byte header: MAGIC, the format (FORMAT_BINARY or
+FORMAT_JSON), and the compression.
+
+Binary format: after the header, one encoded value. Each value is a one byte
+type tag followed by its data:
+
+- ints are zigzag varints, floats are 8 byte doubles
+- strings and containers are prefixed with their length (a varint)
+- repeated strings refer back to the first occurrence
+- objects (Tl pointers, State, etc) are encoded as their number of fields, and
+  the fields
+
+JSON format: after the header, a JSON list of the type of the value (see
+_JSON_TYPES) and its serialise() form.
+"""
+
+import json
+import os
+import struct
+import zlib
+from ..exceptions import UnexpectedError, UserResolvableError
+from . import instructionset
+from . import types as mt
+from .arec import ActivationRecord, Frame
+from .future import Future
+from .instruction import Instruction
+from .state import State
+
+try:
+    from .executable import Executable
+except ModuleNotFoundError:
+    # Executable needs the CLI dependencies (see controllers/ddb.py)
+    Executable = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"\xffH"
+
+# Format (header byte 2)
+FORMAT_BINARY = 1
+FORMAT_JSON = 2
+
+# Compression (header byte 3)
+COMPRESS_NONE = 0
+COMPRESS_ZLIB = 1
+COMPRESS_ZSTD = 2
+
+# Don't bother compressing data smaller than this (bytes)
+COMPRESS_THRESHOLD = 512
+
+DEFAULT_CODEC = "binary"
+
+
+class CodecError(UnexpectedError):
+    """Data can't be encoded or decoded"""
+
+
+### Type tags
+
+# Python data
+T_NONE = 0
+T_FALSE = 1
+T_TRUE = 2
+T_INT = 3
+T_FLOAT = 4
+T_STR = 5
+T_LIST = 6
+T_DICT = 7
+T_STRREF = 8  # a string that has already been seen (see _encode)
+
+# Tl values
+T_TLNULL = 16
+T_TLTRUE = 17
+T_TLFALSE = 18
+T_TLINT = 19
+T_TLFLOAT = 20
+T_TLSTRING = 21
+T_TLSYMBOL = 22
+T_TLINSTRUCTION = 23
+T_TLFUTUREPTR = 24
+T_TLLIST = 25
+T_TLHASH = 26
+T_TLQUOTE = 27
+T_TLFUNCTIONPTR = 28
+T_TLFOREIGNPTR = 29
+
+# Machine data
+T_STATE = 32
+T_AREC = 33
+T_FUTURE = 34
+T_EXECUTABLE = 35
+T_INSTRUCTION = 36
+T_FRAME = 37
+
+_DOUBLE = struct.Struct("<d")
+
+_STRING_TAGS = {
+    str: T_STR,
+    mt.TlString: T_TLSTRING,
+    mt.TlSymbol: T_TLSYMBOL,
+    mt.TlInstruction: T_TLINSTRUCTION,
+}
+_STRING_TYPES = {tag: cls for cls, tag in _STRING_TAGS.items()}
+
+_ATOM_TAGS = {
+    mt.TlNull: T_TLNULL,
+    mt.TlTrue: T_TLTRUE,
+    mt.TlFalse: T_TLFALSE,
+}
+_ATOMS = {
+    T_NONE: None,
+    T_FALSE: False,
+    T_TRUE: True,
+    T_TLNULL: mt.NULL,
+    T_TLTRUE: mt.TRUE,
+    T_TLFALSE: mt.FALSE,
+}
+
+
+### Objects - encoded as tag, number of fields, and the fields
+
+
+def _make_state(ip, stopped, ds, frames, error_msg):
+    s = State(ds)
+    s.ip = ip
+    s.stopped = stopped
+    s.set_frames(frames)
+    s.error_msg = error_msg
+    return s
+
+
+def _make_future(continuations, chain, resolved, value, gathers=None):
+    return Future(
+        continuations=continuations,
+        chain=chain,
+        resolved=resolved,
+        value=value,
+        gathers=gathers,
+    )
+
+
+def _make_executable(bindings, locations, code, num_locals):
+    # FIXME attributes (as Executable.deserialise)
+    return Executable(
+        bindings=bindings,
+        locations=locations,
+        code=code,
+        attributes=None,
+        num_locals=num_locals,
+    )
+
+
+def _make_instruction(name, operands, source):
+    return getattr(instructionset, name)(*operands, source=source)
+
+
+# (type, tag, get fields, make object from fields)
+_OBJECTS = [
+    (mt.TlFuturePtr, T_TLFUTUREPTR, lambda o: (o.value,), mt.TlFuturePtr),
+    (mt.TlQuote, T_TLQUOTE, lambda o: (o.data,), mt.TlQuote),
+    (
+        mt.TlFunctionPtr,
+        T_TLFUNCTIONPTR,
+        lambda o: (o.identifier, o.stack_ptr),
+        mt.TlFunctionPtr,
+    ),
+    (
+        mt.TlForeignPtr,
+        T_TLFOREIGNPTR,
+        lambda o: (o.identifier, o.module, o.qualified_name),
+        mt.TlForeignPtr,
+    ),
+    (
+        State,
+        T_STATE,
+        lambda o: (o.ip, o.stopped, o._ds, o.frames, o.error_msg),
+        _make_state,
+    ),
+    (
+        Frame,
+        T_FRAME,
+        lambda o: (o.function, o.call_site, o.bindings, o.ptr),
+        Frame,
+    ),
+    (
+        ActivationRecord,
+        T_AREC,
+        lambda o: (
+            o.function,
+            o.vmid,
+            o.bindings,
+            o.ref_count,
+            o.dynamic_chain,
+            o.call_site,
+            o.deleted,
+        ),
+        ActivationRecord,
+    ),
+    (
+        Future,
+        T_FUTURE,
+        lambda o: (o.continuations, o.chain, o.resolved, o.value, o.gathers),
+        _make_future,
+    ),
+    (
+        Executable,
+        T_EXECUTABLE,
+        lambda o: (o.bindings, o.locations, o.code, o.num_locals),
+        _make_executable,
+    ),
+    (
+        Instruction,  # (any subclass)
+        T_INSTRUCTION,
+        lambda o: (o.name, o.operands, o.source),
+        _make_instruction,
+    ),
+]
+
+_OBJECT_ENCODERS = {cls: (tag, fields) for cls, tag, fields, _ in _OBJECTS if cls}
+_OBJECT_DECODERS = {tag: make for _, tag, _, make in _OBJECTS}
+
+
+### Encoding
+
+
+def _encode(root) -> bytearray:
+    """Encode root into the binary format (without header)"""
+    out = bytearray()
+    append = out.append
+    # Strings already written, and their index. Repeats (e.g. source file
+    # names in an Executable) are written as a T_STRREF to the index.
+    strings = {}
+
+    def uint(n):
+        while n > 0x7F:
+            append((n & 0x7F) | 0x80)
+            n >>= 7
+        append(n)
+
+    def value(obj):
+        t = type(obj)
+        if t is mt.TlInt or t is int:
+            append(T_TLINT if t is mt.TlInt else T_INT)
+            # zigzag, so small negative numbers are small too
+            uint(obj << 1 if obj >= 0 else ((-obj) << 1) - 1)
+        elif t in _STRING_TAGS:
+            tag = _STRING_TAGS[t]
+            key = (tag, obj)
+            ref = strings.get(key)
+            if ref is None:
+                strings[key] = len(strings)
+                data = obj.encode("utf-8")
+                append(tag)
+                uint(len(data))
+                out.extend(data)
+            else:
+                append(T_STRREF)
+                uint(ref)
+        elif obj is None:
+            append(T_NONE)
+        elif t is list or t is tuple or t is mt.TlList:
+            append(T_TLLIST if t is mt.TlList else T_LIST)
+            uint(len(obj))
+            for item in obj:
+                value(item)
+        elif t is dict or t is mt.TlHash:
+            append(T_TLHASH if t is mt.TlHash else T_DICT)
+            uint(len(obj))
+            for k, v in obj.items():
+                value(k)
+                value(v)
+        elif t is bool:
+            append(T_TRUE if obj else T_FALSE)
+        elif t is float or t is mt.TlFloat:
+            append(T_TLFLOAT if t is mt.TlFloat else T_FLOAT)
+            out.extend(_DOUBLE.pack(obj))
+        elif t in _ATOM_TAGS:
+            append(_ATOM_TAGS[t])
+        else:
+            if isinstance(obj, Instruction):
+                t = Instruction
+            try:
+                tag, get_fields = _OBJECT_ENCODERS[t]
+            except KeyError:
+                raise CodecError(f"Can't encode {obj} ({type(obj)})")
+            fields = get_fields(obj)
+            append(tag)
+            uint(len(fields))
+            for field in fields:
+                value(field)
+
+    value(root)
+    return out
+
+
+### Decoding
+
+
+def _decode(data: bytes):
+    """Decode data in the binary format (without header)"""
+    pos = 0
+    strings = []
+
+    def uint():
+        nonlocal pos
+        result = shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def value():
+        nonlocal pos
+        tag = data[pos]
+        pos += 1
+        if tag in _ATOMS:
+            return _ATOMS[tag]
+        if tag == T_FLOAT or tag == T_TLFLOAT:
+            (n,) = _DOUBLE.unpack_from(data, pos)
+            pos += 8
+            return mt.TlFloat(n) if tag == T_TLFLOAT else n
+
+        # Everything else is followed by a varint (usually one byte)
+        n = data[pos]
+        if n < 0x80:
+            pos += 1
+        else:
+            n = uint()
+
+        if tag == T_TLINT or tag == T_INT:
+            n = (n >> 1) if not n & 1 else -((n + 1) >> 1)
+            return mt.TlInt(n) if tag == T_TLINT else n
+        if tag == T_STRREF:
+            return strings[n]
+        if tag in _STRING_TYPES:
+            start = pos
+            pos += n
+            s = _STRING_TYPES[tag](data[start:pos].decode("utf-8"))
+            strings.append(s)
+            return s
+        if tag == T_LIST:
+            return [value() for _ in range(n)]
+        if tag == T_TLLIST:
+            return mt.TlList([value() for _ in range(n)])
+        if tag == T_DICT:
+            return {value(): value() for _ in range(n)}
+        if tag == T_TLHASH:
+            return mt.TlHash([(value(), value()) for _ in range(n)])
+        try:
+            make = _OBJECT_DECODERS[tag]
+        except KeyError:
+            raise CodecError(f"Bad type tag {tag}")
+        return make(*[value() for _ in range(n)])
+
+    return value()
+
+
+### Codecs
+
+
+class Codec:
+    """Encode machine data to bytes"""
+
+    name = None
+
+    def encode(self, obj) -> bytes:
+        raise NotImplementedError
+
+
+class BinaryCodec(Codec):
+    """The binary format, optionally compressed"""
+
+    def __init__(self, compression=COMPRESS_NONE, threshold=COMPRESS_THRESHOLD):
+        if compression == COMPRESS_ZSTD and not zstandard:
+            raise UserResolvableError(
+                "zstd compression is not available.",
+                "Install the `zstandard' package, or use another codec.",
+            )
+        self.compression = compression
+        self.threshold = threshold
+
+    def encode(self, obj) -> bytes:
+        out = _encode(obj)
+        compression = COMPRESS_NONE
+        if self.compression != COMPRESS_NONE and len(out) >= self.threshold:
+            compressed = _compress(self.compression, out)
+            if len(compressed) < len(out):
+                compression = self.compression
+                out = compressed
+        return MAGIC + bytes([FORMAT_BINARY, compression]) + out
+
+
+# (type, name, deserialise). Lists are local variable slots.
+_JSON_TYPES = [
+    (State, "state", State.deserialise),
+    (ActivationRecord, "arec", ActivationRecord.deserialise),
+    (Future, "future", Future.deserialise),
+    (Executable, "executable", Executable and Executable.deserialise),
+    (mt.TlType, "value", mt.TlType.deserialise),
+    (list, "slots", mt.deserialise_slots),
+]
+_JSON_LOADERS = {name: load for cls, name, load in _JSON_TYPES if cls}
+
+
+class JsonCodec(Codec):
+    """The serialise() form, as JSON. Much bigger and slower than binary."""
+
+    def encode(self, obj) -> bytes:
+        for cls, name, _ in _JSON_TYPES:
+            if cls and isinstance(obj, cls):
+                break
+        else:
+            raise CodecError(f"Can't encode {obj} ({type(obj)})")
+        serialised = mt.serialise_slots(obj) if name == "slots" else obj.serialise()
+        data = json.dumps([name, serialised]).encode("utf-8")
+        return MAGIC + bytes([FORMAT_JSON, COMPRESS_NONE]) + data
+
+    @staticmethod
+    def decode(data: bytes):
+        name, obj = json.loads(data)
+        try:
+            load = _JSON_LOADERS[name]
+        except KeyError:
+            raise CodecError(f"Unknown JSON data type {name}")
+        return load(obj)
+
+
+def _compress(compression: int, data: bytes) -> bytes:
+    if compression == COMPRESS_ZLIB:
+        return zlib.compress(data, 1)
+    return zstandard.ZstdCompressor().compress(bytes(data))
+
+
+def _decompress(compression: int, data: bytes) -> bytes:
+    if compression == COMPRESS_NONE:
+        return data
+    if compression == COMPRESS_ZLIB:
+        return zlib.decompress(data)
+    if compression == COMPRESS_ZSTD:
+        if not zstandard:
+            raise CodecError("Data is zstd compressed, but zstandard isn't installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise CodecError(f"Unknown compression {compression}")
+
+
+def decode(data: bytes):
+    """Decode data encoded by any codec"""
+    if data[:2] != MAGIC:
+        raise CodecError("Not Hark machine data (stored by an older version?)")
+    fmt, compression = data[2], data[3]
+    if fmt == FORMAT_BINARY:
+        try:
+            return _decode(_decompress(compression, data[4:]))
+        except (IndexError, struct.error, UnicodeDecodeError, zlib.error) as exc:
+            raise CodecError(f"Corrupt binary data: {exc}")
+    if fmt == FORMAT_JSON:
+        try:
+            return JsonCodec.decode(_decompress(compression, data[4:]))
+        except (ValueError, KeyError, TypeError) as exc:
+            raise CodecError(f"Corrupt JSON data: {exc}")
+    raise CodecError(f"Unsupported data format {fmt}")
+
+
+CODECS = {
+    "binary": lambda: BinaryCodec(),
+    "binary+zlib": lambda: BinaryCodec(COMPRESS_ZLIB),
+    "binary+zstd": lambda: BinaryCodec(COMPRESS_ZSTD),
+    "json": lambda: JsonCodec(),
+}
+
+
+def get_codec(name: str = None) -> Codec:
+    """Get a codec by name (default: HARK_CODEC, or binary)"""
+    name = name or os.getenv("HARK_CODEC", DEFAULT_CODEC)
+    try:
+        codec = CODECS[name]()
+    except KeyError:
+        raise UserResolvableError(
+            f"Unknown codec `{name}'.", f"Supported codecs: {', '.join(CODECS)}"
+        )
+    codec.name = name
+    return codec
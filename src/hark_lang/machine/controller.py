@@ -1,11 +1,12 @@
 """Placeholder for the controller class"""
 
 import logging
+import time
 from typing import List
 
 from ..exceptions import UnexpectedError
 from . import types as mt
-from .arec import ActivationRecord
+from .arec import ActivationRecord, Frame
 from .future import Future
 from .probe import Probe
 from .state import State
@@ -19,12 +20,24 @@ class ControllerError(UnexpectedError):
 
 
 class Controller:
+    # Probe mode for machines in this session (None: use the default)
+    probe_mode = None
+
     def __init__(self):
         raise NotImplementedError("Must be subclassed")
 
     def supports_plugin(self, name: str):
         return False
 
+    @property
+    def open_args(self) -> tuple:
+        """A picklable (class, session_id, *args) tuple to reopen the session
+
+        Used to load the session in another process (see
+        executors/multiprocess.py), with class.with_session_id(session_id, *args).
+        """
+        raise NotImplementedError
+
     def toplevel_machine(self, fn_ptr: mt.TlFunctionPtr, args):
         """Create a top-level machine"""
         vmid = self.new_thread()
@@ -33,7 +46,7 @@ class Controller:
             dynamic_chain=None,
             vmid=vmid,
             call_site=None,
-            bindings={},
+            bindings=self._new_locals(fn_ptr),
             ref_count=1,
         )
         self.set_entrypoint(fn_ptr.identifier)
@@ -43,31 +56,78 @@ class Controller:
     def thread_machine(self, caller_arec_ptr, caller_ip, fn_ptr, args):
         """Create a new thread machine"""
         vmid = self.new_thread()
-        arec = ActivationRecord(
+        arec = self._thread_arec(vmid, caller_arec_ptr, caller_ip, fn_ptr)
+        self._init_thread(vmid, fn_ptr, args, arec)
+        return vmid
+
+    def thread_machines(self, caller_arec_ptr, caller_ip, fn_ptr, args_list) -> list:
+        """Create a new thread machine for each set of args, returning the IDs
+
+        Controllers that can create threads more cheaply in bulk (e.g. with
+        batched writes) should override this.
+        """
+        return [
+            self.thread_machine(caller_arec_ptr, caller_ip, fn_ptr, args)
+            for args in args_list
+        ]
+
+    def _new_locals(self, fn_ptr) -> list:
+        return [None] * self.executable.num_locals[fn_ptr.identifier]
+
+    def _thread_arec(self, vmid, caller_arec_ptr, caller_ip, fn_ptr):
+        return ActivationRecord(
             function=fn_ptr,
             dynamic_chain=caller_arec_ptr,
             vmid=vmid,
             call_site=caller_ip - 1,
-            bindings={},
+            bindings=self._new_locals(fn_ptr),
             ref_count=1,
         )
-        self._init_thread(vmid, fn_ptr, args, arec)
-        return vmid
 
-    def _init_thread(self, vmid, fn_ptr, args, arec):
+    def _thread_state(self, fn_ptr, args, arec, arec_ptr) -> State:
+        """The initial state of a thread that calls fn_ptr with args"""
         state = State(args)
-        entrypoint_ip = self.executable.locations[fn_ptr.identifier]
+        state.set_frames([Frame(fn_ptr, arec.call_site, arec.bindings, arec_ptr)])
+        state.ip = self.executable.locations[fn_ptr.identifier]
+        return state
+
+    def _init_thread(self, vmid, fn_ptr, args, arec):
         ptr = self.push_arec(vmid, arec)
-        state.current_arec_ptr = ptr
-        state.ip = entrypoint_ip
+        state = self._thread_state(fn_ptr, args, arec, ptr)
         self.set_state(vmid, state)
         future = Future()
         self.set_future(vmid, future)
         self.set_stopped(vmid, False)
         return vmid
 
+    ## Write-behind caching (optional - see controllers/ddb.py)
+
+    def begin(self, vmid):
+        """Machine vmid has started running in this process"""
+
+    def flush(self, vmid):
+        """Write out data cached for machine vmid (e.g. before it forks)"""
+
+    def release(self, vmid):
+        """Machine vmid has stopped - write out and forget its cached data"""
+
     ##
 
+    def wait_finished(self, timeout=None, poll_interval=None) -> bool:
+        """Block until all threads have stopped, or timeout seconds have passed
+
+        Returns whether all threads have stopped. This implementation polls
+        all_stopped every poll_interval seconds - controllers should override it
+        with something that doesn't.
+        """
+        poll_interval = poll_interval or 0.1
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.all_stopped():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(poll_interval)
+        return True
+
     def get_top_level_result(self):
         """Get the return value of the top-level thread"""
         # NOTE: if it's not resolved, value will be None
@@ -99,7 +159,7 @@ class Controller:
 
         # Pop parent records until one is still being used
         if collect_garbage:
-            while rec.dynamic_chain:
+            while rec.dynamic_chain is not None:
                 with self.lock_arec(rec.dynamic_chain):
                     parent = self.decrement_ref(rec.dynamic_chain)
                     if parent.ref_count > 0:
@@ -118,12 +178,16 @@ class Controller:
 
         with self.lock_future(vmid):
             future = self.get_future(vmid)
+            waiting, gathers = future.continuations, future.gathers
             future.resolved = True
             future.value = value
+            # The waiters are continued now - later readers only need the value
+            future.continuations = []
+            future.gathers = []
             self.set_future(vmid, future)
 
-            continuations = future.continuations
-            if future.chain:
+            continuations = waiting + self._ready_gathers(gathers)
+            if future.chain is not None:
                 continuations += self.resolve_future(future.chain, value)
 
         if self.is_top_level(vmid):
@@ -147,15 +211,23 @@ class Controller:
         # Otherwise, VALUE is another future, and we can only resolve this machine's
         # future if VALUE has also resolved. If VALUE hasn't resolved, we "chain"
         # this machine's future to it.
-        next_future_id = value.vmid
-        with self.lock_future(next_future_id):
-            next_future = self.get_future(next_future_id)
-            if next_future.resolved:
-                return (next_future.value, self.resolve_future(vmid, next_future.value))
-            else:
-                LOG.info("Chaining %s to %s", vmid, value)
-                self.set_future_chain(next_future_id, vmid)
-                return None, []
+        resolved, next_value = self.chain_future(value.vmid, vmid)
+        if resolved:
+            return (next_value, self.resolve_future(vmid, next_value))
+        return None, []
+
+    def chain_future(self, future_id, vmid):
+        """Chain the future of VMID to FUTURE_ID, unless it has already resolved
+
+        Return tuple (resolved, value), like get_or_wait.
+        """
+        with self.lock_future(future_id):
+            future = self.get_future(future_id)
+            if future.resolved:
+                return True, future.value
+            LOG.info("Chaining %s to %s", vmid, future_id)
+            self.set_future_chain(future_id, vmid)
+            return False, None
 
     def get_or_wait(self, vmid, future_ptr):
         """Get the value of a future in the stack, or add a continuation
@@ -183,13 +255,84 @@ class Controller:
 
         return future.resolved, value
 
+    def gather(self, vmid, future_ptrs) -> tuple:
+        """Get the values of several futures, or wait for all of them
+
+        Like get_or_wait, but the thread is added to the gathers of every
+        unresolved future, and only continued when the last one resolves. The
+        thread's pending count (see add_pending) is the number of futures it's
+        still waiting for, plus one held until it has stopped (see stop).
+
+        Return tuple:
+        - resolved (bool): whether all of the futures have resolved
+        - values: Their values (in order), or None if not resolved
+        """
+        ids = [ptr.vmid for ptr in future_ptrs]
+        futures = self.get_futures(ids)
+        waiting = [i for i, future in zip(ids, futures) if not future.resolved]
+        if not waiting:
+            return True, [future.value for future in futures]
+
+        # Count one extra, which the thread holds until it has stopped, so that
+        # futures resolving in the meantime can't continue it while it's still
+        # running. It's released by stop (see stop_gathering).
+        self.add_pending(vmid, len(waiting) + 1)
+        missed = sum(not self.add_gather(i, vmid) for i in waiting)
+        if self.add_pending(vmid, -missed) > 1:
+            LOG.info("%d waiting on %d futures", vmid, len(waiting) - missed)
+            return False, None
+
+        # They all resolved while adding the gathers
+        self.add_pending(vmid, -1)
+        return True, [future.value for future in self.get_futures(ids)]
+
+    def _ready_gathers(self, gathers) -> list:
+        """Threads in gathers that were waiting for just one more future"""
+        return [vmid for vmid in gathers if self.add_pending(vmid, -1) == 0]
+
+    def add_pending(self, vmid, delta) -> int:
+        """Atomically add delta to the pending count of vmid, returning the total"""
+        raise NotImplementedError
+
+    def stop_gathering(self, vmid) -> bool:
+        """Stop a gathering thread, releasing the pending count it holds
+
+        Both at once (atomically), so that the last future to resolve can only
+        see a zero count once the thread has stopped, and continue it. Unless
+        the held count is all that's left - the futures all resolved while the
+        thread was stopping. Then it's released but the thread isn't stopped,
+        and False is returned: the thread must carry on instead.
+        """
+        raise NotImplementedError
+
+    def get_futures(self, ids) -> list:
+        return [self.get_future(i) for i in ids]
+
+    def add_gather(self, future_id, vmid) -> bool:
+        """Add vmid to the gathers of a future, unless it has resolved"""
+        with self.lock_future(future_id):
+            future = self.get_future(future_id)
+            if future.resolved:
+                return False
+            future.gathers.append(vmid)
+            self.set_future(future_id, future)
+            return True
+
     ##
 
-    def stop(self, vmid, finished_ok):
-        """Signal that a machine has stopped running"""
+    def stop(self, vmid, finished_ok, gathering=False) -> bool:
+        """Signal that a machine has stopped running
+
+        A machine stopped by gather (gathering=True) still holds an extra
+        pending count, released here. Returns False if the machine must carry
+        on running instead (see stop_gathering).
+        """
         if not finished_ok:
             self.broken = True
+        if gathering:
+            return self.stop_gathering(vmid)
         self.set_stopped(vmid, True)
+        return True
 
     ##
 
@@ -214,19 +357,31 @@ class Controller:
         """Get a stack trace for a thread"""
         trace = []
         state = self.get_state(vmid)
-        arec_ptr = state.current_arec_ptr
-        arec = self.get_arec(arec_ptr)
+        frames = state.frames
+        if not frames:
+            return trace
 
         # Push the current frame
         trace.append(
             StackTraceItem(
                 caller_thread=vmid,
                 caller_ip=state.ip - 1,  # minus 1: IP is pre-advanced
-                caller_fn=arec.function.identifier,
+                caller_fn=frames[-1].function.identifier,
             )
         )
 
-        # And then all parents
+        # Then the callers in this thread
+        for caller, frame in zip(frames[-2::-1], frames[:0:-1]):
+            trace.append(
+                StackTraceItem(
+                    caller_thread=vmid,
+                    caller_ip=frame.call_site,
+                    caller_fn=caller.function.identifier,
+                )
+            )
+
+        # And then all parents, in other threads
+        arec_ptr = frames[0].ptr
         while True:
             arec = self.get_arec(arec_ptr)
             if arec.dynamic_chain is not None:
@@ -1,6 +1,6 @@
 """The Hark Machine Executable class"""
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any, Dict, List
 
 from ..cli import interface as ui
@@ -17,6 +17,11 @@ class Executable:
     locations: Dict[str, int]
     code: List[Instruction]
     attributes: dict
+    num_locals: Dict[str, int]  # Number of local variable slots per function
+    # Instructions pre-linked to their handlers, and the imported foreign
+    # functions, both set by the machine (not serialised)
+    linked: list = field(default=None, init=False, repr=False, compare=False)
+    foreign: dict = field(default=None, init=False, repr=False, compare=False)
 
     def listing(self) -> str:
         """Get a pretty assembly listing string"""
@@ -44,7 +49,12 @@ class Executable:
         """Serialise the executable into a JSON-able dict"""
         code = [i.serialise() for i in self.code]
         bindings = {name: val.serialise() for name, val in self.bindings.items()}
-        return dict(locations=self.locations, bindings=bindings, code=code)
+        return dict(
+            locations=self.locations,
+            num_locals=self.num_locals,
+            bindings=bindings,
+            code=code,
+        )
 
     @classmethod
     def deserialise(cls, obj: dict):
@@ -55,5 +65,9 @@ class Executable:
         }
         # FIXME attributes
         return cls(
-            locations=obj["locations"], bindings=bindings, code=code, attributes=None
+            locations=obj["locations"],
+            num_locals=obj["num_locals"],
+            bindings=bindings,
+            code=code,
+            attributes=None,
         )
@@ -7,21 +7,37 @@ _SerialisedFuture = dict
 
 
 class Future:
-    """A future - holds results of function calls"""
-
-    def __init__(self, *, continuations=None, chain=None, resolved=False, value=None):
+    """A future - holds results of function calls
+
+    continuations are threads waiting on just this future, and gathers are
+    threads waiting on several (see Controller.gather).
+    """
+
+    __slots__ = ("continuations", "chain", "resolved", "value", "gathers")
+
+    def __init__(
+        self,
+        *,
+        continuations=None,
+        chain=None,
+        resolved=False,
+        value=None,
+        gathers=None,
+    ):
         self.continuations = [] if not continuations else continuations
+        self.gathers = [] if not gathers else gathers
         self.chain = chain
         self.resolved = resolved
         self.value = value
 
     def serialise(self) -> _SerialisedFuture:
-        value = self.value.serialise() if self.value else None
+        value = self.value.serialise() if self.value is not None else None
         return dict(
             continuations=self.continuations,
             chain=self.chain,
             resolved=self.resolved,
             value=value,
+            gathers=self.gathers,
         )
 
     @classmethod
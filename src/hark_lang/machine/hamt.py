@@ -0,0 +1,176 @@
+"""A persistent hash map (Hash Array Mapped Trie)
+
+Setting a key returns a new map, sharing all but O(log n) nodes with the
+original. Each level of the trie consumes 5 bits of the key's hash, so a map
+with a million keys is about four levels deep.
+
+Nodes are never modified once created, so maps can be shared freely between
+threads.
+"""
+
+from typing import Any, Iterator, Tuple
+
+BITS = 5
+MASK = (1 << BITS) - 1
+HASH_BITS = 32
+
+# Marker for missing keys (None is a valid value)
+_MISSING = object()
+
+
+def _hash(key) -> int:
+    return hash(key) & ((1 << HASH_BITS) - 1)
+
+
+def _popcount(x: int) -> int:
+    return bin(x).count("1")
+
+
+def _replace(entries: tuple, idx: int, entry) -> tuple:
+    return entries[:idx] + (entry,) + entries[idx + 1 :]
+
+
+class _BitmapNode:
+    """A node with up to 32 entries, present ones flagged in the bitmap
+
+    Each entry is either a (key, value) tuple or a child node.
+    """
+
+    __slots__ = ("bitmap", "entries")
+
+    def __init__(self, bitmap: int, entries: tuple):
+        self.bitmap = bitmap
+        self.entries = entries
+
+    def get(self, key, h: int, shift: int):
+        bit = 1 << ((h >> shift) & MASK)
+        if not self.bitmap & bit:
+            return _MISSING
+        entry = self.entries[_popcount(self.bitmap & (bit - 1))]
+        if type(entry) is tuple:
+            return entry[1] if entry[0] == key else _MISSING
+        return entry.get(key, h, shift + BITS)
+
+    def assoc(self, key, value, h: int, shift: int):
+        """Return (new node, whether key was added)"""
+        bit = 1 << ((h >> shift) & MASK)
+        idx = _popcount(self.bitmap & (bit - 1))
+        entries = self.entries
+
+        if not self.bitmap & bit:
+            new_entries = entries[:idx] + ((key, value),) + entries[idx:]
+            return _BitmapNode(self.bitmap | bit, new_entries), True
+
+        entry = entries[idx]
+        if type(entry) is tuple:
+            old_key, old_value = entry
+            if old_key == key:
+                if old_value is value:
+                    return self, False
+                new_entries = _replace(entries, idx, (key, value))
+                return _BitmapNode(self.bitmap, new_entries), False
+            child = _pair_node(
+                old_key, old_value, _hash(old_key), key, value, h, shift + BITS
+            )
+            return _BitmapNode(self.bitmap, _replace(entries, idx, child)), True
+
+        child, added = entry.assoc(key, value, h, shift + BITS)
+        if child is entry:
+            return self, False
+        return _BitmapNode(self.bitmap, _replace(entries, idx, child)), added
+
+    def items(self) -> Iterator[Tuple[Any, Any]]:
+        for entry in self.entries:
+            if type(entry) is tuple:
+                yield entry
+            else:
+                yield from entry.items()
+
+
+class _CollisionNode:
+    """A node for keys whose hashes are identical"""
+
+    __slots__ = ("hash", "entries")
+
+    def __init__(self, h: int, entries: tuple):
+        self.hash = h
+        self.entries = entries
+
+    def get(self, key, h: int, shift: int):
+        for k, v in self.entries:
+            if k == key:
+                return v
+        return _MISSING
+
+    def assoc(self, key, value, h: int, shift: int):
+        if h != self.hash:
+            # Push this node down a level, below a new bitmap node
+            bit = 1 << ((self.hash >> shift) & MASK)
+            return _BitmapNode(bit, (self,)).assoc(key, value, h, shift)
+        for idx, (k, v) in enumerate(self.entries):
+            if k == key:
+                if v is value:
+                    return self, False
+                new_entries = _replace(self.entries, idx, (key, value))
+                return _CollisionNode(h, new_entries), False
+        return _CollisionNode(h, self.entries + ((key, value),)), True
+
+    def items(self) -> Iterator[Tuple[Any, Any]]:
+        yield from self.entries
+
+
+def _pair_node(key1, value1, h1: int, key2, value2, h2: int, shift: int):
+    """Make a node holding two different keys"""
+    if h1 == h2:
+        return _CollisionNode(h1, ((key1, value1), (key2, value2)))
+    idx1 = (h1 >> shift) & MASK
+    idx2 = (h2 >> shift) & MASK
+    if idx1 == idx2:
+        child = _pair_node(key1, value1, h1, key2, value2, h2, shift + BITS)
+        return _BitmapNode(1 << idx1, (child,))
+    entries = ((key1, value1), (key2, value2))
+    if idx2 < idx1:
+        entries = entries[::-1]
+    return _BitmapNode((1 << idx1) | (1 << idx2), entries)
+
+
+_EMPTY_NODE = _BitmapNode(0, ())
+
+
+class Hamt:
+    """A persistent hash map
+
+    Keys must be hashable. Iteration order is unspecified.
+    """
+
+    __slots__ = ("_root", "_size")
+
+    def __init__(self, _root=_EMPTY_NODE, _size=0):
+        self._root = _root
+        self._size = _size
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, key):
+        value = self._root.get(key, _hash(key), 0)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self._root.get(key, _hash(key), 0) is not _MISSING
+
+    def get(self, key, default=None):
+        value = self._root.get(key, _hash(key), 0)
+        return default if value is _MISSING else value
+
+    def set(self, key, value) -> "Hamt":
+        """Return a new map with key set to value"""
+        root, added = self._root.assoc(key, value, _hash(key), 0)
+        if root is self._root:
+            return self
+        return Hamt(root, self._size + added)
+
+    def items(self) -> Iterator[Tuple[Any, Any]]:
+        return self._root.items()
@@ -87,6 +87,8 @@ class Instruction:
         return f"{name:8} {ops}"
 
     def __eq__(self, other):
-        return type(self) == type(other) and all(
-            a == b for a, b in zip(self.operands, other.operands)
+        return (
+            type(self) == type(other)
+            and len(self.operands) == len(other.operands)
+            and all(a == b for a, b in zip(self.operands, other.operands))
         )
@@ -90,6 +90,14 @@ class ACall(I):
     op_types = [int]
 
 
+class MapAsync(I):
+    """Call a function (async) on every element of a list
+
+    Pushes a list of futures, one per element. The threads are all created and
+    invoked together, which is much cheaper than one ACall per element.
+    """
+
+
 ##± Conditions ±################################################################
 
 # Like Exceptions, but a bit more powerful
@@ -140,20 +148,28 @@ class PushV(I):
     op_types = [mt.TlType]
 
 
-class Bind(I):
-    """Take the top value off the stack and bind it to a register
+class BindL(I):
+    """Bind the top value on the stack to a local variable slot
 
-    Maybe - if the given binding doesn't exist in the current binding stack,
-    each parent stack will be searched until a matching binding is found. That'd
-    make this machine far more dynamic! And make compilation harder.
+    Names are resolved at compile time - each function has a fixed number of
+    local slots (parameters and assigned names), allocated when it is called.
 
     """
 
-    op_types = [mt.TlSymbol]
+    op_types = [int]
+
 
+class PushL(I):
+    """Push the value in a local variable slot onto the stack"""
+
+    op_types = [int]
 
-class PushB(I):
-    """Push a bound value onto the stack"""
+
+class PushG(I):
+    """Push a global (executable) binding onto the stack
+
+    Builtins are not globals - they're pushed with PushV, as TlInstructions.
+    """
 
     op_types = [mt.TlSymbol]
 
@@ -308,3 +324,45 @@ class GetSessionId(I):
 
 class GetThreadId(I):
     """Get the current thread ID"""
+
+
+##± Builtins ±##################################################################
+
+# Builtin function name -> Instruction. Globals (functions and imports) with the
+# same name take precedence.
+BUILTINS = {
+    "future": Future,
+    "map_async": MapAsync,
+    "print": Print,
+    "sleep": Sleep,
+    "atomp": Atomp,
+    "nullp": Nullp,
+    "list": List,
+    "conc": Conc,
+    "append": Append,
+    "first": First,
+    "rest": Rest,
+    "length": Length,
+    "hash": Hash,
+    "get": HGet,
+    "set": HSet,
+    "nth": Nth,
+    "==": Eq,
+    "!=": NEq,
+    "+": Plus,
+    "-": Minus,
+    "*": Multiply,
+    "%": Modulo,
+    "/": Divide,
+    ">": GreaterThan,
+    ">=": GreaterThanOrEqual,
+    "<": LessThan,
+    "<=": LessThanOrEqual,
+    "&&": OpAnd,
+    "||": OpOr,
+    "!": BooloeanNeg,
+    "parse_float": ParseFloat,
+    "signal": Signal,
+    "sid": GetSessionId,
+    "tid": GetThreadId,
+}
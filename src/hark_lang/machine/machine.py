@@ -12,13 +12,12 @@ import os
 import sys
 import time
 import traceback
-from functools import singledispatchmethod
 from io import StringIO
 from typing import Any, Dict, List
 
 from ..exceptions import HarkError, UserResolvableError, UnexpectedError
 from . import types as mt
-from .arec import ActivationRecord
+from .arec import ActivationRecord, Frame
 from .controller import Controller
 from .executable import Executable
 from .instruction import Instruction
@@ -57,10 +56,48 @@ def traverse(o, tree_types=(list, tuple)):
         yield o
 
 
-def shortstr(obj, maxl=20) -> str:
-    """Convert an object to string and truncate to a maximum length"""
-    s = str(obj)
-    return (s[:maxl] + "...") if len(s) > maxl else s
+class HandlerTable(dict):
+    """Map Instruction types to the TlMachine methods that evaluate them
+
+    Handlers are registered with the type annotation of their instruction
+    argument (like functools.singledispatch), but dispatch is only done once per
+    instruction, when the executable is linked, instead of on every step.
+
+    """
+
+    def register(self, fn):
+        """Register fn as the handler for its annotated Instruction type"""
+        instr_cls = next(iter(fn.__annotations__.values()))
+        self[instr_cls] = fn
+        return fn
+
+    def lookup(self, instr_cls):
+        """Find the handler for instr_cls (or the nearest base class)"""
+        for cls in instr_cls.__mro__:
+            if cls in self:
+                return self[cls]
+        return _not_implemented
+
+
+def _not_implemented(machine, i: Instruction):
+    raise NotImplementedError(i)
+
+
+def run_inline(vmid, invoker, on_error=None):
+    """Run a machine, and then any continuations it leaves to run in this context
+
+    If a machine raises an exception, on_error (if given) is called with its ID
+    before the exception propagates.
+    """
+    while vmid is not None:
+        try:
+            machine = TlMachine(vmid, invoker)
+            machine.run()
+        except Exception:
+            if on_error:
+                on_error(vmid)
+            raise
+        vmid = machine.next_vmid
 
 
 class TlMachine:
@@ -77,61 +114,77 @@ class TlMachine:
 
     """
 
-    builtins = {
-        "future": Future,
-        "print": Print,
-        "sleep": Sleep,
-        "atomp": Atomp,
-        "nullp": Nullp,
-        "list": List,
-        "conc": Conc,
-        "append": Append,
-        "first": First,
-        "rest": Rest,
-        "length": Length,
-        "hash": Hash,
-        "get": HGet,
-        "set": HSet,
-        "nth": Nth,
-        "==": Eq,
-        "!=": NEq,
-        "+": Plus,
-        "-": Minus,
-        "*": Multiply,
-        "%": Modulo,
-        "/": Divide,
-        ">": GreaterThan,
-        ">=": GreaterThanOrEqual,
-        "<": LessThan,
-        "<=": LessThanOrEqual,
-        "&&": OpAnd,
-        "||": OpOr,
-        "!": BooloeanNeg,
-        "parse_float": ParseFloat,
-        "signal": Signal,
-        "sid": GetSessionId,
-        "tid": GetThreadId,
-    }
+    builtins = BUILTINS
 
     def __init__(self, vmid, invoker):
         self._steps = 0
         self.vmid = vmid
+        # A continuation to run in this context after this machine stops
+        self.next_vmid = None
+        # Whether the thread has returned (see Return)
+        self.finished = False
+        # Whether the thread has stopped to gather futures (see Wait)
+        self.gathering = False
         self.invoker = invoker
         self.dc = invoker.data_controller
+        self.dc.begin(self.vmid)
         self.state = self.dc.get_state(self.vmid)
-        self.probe = Probe(self.vmid)
+        self.probe = Probe(self.vmid, self.dc.probe_mode)
+        self._probe_interval = self.probe.step_interval
         self.exe = self.dc.executable
         if not self.exe:
             raise UnexpectedError("No executable, can't start thread.")
-        self._foreign = {
-            name: import_python_function(val.identifier, val.module)
-            for name, val in self.exe.bindings.items()
-            if isinstance(val, mt.TlForeignPtr)
-        }
+        self._foreign = self.link_foreign(self.exe)
+        self._code = self.link(self.exe)
         LOG.debug("locations %s", self.exe.locations.keys())
         LOG.debug("foreign %s", self._foreign.keys())
         # No entrypoint argument - just set the IP in the state
 
+    @classmethod
+    def link(cls, exe: Executable) -> list:
+        """Resolve the handler for every instruction in exe
+
+        Returns a list of (handler, instruction) pairs, indexed by IP. This is
+        done once per executable and cached on it.
+        """
+        if exe.linked is None:
+            exe.linked = [(cls.handlers.lookup(type(i)), i) for i in exe.code]
+        return exe.linked
+
+    @staticmethod
+    def link_foreign(exe: Executable) -> dict:
+        """Import the foreign functions bound in exe (once per executable)"""
+        if exe.foreign is None:
+            exe.foreign = {
+                name: import_python_function(val.identifier, val.module)
+                for name, val in exe.bindings.items()
+                if isinstance(val, mt.TlForeignPtr)
+            }
+        return exe.foreign
+
+    def store_frames(self) -> int:
+        """Store the frames of this thread that aren't yet in the controller
+
+        Returns the pointer to the current frame's activation record.
+        """
+        frames = self.state.frames
+        first = len(frames)
+        # The first frame is always stored, and stored frames are never above
+        # frames that aren't
+        while frames[first - 1].ptr is None:
+            first -= 1
+        for caller, frame in zip(frames[first - 1 :], frames[first:]):
+            arec = ActivationRecord(
+                function=frame.function,
+                vmid=self.vmid,
+                dynamic_chain=caller.ptr,
+                call_site=frame.call_site,
+                bindings=frame.bindings,
+                ref_count=1,
+            )
+            frame.ptr = self.dc.push_arec(self.vmid, arec)
+        return frames[-1].ptr
+
     @property
     def stopped(self):
         return self.state.stopped
@@ -142,18 +195,15 @@ class TlMachine:
 
     def step(self):
         """Execute the current instruction and increment the IP"""
-        if self.state.ip >= len(self.exe.code):
+        try:
+            handler, instr = self._code[self.state.ip]
+        except IndexError:
             raise UnexpectedError("Instruction Pointer out of bounds")
-        instr = self.exe.code[self.state.ip]
-        self.probe.event(
-            "step",
-            ip=self.state.ip,
-            instr=str(instr),
-            ops=str(instr.operands),
-            top_of_stack=shortstr(self.state._ds[-3:]),
-        )
+        interval = self._probe_interval
+        if interval and self._steps % interval == 0:
+            self.probe.step(self.state.ip, instr, self.state._ds[-3:])
         self.state.ip += 1  # NOTE - IP incremented before evaluation
-        self.evali(instr)
+        handler(self, instr)
         self._steps += 1  # Counts successfully completed steps
 
     def run(self):
@@ -170,10 +220,12 @@ class TlMachine:
         self.probe.event("run")
         broken = False
 
-        self.state.stopped = False
-        while not self.state.stopped:
+        step = self.step
+        state = self.state
+        state.stopped = False
+        while not state.stopped:
             try:
-                self.step()
+                step()
             except HarkError as exc:
                 broken = True
                 self.state.stopped = True
@@ -192,21 +244,29 @@ class TlMachine:
                 break
 
         self.probe.event("stop", steps=self._steps)
+        if self.finished and not broken:
+            # Its result is in its future, and nothing else in the state of a
+            # finished thread is needed again - don't keep the stacks around
+            self.state = State([])
         self.dc.set_state(self.vmid, self.state)
+        self.dc.release(self.vmid)
         self.dc.set_probe_data(self.vmid, self.probe)
         # This order is important. dc.stop must come last to avoid race
         # conditions in us setting/the user reading the state and probe data
-        self.dc.stop(self.vmid, finished_ok=not broken)
+        stopped = self.dc.stop(
+            self.vmid, finished_ok=not broken, gathering=self.gathering
+        )
+        if not stopped:
+            # The futures it was gathering resolved while it was stopping, so
+            # nothing else will continue it (see Controller.stop_gathering)
+            self.next_vmid = self.vmid
 
-    @singledispatchmethod
-    def evali(self, i: Instruction):
-        """Evaluate instruction"""
-        raise NotImplementedError(i)
+    # Instruction evaluation methods, keyed by Instruction type
+    handlers = HandlerTable()
 
-    @evali.register
-    def _(self, i: Bind):
-        """Bind the top value on the data stack to a name"""
-        ptr = str(i.operands[0])
+    @handlers.register
+    def _(self, i: BindL):
+        """Bind the top value on the data stack to a local variable slot"""
         try:
             val = self.state.ds_peek(0)
         except IndexError as exc:
@@ -218,47 +278,37 @@ class TlMachine:
             )
         if not isinstance(val, mt.TlType):
             raise UnexpectedError(f"Bad value to Bind: {val} ({type(val)})")
-        self.state.bindings[ptr] = val
-
-    @evali.register
-    def _(self, i: PushB):
-        """Push the value bound to a name onto the data stack"""
-        # The value on the stack must be a Symbol, which is used to find a
-        # function to call. Binding precedence:
-        #
-        # local binding -> exe global bindings -> builtins
-        sym = i.operands[0]
-        if not isinstance(sym, mt.TlSymbol):
-            raise UnexpectedError(str(ValueError(sym, type(sym))))
-
-        ptr = str(sym)
-        if ptr in self.state.bindings:
-            val = self.state.bindings[ptr]
-        elif ptr in self.exe.bindings:
-            val = self.exe.bindings[ptr]
-        elif ptr in TlMachine.builtins:
-            val = mt.TlInstruction(ptr)
-        else:
-            # FIXME should be a compile time check
-            raise UserResolvableError(f"'{ptr}' is not defined", "")
-
+        self.state.bindings[i.operands[0]] = val
+
+    @handlers.register
+    def _(self, i: PushL):
+        """Push the value in a local variable slot onto the data stack"""
+        val = self.state.bindings[i.operands[0]]
+        if val is None:
+            # The name is assigned somewhere in this function, but not yet
+            raise UserResolvableError("Local variable used before assignment", "")
         self.state.ds_push(val)
 
-    @evali.register
+    @handlers.register
+    def _(self, i: PushG):
+        """Push a global binding (a function or import) onto the data stack"""
+        self.state.ds_push(self.exe.bindings[i.operands[0]])
+
+    @handlers.register
     def _(self, i: PushV):
         val = i.operands[0]
         self.state.ds_push(val)
 
-    @evali.register
+    @handlers.register
     def _(self, i: Pop):
         self.state.ds_pop()
 
-    @evali.register
+    @handlers.register
     def _(self, i: Jump):
         distance = i.operands[0]
         self.state.ip += distance
 
-    @evali.register
+    @handlers.register
     def _(self, i: JumpIf):
         distance = i.operands[0]
         a = self.state.ds_pop()
@@ -266,54 +316,52 @@ class TlMachine:
         if not isinstance(a, (mt.TlNull, mt.TlFalse)):
             self.state.ip += distance
 
-    @evali.register
+    @handlers.register
     def _(self, i: Return):
-        # Only return if there's somewhere to go to, and it's in the same thread
-        current_arec = self.dc.pop_arec(self.state.current_arec_ptr)
-        if current_arec.dynamic_chain is not None:
-            new_arec = self.dc.get_arec(current_arec.dynamic_chain)
-            if new_arec.vmid == self.vmid:
-                self.probe.event("return")
-                self.state.current_arec_ptr = current_arec.dynamic_chain  # the new AR
-                self.state.ip = current_arec.call_site + 1
-                self.state.bindings = new_arec.bindings
-                return
+        frames = self.state.frames
+        frame = frames[-1]
+        if frame.ptr is not None:
+            self.dc.pop_arec(frame.ptr)
+
+        # Only return if there's somewhere to go to in this thread. The first
+        # frame is the thread's entry point (its caller is in another thread).
+        if len(frames) > 1:
+            self.probe.event("return")
+            frames.pop()
+            self.state.ip = frame.call_site + 1
+            self.state.bindings = frames[-1].bindings
+            return
 
         # Otherwise, this thread has finished!
         self.state.stopped = True
+        self.finished = True
         value = self.state.ds_peek(0)
-        self.probe.log(f"Returning value: {shortstr(value)}")
+        self.probe.log("Returning value: %s", value)
         value, continuations = self.dc.finish(self.vmid, value)
         for machine in continuations:
             self.dc.set_stopped(machine, False)
-            # FIXME - invoke all of the machines except the last one. That
-            # one, just run in this context. Save one invocation. Caution:
-            # tricky with Lambda timeouts.
-            self.invoker.invoke(machine)
+        if continuations and self.invoker.inline_continuations:
+            # Run the last one in this context once this machine has stopped
+            # (see run_inline), saving an invocation.
+            *continuations, self.next_vmid = continuations
+        self.invoker.invoke_many(continuations)
 
-    @evali.register
+    @handlers.register
     def _(self, i: Call):
         # Arguments for the function must already be on the stack
         num_args = i.operands[0]
-        # The value to call will have been retrieved earlier by PushB.
+        # The value to call will have been pushed earlier (e.g. by PushG).
         fn = self.state.ds_pop()
 
         if isinstance(fn, mt.TlFunctionPtr):
-            self.probe.event("call", function=str(fn))
-            self.state.bindings = {}
-            arec = ActivationRecord(
-                function=fn,
-                vmid=self.vmid,
-                dynamic_chain=self.state.current_arec_ptr,
-                call_site=self.state.ip - 1,
-                bindings=self.state.bindings,
-                ref_count=1,
-            )
-            self.state.current_arec_ptr = self.dc.push_arec(self.vmid, arec)
+            self.probe.event("call", function=fn)
+            bindings = [None] * self.exe.num_locals[fn.identifier]
+            self.state.frames.append(Frame(fn, self.state.ip - 1, bindings))
+            self.state.bindings = bindings
             self.state.ip = self.exe.locations[fn.identifier]
 
         elif isinstance(fn, mt.TlForeignPtr):
-            self.probe.event("call_foreign", function=str(fn))
+            self.probe.event("call_foreign", function=fn)
             foreign_f = self._foreign[fn.identifier]
             args = tuple(reversed([self.state.ds_pop() for _ in range(num_args)]))
             # TODO automatically wait for the args? Somehow mark which one we're
@@ -341,21 +389,35 @@ class TlMachine:
             self.state.ds_push(result)
 
         elif isinstance(fn, mt.TlInstruction):
-            self.probe.event("call_builtin", function=str(fn))
-            instr = TlMachine.builtins[fn](num_args)
-            self.evali(instr)
+            if self.probe.trace_builtins:
+                self.probe.event("call_builtin", function=fn)
+            # Builtins take the number of arguments as their only operand, just
+            # like Call, so evaluate them with this instruction directly
+            TlMachine.builtin_handlers[fn](self, i)
 
         else:
             # FIXME this should be a compile time check
             raise UnexpectedError(f"Don't know how to call `{fn}' of type {type(fn)}.")
 
-    @evali.register
+    @handlers.register
     def _(self, i: ACall):
         # Arguments for the function must already be on the stack
         # ACall can *only* call functions in self.locations (unlike Call)
         num_args = i.operands[0]
-        fn_ptr = self.state.ds_pop()
+        fn_ptr = self._async_target(self.state.ds_pop())
+        args = reversed([self.state.ds_pop() for _ in range(num_args)])
+        # The new thread refers to the current frame, so it must be stored first
+        caller_ptr = self.store_frames()
+        self.dc.flush(self.vmid)
+        machine = self.dc.thread_machine(caller_ptr, self.state.ip, fn_ptr, args)
+        self.invoker.invoke(machine)
+        future = mt.TlFuturePtr(machine)
+
+        self.probe.event("fork", to_function=fn_ptr.identifier, to_thread=machine)
+        self.state.ds_push(future)
 
+    def _async_target(self, fn_ptr) -> mt.TlFunctionPtr:
+        """Get the function to call in a new thread"""
         # FIXME ugh.
         if isinstance(fn_ptr, mt.TlForeignPtr):
             fn_ptr = mt.TlFunctionPtr(f"#F:{fn_ptr.qualified_name}")
@@ -367,28 +429,37 @@ class TlMachine:
             raise UserResolvableError(
                 f"Can't find function `{fn_ptr}'.", "Does it really exist?"
             )
+        return fn_ptr
 
-        args = reversed([self.state.ds_pop() for _ in range(num_args)])
-        machine = self.dc.thread_machine(
-            self.state.current_arec_ptr, self.state.ip, fn_ptr, args
+    @handlers.register
+    def _(self, i: MapAsync):
+        lst = self.state.ds_pop()
+        fn_ptr = self._async_target(self.state.ds_pop())
+        if not isinstance(lst, mt.TlList):
+            raise UserResolvableError(f"{lst} ({type(lst)}) is not a list", "")
+
+        caller_ptr = self.store_frames()
+        self.dc.flush(self.vmid)
+        machines = self.dc.thread_machines(
+            caller_ptr, self.state.ip, fn_ptr, [[elt] for elt in lst]
         )
-        self.invoker.invoke(machine)
-        future = mt.TlFuturePtr(machine)
+        self.invoker.invoke_many(machines)
 
-        self.probe.event("fork", to_function=fn_ptr.identifier, to_thread=machine)
-        self.state.ds_push(future)
+        for machine in machines:
+            self.probe.event("fork", to_function=fn_ptr.identifier, to_thread=machine)
+        self.state.ds_push(mt.TlList(mt.TlFuturePtr(m) for m in machines))
 
-    @evali.register
+    @handlers.register
     def _(self, i: Wait):
         val = self.state.ds_peek(0)
 
         if isinstance(val, mt.TlFuturePtr):
             resolved, result = self.dc.get_or_wait(self.vmid, val)
             if resolved:
-                self.probe.log(f"{val} resolved, got {shortstr(result)}")
+                self.probe.log("%s resolved, got %s", val, result)
                 self.state.ds_set(0, result)
             else:
-                self.probe.log(f"Waiting for {val}")
+                self.probe.log("Waiting for %s", val)
                 # repeat the Wait instruction again:
                 #
                 # NOTE: Wait cannot be a builtin for this to work! It must be an
@@ -396,17 +467,37 @@ class TlMachine:
                 self.state.ip -= 1
                 self.state.stopped = True
 
-        elif isinstance(val, list) and any(
-            isinstance(elt, mt.TlFuturePtr) for elt in traverse(val)
+        elif isinstance(val, mt.TlList) and any(
+            isinstance(elt, mt.TlFuturePtr) for elt in val
+        ):
+            # Wait for all of them at once, and continue just once
+            ptrs = [elt for elt in val if isinstance(elt, mt.TlFuturePtr)]
+            resolved, values = self.dc.gather(self.vmid, ptrs)
+            if resolved:
+                self.probe.log("%s futures resolved", len(ptrs))
+                values = iter(values)
+                self.state.ds_set(
+                    0,
+                    mt.TlList(
+                        next(values) if isinstance(elt, mt.TlFuturePtr) else elt
+                        for elt in val
+                    ),
+                )
+            else:
+                self.probe.log("Waiting for %s futures", len(ptrs))
+                self.state.ip -= 1
+                self.state.stopped = True
+                self.gathering = True
+
+        elif isinstance(val, mt.TlList) and any(
+            isinstance(elt, mt.TlFuturePtr) for elt in traverse(val, mt.TlList)
         ):
-            # The programmer is responsible for waiting on all elements
-            # of lists.
             # NOTE - we don't try to detect futures hidden in other
             # kinds of structured data, which could cause runtime bugs!
             raise UserResolvableError(
-                "Waiting on a list that contains futures!",
-                "For now, you (the programmer) are responsible for waiting on all "
-                "elements of structured data. For example, use map and await.",
+                "Waiting on a nested list that contains futures!",
+                "Only futures directly in a list are waited on together. You (the "
+                "programmer) are responsible for waiting on nested lists.",
             )
 
         else:
@@ -416,7 +507,7 @@ class TlMachine:
 
     ## "builtins":
 
-    @evali.register
+    @handlers.register
     def _(self, i: Future):
         wrapped = str(self.state.ds_pop())
         plugin_name = str(self.state.ds_pop())
@@ -432,24 +523,24 @@ class TlMachine:
             self.probe.log("Skipping call to plugin - controller doesn't support it")
             self.state.ds_push(wrapped)
 
-    @evali.register
+    @handlers.register
     def _(self, i: Atomp):
         val = self.state.ds_pop()
         self.state.ds_push(tl_bool(not isinstance(val, list)))
 
-    @evali.register
+    @handlers.register
     def _(self, i: Nullp):
         val = self.state.ds_pop()
         isnull = isinstance(val, mt.TlNull) or len(val) == 0
         self.state.ds_push(tl_bool(isnull))
 
-    @evali.register
+    @handlers.register
     def _(self, i: List):
         num_args = i.operands[0]
         elts = [self.state.ds_pop() for _ in range(num_args)]
         self.state.ds_push(mt.TlList(reversed(elts)))
 
-    @evali.register
+    @handlers.register
     def _(self, i: Conc):
         b = self.state.ds_pop()
         a = self.state.ds_pop()
@@ -462,11 +553,11 @@ class TlMachine:
             raise UserResolvableError(f"b ({b}, {type(b)}) is not a list", "")
 
         if isinstance(a, mt.TlList):
-            self.state.ds_push(mt.TlList(a + b))
+            self.state.ds_push(a + b)
         else:
-            self.state.ds_push(mt.TlList([a] + b))
+            self.state.ds_push(b.prepended(a))
 
-    @evali.register
+    @handlers.register
     def _(self, i: Append):
         b = self.state.ds_pop()
         a = self.state.ds_pop()
@@ -477,23 +568,23 @@ class TlMachine:
             # TODO compile time checks...
             raise UserResolvableError(f"{a} ({type(a)}) is not a list", "")
 
-        self.state.ds_push(mt.TlList(a + [b]))
+        self.state.ds_push(a.appended(b))
 
-    @evali.register
+    @handlers.register
     def _(self, i: First):
         lst = self.state.ds_pop()
         if not isinstance(lst, mt.TlList):
             raise UserResolvableError(f"{lst} ({type(lst)}) is not a list", "")
         self.state.ds_push(lst[0])
 
-    @evali.register
+    @handlers.register
     def _(self, i: Rest):
         lst = self.state.ds_pop()
         if not isinstance(lst, mt.TlList):
             raise UserResolvableError(f"{lst} ({type(lst)}) is not a list", "")
-        self.state.ds_push(lst[1:])
+        self.state.ds_push(lst.rest())
 
-    @evali.register
+    @handlers.register
     def _(self, i: Nth):
         n = self.state.ds_pop()
         lst = self.state.ds_pop()
@@ -501,14 +592,14 @@ class TlMachine:
             raise UserResolvableError(f"{lst} ({type(lst)}) is not a list", "")
         self.state.ds_push(lst[n])
 
-    @evali.register
+    @handlers.register
     def _(self, i: Length):
         lst = self.state.ds_pop()
         if not isinstance(lst, mt.TlList):
             raise UserResolvableError(f"{lst} ({type(lst)}) is not a list", "")
         self.state.ds_push(mt.TlInt(len(lst)))
 
-    @evali.register
+    @handlers.register
     def _(self, i: Hash):
         num_args = i.operands[0]
         # convert list [a, b, c, d] (reversed) -> dict {a: b, c: d}
@@ -516,7 +607,7 @@ class TlMachine:
         pairs = zip(elts[::2], elts[1::2])
         self.state.ds_push(mt.TlHash(pairs))
 
-    @evali.register
+    @handlers.register
     def _(self, i: HGet):
         key = self.state.ds_pop()
         obj = self.state.ds_pop()
@@ -525,10 +616,10 @@ class TlMachine:
         try:
             res = obj[key]
         except KeyError:
-            res = mt.TlNull()
+            res = mt.NULL
         self.state.ds_push(res)
 
-    @evali.register
+    @handlers.register
     def _(self, i: HSet):
         value = self.state.ds_pop()
         key = self.state.ds_pop()
@@ -536,55 +627,55 @@ class TlMachine:
         if not isinstance(obj, mt.TlHash):
             raise UserResolvableError(f"{obj} ({type(obj)}) is not a hash", "")
         # Create a new object, overwriting the old key
-        self.state.ds_push(mt.TlHash({**obj, key: value}))
+        self.state.ds_push(obj.set(key, value))
 
-    @evali.register
+    @handlers.register
     def _(self, i: Plus):
         a = self.state.ds_pop()
         b = self.state.ds_pop()
         cls = new_number_type(a, b)
         self.state.ds_push(cls(a + b))
 
-    @evali.register
+    @handlers.register
     def _(self, i: Minus):
         a = self.state.ds_pop()
         b = self.state.ds_pop()
         cls = new_number_type(a, b)
         self.state.ds_push(cls(a - b))
 
-    @evali.register
+    @handlers.register
     def _(self, i: Multiply):
         a = self.state.ds_pop()
         b = self.state.ds_pop()
         cls = new_number_type(a, b)
         self.state.ds_push(cls(a * b))
 
-    @evali.register
+    @handlers.register
     def _(self, i: Divide):
         a = self.state.ds_pop()
         b = self.state.ds_pop()
         cls = new_number_type(a, b)
         self.state.ds_push(cls(a / b))
 
-    @evali.register
+    @handlers.register
     def _(self, i: Modulo):
         a = self.state.ds_pop()
         b = self.state.ds_pop()
         self.state.ds_push(mt.TlInt(a % b))
 
-    @evali.register
+    @handlers.register
     def _(self, i: Eq):
         a = self.state.ds_pop()
         b = self.state.ds_pop()
         self.state.ds_push(tl_bool(a == b))
 
-    @evali.register
+    @handlers.register
     def _(self, i: GreaterThan):
         a = self.state.ds_pop()
         b = self.state.ds_pop()
         self.state.ds_push(tl_bool(a > b))
 
-    @evali.register
+    @handlers.register
     def _(self, i: LessThan):
         a = self.state.ds_pop()
         b = self.state.ds_pop()
@@ -597,7 +688,7 @@ class TlMachine:
                 f"Got {a.__tlname__} and {b.__tlname__}",
             )
 
-    @evali.register
+    @handlers.register
     def _(self, i: OpAnd):
         # FIXME no short-circuit behaviour
         a = self.state.ds_pop()
@@ -607,7 +698,7 @@ class TlMachine:
             tl_bool(isinstance(a, mt.TlTrue) and isinstance(b, mt.TlTrue))
         )
 
-    @evali.register
+    @handlers.register
     def _(self, i: OpOr):
         # FIXME no short-circuit behaviour
         a = self.state.ds_pop()
@@ -617,12 +708,12 @@ class TlMachine:
             tl_bool(isinstance(a, mt.TlTrue) or isinstance(b, mt.TlTrue))
         )
 
-    @evali.register
+    @handlers.register
     def _(self, i: BooloeanNeg):
         a = self.state.ds_pop()
         self.state.ds_push(tl_bool(not mt.to_py_type(a)))
 
-    @evali.register
+    @handlers.register
     def _(self, i: UnaryMinus):
         a = self.state.ds_pop()
         if isinstance(a, float):
@@ -632,35 +723,35 @@ class TlMachine:
         else:
             raise UnexpectedError("cannot negate non-numeric types")
 
-    @evali.register
+    @handlers.register
     def _(self, i: NEq):
         a = self.state.ds_pop()
         b = self.state.ds_pop()
         self.state.ds_push(tl_bool(a != b))
 
-    @evali.register
+    @handlers.register
     def _(self, i: GreaterThanOrEqual):
         a = self.state.ds_pop()
         b = self.state.ds_pop()
         self.state.ds_push(tl_bool(a >= b))
 
-    @evali.register
+    @handlers.register
     def _(self, i: LessThanOrEqual):
         a = self.state.ds_pop()
         b = self.state.ds_pop()
         self.state.ds_push(tl_bool(a <= b))
 
-    @evali.register
+    @handlers.register
     def _(self, i: ParseFloat):
         x = self.state.ds_pop()
         self.state.ds_push(mt.TlFloat(float(x)))
 
-    @evali.register
+    @handlers.register
     def _(self, i: Sleep):
         t = self.state.ds_peek(0)
         time.sleep(t)
 
-    @evali.register
+    @handlers.register
     def _(self, i: Print):
         # Leave the value in the stack - print() 'returns' the value printed
         val = self.state.ds_peek(0)
@@ -668,7 +759,7 @@ class TlMachine:
         # Could also store a timestamp...
         self.dc.write_stdout(StdoutItem(self.vmid, str(val) + "\n"))
 
-    @evali.register
+    @handlers.register
     def _(self, i: Signal):
         msg = self.state.ds_peek(0)
         val = self.state.ds_peek(1)
@@ -677,11 +768,11 @@ class TlMachine:
             raise UnhandledError(msg)
         # other kinds of signals don't need special handling
 
-    @evali.register
+    @handlers.register
     def _(self, i: GetSessionId):
         self.state.ds_push(mt.TlString(self.dc.session_id))
 
-    @evali.register
+    @handlers.register
     def _(self, i: GetThreadId):
         self.state.ds_push(mt.TlInt(self.vmid))
 
@@ -689,11 +780,18 @@ class TlMachine:
         return f"<Machine {id(self)}>"
 
 
+# Builtin function name -> evaluation method
+TlMachine.builtin_handlers = {
+    name: TlMachine.handlers.lookup(instr_cls)
+    for name, instr_cls in TlMachine.builtins.items()
+}
+
+
 def tl_bool(val):
     """Make a Hark bool-ish from val"""
     if val not in (True, False):
         raise UnexpectedError(str(ValueError(val)))
-    return mt.TlTrue() if val is True else mt.TlFalse()
+    return mt.TRUE if val is True else mt.FALSE
 
 
 def new_number_type(a, b):
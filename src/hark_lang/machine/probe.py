@@ -1,40 +1,167 @@
-"""Machine Probe"""
+"""Machine Probe
 
+The probe records what a machine does, for debugging and monitoring. How much
+is recorded is set by the probe mode:
+
+- off:        nothing
+- calls:      thread, function call, fork and return events, and logs (default)
+- sampled[:N]: as calls, plus every Nth step (N defaults to 100)
+- full:       as calls, plus every step and builtin call
+
+The mode can be set per session (see the controllers), and defaults to the
+HARK_PROBE environment variable.
+
+Nothing is formatted when the event is recorded - only when the probe data is
+read (i.e. when it is persisted by the controller).
+"""
+
+import datetime
+import os
+import time
 from dataclasses import dataclass
+from typing import Tuple
+
+from ..exceptions import UserResolvableError
+from .hark_serialisable import HarkSerialisable
+
+# Probe modes
+PROBE_OFF = "off"
+PROBE_CALLS = "calls"
+PROBE_SAMPLED = "sampled"
+PROBE_FULL = "full"
 
-from .types import TlType
-from .hark_serialisable import HarkSerialisable, now_str
+PROBE_MODES = (PROBE_OFF, PROBE_CALLS, PROBE_SAMPLED, PROBE_FULL)
 
+DEFAULT_PROBE_MODE = PROBE_CALLS
+DEFAULT_SAMPLE_INTERVAL = 100
 
-@dataclass(frozen=True)
+
+@dataclass
 class ProbeLog(HarkSerialisable):
     thread: int
-    time: int
+    time: str
     text: str
 
 
-@dataclass(frozen=True)
+@dataclass
 class ProbeEvent(HarkSerialisable):
     thread: int
-    time: int
+    time: str
     event: str
     data: dict
 
     # TODO deserialise?
 
 
+def parse_probe_mode(spec: str) -> Tuple[str, int]:
+    """Parse a probe mode spec (e.g. "sampled:10") into (mode, step interval)
+
+    The step interval is the number of steps between step events (0 for none).
+    """
+    mode, _, interval = spec.strip().lower().partition(":")
+    if mode not in PROBE_MODES:
+        raise UserResolvableError(
+            f"Bad probe mode `{spec}'.", f"Supported modes: {', '.join(PROBE_MODES)}"
+        )
+    if interval and mode != PROBE_SAMPLED:
+        raise UserResolvableError(
+            f"Bad probe mode `{spec}'.", "Only `sampled' takes an interval"
+        )
+    if mode == PROBE_SAMPLED:
+        try:
+            step_interval = int(interval) if interval else DEFAULT_SAMPLE_INTERVAL
+        except ValueError:
+            step_interval = 0
+        if step_interval < 1:
+            raise UserResolvableError(
+                f"Bad probe sample interval `{interval}'.",
+                "Must be a positive integer",
+            )
+        return mode, step_interval
+    return mode, 1 if mode == PROBE_FULL else 0
+
+
+def default_probe_mode() -> str:
+    """Get the probe mode to use when a session doesn't specify one"""
+    return os.getenv("HARK_PROBE", DEFAULT_PROBE_MODE)
+
+
+def _fmt_time(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp).isoformat()
+
+
+def _fmt_value(value):
+    """Make an event data value JSON-able"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def shortstr(obj, maxl=20) -> str:
+    """Convert an object to string and truncate to a maximum length"""
+    s = str(obj)
+    return (s[:maxl] + "...") if len(s) > maxl else s
+
+
 class Probe:
-    """A small interface for storing machine logs and events"""
+    """A small interface for storing machine logs and events
+
+    Events and logs are stored unformatted, and only converted to ProbeEvent and
+    ProbeLog objects when the events and logs properties are read.
+    """
 
-    def __init__(self, vmid):
+    def __init__(self, vmid, mode: str = None):
         self.vmid = vmid
-        self.logs = []
-        self.events = []
+        self.mode, self.step_interval = parse_probe_mode(mode or default_probe_mode())
+        # Whether to record anything at all
+        self.enabled = self.mode != PROBE_OFF
+        # Whether to record calls to builtin functions
+        self.trace_builtins = self.mode == PROBE_FULL
+        self._logs = []
+        self._events = []
 
     def event(self, etype: str, **data):
-        e = ProbeEvent(thread=self.vmid, time=now_str(), event=etype, data=data)
-        self.events.append(e)
+        if self.enabled:
+            self._events.append((time.time(), etype, data))
+
+    def step(self, ip: int, instr, top_of_stack: list):
+        """Record a machine step (the caller decides whether to sample it)"""
+        self._events.append((time.time(), None, (ip, instr, top_of_stack)))
+
+    def log(self, text: str, *args):
+        """Record a log message. text is %-formatted with args, if given"""
+        if self.enabled:
+            self._logs.append((time.time(), text, args))
+
+    @property
+    def events(self):
+        result = []
+        for timestamp, etype, data in self._events:
+            if etype is None:
+                ip, instr, top_of_stack = data
+                etype = "step"
+                data = dict(
+                    ip=ip,
+                    instr=str(instr),
+                    ops=str(instr.operands),
+                    top_of_stack=shortstr(top_of_stack),
+                )
+            else:
+                data = {k: _fmt_value(v) for k, v in data.items()}
+            result.append(
+                ProbeEvent(
+                    thread=self.vmid, time=_fmt_time(timestamp), event=etype, data=data
+                )
+            )
+        return result
 
-    def log(self, text):
-        l = ProbeLog(thread=self.vmid, time=now_str(), text=text)
-        self.logs.append(l)
+    @property
+    def logs(self):
+        return [
+            ProbeLog(
+                thread=self.vmid,
+                time=_fmt_time(timestamp),
+                text=(text % tuple(map(shortstr, args))) if args else text,
+            )
+            for timestamp, text, args in self._logs
+        ]
@@ -1,5 +1,6 @@
 """Machine state representation"""
 
+from .arec import Frame
 from .types import TlType
 
 # TODO convert this class to HarkSerialisable, there's duplicated logic. Sorry -
@@ -9,13 +10,20 @@ from .types import TlType
 class State:
     """Data local/specific to a particular thread"""
 
+    __slots__ = ("ip", "_ds", "stopped", "frames", "bindings", "error_msg")
+
     def __init__(self, data):
         self.ip = 0
         self._ds = list(data)
         self.stopped = False
-        self.bindings = {}
+        self.frames = []  # call stack of this thread (see arec.Frame)
+        self.bindings = []  # local variable slots of the current frame
         self.error_msg = None
-        self.current_arec_ptr = None
+
+    def set_frames(self, frames: list):
+        """Set the call stack, and the current bindings from it"""
+        self.frames = frames
+        self.bindings = frames[-1].bindings if frames else []
 
     def ds_push(self, val):
         if not isinstance(val, TlType):
@@ -41,12 +49,19 @@ class State:
     def to_table(self):
         return (
             "Bind: "
-            + ", ".join(f"{k}->{v}" for k, v in self.bindings.items())
+            + ", ".join(f"{k}->{v}" for k, v in enumerate(self.bindings))
             + f"\nData: {self._ds}"
         )
 
     def __eq__(self, other):
-        return self.serialise() == other.serialise()
+        return (
+            isinstance(other, State)
+            and self.ip == other.ip
+            and self.stopped == other.stopped
+            and self.error_msg == other.error_msg
+            and self.frames == other.frames
+            and self._ds == other._ds
+        )
 
     def __str__(self):
         return f"<State {id(self)} ip={self.ip}>"
@@ -56,9 +71,8 @@ class State:
             ip=self.ip,
             stopped=self.stopped,
             ds=[value.serialise() for value in self._ds],
-            bindings={name: value.serialise() for name, value in self.bindings.items()},
+            frames=[frame.serialise() for frame in self.frames],
             error_msg=self.error_msg,
-            current_arec_ptr=self.current_arec_ptr,
         )
 
     @classmethod
@@ -67,9 +81,6 @@ class State:
         s.ip = data["ip"]
         s.stopped = data["stopped"]
         s._ds = [TlType.deserialise(obj) for obj in data["ds"]]
-        s.bindings = {
-            name: TlType.deserialise(val) for name, val in data["bindings"].items()
-        }
+        s.set_frames([Frame.deserialise(f) for f in data["frames"]])
         s.error_msg = data["error_msg"]
-        s.current_arec_ptr = data["current_arec_ptr"]
         return s
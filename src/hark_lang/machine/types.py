@@ -6,7 +6,9 @@ See https://docs.python.org/3/library/json.html#py-to-json-table
 """
 
 from typing import Optional
-from collections import UserList, UserDict
+from collections.abc import Mapping, Sequence
+
+from .hamt import Hamt
 
 # TODO Convert these to dataclasses
 
@@ -14,6 +16,8 @@ from collections import UserList, UserDict
 class TlType:
     """Base class"""
 
+    __slots__ = ()
+
     @property
     def __tlname__(self):
         return type(self).__name__
@@ -25,6 +29,9 @@ class TlType:
         return [type(self).__name__, self.serialise_data()]
 
     def __eq__(self, other):
+        # Slow fallback - subclasses compare natively
+        if not isinstance(other, TlType):
+            return NotImplemented
         return self.serialise() == other.serialise()
 
     @classmethod
@@ -40,6 +47,23 @@ class TlType:
 class TlAtomic(TlType):
     """Atomic (singleton) types"""
 
+    __slots__ = ()
+
+    def __new__(cls):
+        # One instance per class. Look in the class's own __dict__ so that
+        # subclasses don't get their parent's instance.
+        instance = cls.__dict__.get("_instance")
+        if instance is None:
+            instance = super().__new__(cls)
+            cls._instance = instance
+        return instance
+
+    def __eq__(self, other):
+        return type(self) is type(other)
+
+    def __hash__(self):
+        return hash(type(self))
+
     def serialise_data(self):
         return None
 
@@ -51,10 +75,14 @@ class TlAtomic(TlType):
 class TlTrue(TlAtomic):
     """Represent True"""
 
+    __slots__ = ()
+
 
 class TlFalse(TlAtomic):
     """Represent False"""
 
+    __slots__ = ()
+
 
 BOOLEANS = (TlTrue, TlFalse)
 
@@ -62,18 +90,31 @@ BOOLEANS = (TlTrue, TlFalse)
 class TlNull(TlAtomic):
     """Represent Null (None)"""
 
+    __slots__ = ()
+
+
+# Interned atomics
+TRUE = TlTrue()
+FALSE = TlFalse()
+NULL = TlNull()
+
 
 ### Literals
 
 
 class TlLiteral(TlType):
-    """A literal data which has an underlying Python type"""
+    """A literal data which has an underlying Python type
+
+    Subclasses of Python types are their own value (see the value properties
+    below), so they don't need any per-instance storage.
+    """
+
+    __slots__ = ()
 
     def __init__(self, value):
         # Restrict to JSON literals (and disallow subclasses of them)
         if type(value) not in (str, float, int):
             raise ValueError(value, type(value))
-        self.value = value
 
     def serialise_data(self):
         return self.value
@@ -82,39 +123,78 @@ class TlLiteral(TlType):
     def from_data(cls, value):
         return cls(value)
 
+    # NOTE: subclasses of Python types use the Python type's __eq__/__hash__
+    def __eq__(self, other):
+        return type(self) is type(other) and self.value == other.value
+
+    def __hash__(self):
+        return hash((type(self), self.value))
+
     def __repr__(self):
         kind = type(self).__name__
         return f"<{kind} {self.value}>"
 
 
 class TlSymbol(str, TlLiteral):
-    pass
+    __slots__ = ()
+    value = property(str)
 
 
 class TlFloat(float, TlLiteral):
-    pass
+    __slots__ = ()
+    value = property(float)
+
+
+# Range of cached TlInts (as in CPython)
+SMALL_INT_MIN = -5
+SMALL_INT_MAX = 256
 
 
 class TlInt(int, TlLiteral):
-    pass
+    __slots__ = ()
+    value = property(int)
+
+    def __new__(cls, value=0):
+        if (
+            cls is TlInt
+            and type(value) is int
+            and SMALL_INT_MIN <= value <= SMALL_INT_MAX
+        ):
+            return _SMALL_INTS[value - SMALL_INT_MIN]
+        return super().__new__(cls, value)
+
+
+_SMALL_INTS = tuple(
+    int.__new__(TlInt, value) for value in range(SMALL_INT_MIN, SMALL_INT_MAX + 1)
+)
 
 
 class TlString(str, TlLiteral):
-    pass
+    __slots__ = ()
+    value = property(str)
 
 
 class TlInstruction(str, TlLiteral):
     """A Hark machine instruction"""
 
+    __slots__ = ()
+    value = property(str)
+
 
 class TlFuturePtr(TlLiteral):
     """Pointer to a TlFuture"""
 
+    __slots__ = ("value",)
+
     def __init__(self, future_id):
         if type(future_id) not in (int, str):
             raise TypeError(future_id)
         super().__init__(future_id)
-        self.vmid = future_id
+        self.value = future_id
+
+    @property
+    def vmid(self):
+        return self.value
 
 
 ### Complex types
@@ -123,9 +203,17 @@ class TlFuturePtr(TlLiteral):
 class TlQuote(TlType):
     """A quoted value"""
 
+    __slots__ = ("data",)
+
     def __init__(self, data):
         self.data = data
 
+    def __eq__(self, other):
+        return type(self) is type(other) and self.data == other.data
+
+    def __hash__(self):
+        return hash((type(self), self.data))
+
     def serialise_data(self):
         # self.data is another TlType that needs to be serialised
         return self.data.serialise()
@@ -135,27 +223,205 @@ class TlQuote(TlType):
         return cls(TlType.deserialise(data))
 
 
-class TlList(UserList, TlType):
+class TlList(Sequence, TlType):
+    """A persistent list
+
+    Lists are values: adding to or taking from a list creates a new list, and
+    never changes the original. To make that cheap, lists share storage:
+
+    - appended, prepended and rest are O(1) (amortised), and
+    - indexing and len are O(1).
+
+    Storage is two Python lists, "front" (stored reversed, grown by prepend)
+    and "back" (grown by append), and a list is a [start, end) view onto them.
+    Logical index i >= 0 is back[i], and i < 0 is front[~i].
+
+    Only the list whose view ends at the end of the storage may extend it in
+    place. Any other list (e.g. an older version that has since been appended
+    to) copies instead. Python list appends are atomic, so this is safe
+    between threads too: whoever's item lands in the slot owns it.
+    """
+
+    __slots__ = ("_front", "_back", "_start", "_end")
+
+    def __init__(self, items=()):
+        self._front = []
+        self._back = list(items)
+        self._start = 0
+        self._end = len(self._back)
+
+    @classmethod
+    def _view(cls, front: list, back: list, start: int, end: int) -> "TlList":
+        obj = cls.__new__(cls)
+        obj._front = front
+        obj._back = back
+        obj._start = start
+        obj._end = end
+        return obj
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step is None and index.stop is None:
+                # Fast path for lst[n:] (shares storage)
+                n = index.start or 0
+                if n >= 0:
+                    start = min(self._start + n, self._end)
+                    return self._view(self._front, self._back, start, self._end)
+            return TlList(list(self)[index])
+        length = self._end - self._start
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("TlList index out of range")
+        i = self._start + index
+        return self._back[i] if i >= 0 else self._front[~i]
+
+    def __iter__(self):
+        start, end = self._start, self._end
+        if start < 0:
+            # front[-m:-start] holds logical indices start..m-1, reversed
+            yield from reversed(self._front[-min(end, 0) : -start])
+        if end > 0:
+            yield from self._back[max(start, 0) : end]
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, TlList):
+            if len(self) != len(other):
+                return False
+            if (
+                self._back is other._back
+                and self._front is other._front
+                and self._start == other._start
+            ):
+                # Same view of the same storage
+                return True
+        elif not isinstance(other, list):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def appended(self, item) -> "TlList":
+        """A new list with item added at the end"""
+        back, end = self._back, self._end
+        if end >= 0 and end == len(back):
+            back.append(item)
+            if back[end] is item:
+                return self._view(self._front, back, self._start, end + 1)
+        return TlList([*self, item])
+
+    def prepended(self, item) -> "TlList":
+        """A new list with item added at the start"""
+        front, start = self._front, self._start
+        if start <= 0 and -start == len(front):
+            front.append(item)
+            if front[-start] is item:
+                return self._view(front, self._back, start - 1, self._end)
+        return TlList([item, *self])
+
+    def rest(self) -> "TlList":
+        """A new list without the first item"""
+        return self[1:]
+
+    def __add__(self, other) -> "TlList":
+        if not isinstance(other, (TlList, list)):
+            return NotImplemented
+        if not self:
+            return other if isinstance(other, TlList) else TlList(other)
+        result = self
+        for item in other:
+            result = result.appended(item)
+        return result
+
     def serialise_data(self):
-        return [a.serialise() for a in self.data]
+        return [a.serialise() for a in self]
 
     @classmethod
     def from_data(cls, data):
         return cls([TlType.deserialise(a) for a in data])
 
 
-class TlHash(UserDict, TlType):
+class TlHash(Mapping, TlType):
+    """A persistent hash
+
+    Like lists, hashes are values: set returns a new hash, sharing most of its
+    storage with the original (see hamt.py). Keys iterate in insertion order.
+    """
+
+    __slots__ = ("_hamt", "_keys")
+
+    def __init__(self, items=()):
+        pairs = items.items() if isinstance(items, Mapping) else items
+        hamt = Hamt()
+        keys = []
+        for key, value in pairs:
+            new_hamt = hamt.set(key, value)
+            if len(new_hamt) > len(hamt):
+                keys.append(key)
+            hamt = new_hamt
+        self._hamt = hamt
+        self._keys = TlList(keys)
+
+    def __getitem__(self, key):
+        return self._hamt[key]
+
+    def __contains__(self, key):
+        return key in self._hamt
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._hamt)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        if isinstance(other, TlHash) and self._hamt is other._hamt:
+            return True
+        missing = object()
+        return all(other.get(k, missing) == v for k, v in self.items())
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def set(self, key, value) -> "TlHash":
+        """A new hash with key set to value"""
+        obj = TlHash.__new__(TlHash)
+        obj._hamt = self._hamt.set(key, value)
+        if len(obj._hamt) > len(self._hamt):
+            obj._keys = self._keys.appended(key)
+        else:
+            obj._keys = self._keys
+        return obj
+
     def serialise_data(self):
-        return [[k.serialise(), v.serialise()] for k, v in self.data.items()]
+        return [[k.serialise(), v.serialise()] for k, v in self.items()]
 
     @classmethod
     def from_data(cls, data):
-        return cls({TlType.deserialise(k): TlType.deserialise(v) for k, v in data})
+        return cls((TlType.deserialise(k), TlType.deserialise(v)) for k, v in data)
 
 
 class TlFunctionPtr(TlType):
     """Pointer to a function or closure defined in Tl"""
 
+    __slots__ = ("identifier", "stack_ptr")
+
     def __init__(self, identifier: str, stack_ptr: Optional[int] = None):
         if not isinstance(identifier, str):
             raise ValueError(identifier)
@@ -165,6 +431,16 @@ class TlFunctionPtr(TlType):
         self.identifier = identifier
         self.stack_ptr = stack_ptr
 
+    def __eq__(self, other):
+        return (
+            type(self) is type(other)
+            and self.identifier == other.identifier
+            and self.stack_ptr == other.stack_ptr
+        )
+
+    def __hash__(self):
+        return hash((type(self), self.identifier, self.stack_ptr))
+
     def serialise_data(self):
         return [self.identifier, self.stack_ptr]
 
@@ -180,6 +456,8 @@ class TlFunctionPtr(TlType):
 class TlForeignPtr(TlType):
     """Pointer to an imported python function"""
 
+    __slots__ = ("identifier", "module", "qualified_name")
+
     def __init__(self, identifier: str, module: str, qualified_name: str):
         if not isinstance(identifier, str):
             raise ValueError(identifier)
@@ -190,6 +468,17 @@ class TlForeignPtr(TlType):
         self.module = module
         self.qualified_name = qualified_name
 
+    def __eq__(self, other):
+        return (
+            type(self) is type(other)
+            and self.identifier == other.identifier
+            and self.module == other.module
+            and self.qualified_name == other.qualified_name
+        )
+
+    def __hash__(self):
+        return hash((type(self), self.identifier, self.module))
+
     def serialise_data(self):
         return [self.identifier, self.module, self.qualified_name]
 
@@ -202,6 +491,17 @@ class TlForeignPtr(TlType):
         return f"<{kind} {self.module}.{self.identifier}>"
 
 
+### Local variable slots (lists of TlType, or None for unassigned)
+
+
+def serialise_slots(slots: list) -> list:
+    return [None if v is None else v.serialise() for v in slots]
+
+
+def deserialise_slots(data: list) -> list:
+    return [None if v is None else TlType.deserialise(v) for v in data]
+
+
 ### Type Conversion
 
 # NOTE - no conversion to/from Symbols
@@ -250,11 +550,11 @@ Tl_TO_PY = {
 
 def to_hark_type(py_val):
     if py_val is None:
-        return TlNull()
+        return NULL
     elif py_val is True:
-        return TlTrue()
+        return TRUE
     elif py_val is False:
-        return TlFalse()
+        return FALSE
 
     try:
         return PY_TO_TL[type(py_val)](py_val)
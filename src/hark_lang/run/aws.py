@@ -4,7 +4,6 @@ import json
 import logging
 import os
 import sys
-import time
 import traceback
 
 from .. import __version__, load
@@ -13,7 +12,7 @@ from ..controllers import ddb_model as db
 from ..exceptions import UserResolvableError
 from ..executors.awslambda import Invoker
 from ..machine.controller import ControllerError
-from ..machine.machine import TlMachine
+from ..machine.machine import run_inline
 from ..hark_compiler.compiler import HarkCompileError
 from ..hark_parser.parser import HarkParseError
 from . import lambda_handlers
@@ -44,23 +43,24 @@ def resume(event, context):
     # a result to. So all exceptions must appear in the AWS console.
     #
     # However, any waiting machines need to find out about this.
-    _run_machine(controller, vmid)
-
+    _run_machine(controller, vmid, context)
 
-def _run_machine(controller, vmid):
-    try:
-        invoker = Invoker(controller)
-        machine = TlMachine(vmid, invoker)
-        machine.run()
 
+def _run_machine(controller, vmid, context=None):
+    """Run a machine, and any continuations that fit in this invocation"""
+    invoker = Invoker(controller, context)
     # One of those rare times when we really do want to catch and record any
     # possible exception.
-    except Exception as exc:
-        state = controller.get_state(vmid)
-        state.error_msg = "".join(traceback.format_exception(*sys.exc_info()))
-        controller.set_state(vmid, state)
-        controller.stop(vmid, finished_ok=False)
-        raise
+    run_inline(vmid, invoker, functools.partial(_record_error, controller))
+
+
+def _record_error(controller, vmid):
+    """Record the exception being handled, so that waiting machines find out"""
+    state = controller.get_state(vmid)
+    state.error_msg = "".join(traceback.format_exception(*sys.exc_info()))
+    controller.set_state(vmid, state)
+    controller.release(vmid)
+    controller.stop(vmid, finished_ok=False)
 
 
 def event_handler(event, context):
@@ -91,26 +91,63 @@ def set_exe(event, context):
 
 
 def getoutput(event, context):
-    """Get Hark standard output for a session"""
+    """Get a page of Hark standard output for a session
+
+    To get the next page, call again with `after` set to the `next` value in the
+    result. Thread errors are only included in the last page (when `next` is
+    None).
+
+    To follow the output of a running session, pass `cursor` instead ({} at
+    first) - only output newer than the cursor is returned, along with the new
+    cursor, and whether the session has `finished` (all threads stopped, and
+    all of the output returned).
+    """
     session_id = event.get("session_id", None)
 
     if not session_id:
         return _fail("No session ID")
 
+    if "cursor" in event:
+        return _follow_output(session_id, event["cursor"])
+
+    try:
+        controller = ddb_controller.DataController.with_session_id(session_id)
+        output, next_key = controller.get_page(db.STDOUT, event.get("after"))
+        errors = []
+        if next_key is None:
+            errors = [
+                controller.get_state(idx).error_msg
+                for idx in controller.get_thread_ids()
+            ]
+    except ControllerError:
+        return _fail("Error getting data")
+
+    return _success(output=output, errors=errors, next=next_key)
+
+
+def _follow_output(session_id, cursor):
     try:
         controller = ddb_controller.DataController.with_session_id(session_id)
-        output = [o.serialise() for o in controller.get_stdout()]
-        errors = [
-            controller.get_state(idx).error_msg for idx in controller.get_thread_ids()
-        ]
+        # Check first, so no output is missed if it finishes in between
+        stopped = controller.all_stopped()
+        output, cursor, caught_up = controller.get_stdout_since(
+            cursor, skip_gaps=stopped
+        )
+        finished = stopped and caught_up
+        errors = []
+        if finished:
+            errors = [
+                controller.get_state(idx).error_msg
+                for idx in controller.get_thread_ids()
+            ]
     except ControllerError:
         return _fail("Error getting data")
 
-    return _success(output=output, errors=errors)
+    return _success(output=output, errors=errors, cursor=cursor, finished=finished)
 
 
 def getevents(event, context) -> dict:
-    """Get probe events for a session"""
+    """Get a page of probe events for a session (paginated like getoutput)"""
     session_id = event.get("session_id", None)
 
     if not session_id:
@@ -118,22 +155,28 @@ def getevents(event, context) -> dict:
 
     try:
         controller = ddb_controller.DataController.with_session_id(session_id)
-        events = [pe.serialise() for pe in controller.get_probe_events()]
+        events, next_key = controller.get_page(db.PEVENTS, event.get("after"))
     except ControllerError:
         return _fail("Error loading session data")
 
-    return _success(events=events)
+    return _success(events=events, next=next_key)
 
 
 ## Helpers
 
 
 def _new_session(
-    function, args, check_period, wait_for_finish, timeout, code_override=None
+    function,
+    args,
+    check_period,
+    wait_for_finish,
+    timeout,
+    code_override=None,
+    probe_mode=None,
 ):
     """Create a new hark session"""
     LOG.info("Creating new session and running function: %s", function)
-    controller = ddb_controller.DataController.with_new_session()
+    controller = ddb_controller.DataController.with_new_session(probe_mode)
 
     if not code_override:
         exe = controller.executable
@@ -163,16 +206,11 @@ def _new_session(
 
     _run_machine(controller, vmid)
 
-    # TODO reduce duplication - this is all similar to common.py
-    if wait_for_finish:
-        start_time = time.time()
-        while not controller.all_stopped():
-            time.sleep(check_period)
-            if time.time() - start_time > timeout:
-                raise UserResolvableError(
-                    f"Timeout waiting for Hark program to finish ({controller.session_id})",
-                    "",
-                )
+    if wait_for_finish and not controller.wait_finished(timeout, check_period):
+        raise UserResolvableError(
+            f"Timeout waiting for Hark program to finish ({controller.session_id})",
+            "",
+        )
 
     return controller
 
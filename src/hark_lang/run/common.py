@@ -18,23 +18,25 @@ class ThreadDied(UnexpectedError):
     msg = ""
 
 
-def wait_for_finish(check_period, timeout, data_controller, invoker):
-    """Wait for a machine to finish, checking every CHECK_PERIOD
+def wait_for_finish(
+    check_period, timeout, data_controller, invoker, poll_interval=None
+):
+    """Wait for a machine to finish, checking for errors every CHECK_PERIOD
 
-    If timeout is None, wait indefinitely.
+    If timeout is None, wait indefinitely. POLL_INTERVAL is passed on to
+    wait_finished (needed if the threads don't run in this process).
 
     """
     start_time = time.time()
     try:
-        while not data_controller.all_stopped():
-            time.sleep(check_period)
+        while not data_controller.wait_finished(check_period, poll_interval):
             if timeout and time.time() - start_time > timeout:
                 raise Exception("Timeout waiting for finish")
 
             # This should never happen - we catch runtime errors and print them
             # nicely in machine
             if invoker.exception:
-                raise ThreadDied() from invoker.exception.exc_value
+                raise ThreadDied(str(invoker.exception)) from invoker.exception
 
     except Exception as e:
         LOG.warn("Unexpected Exception!! Returning controller for analysis")
@@ -73,13 +75,19 @@ def run_and_wait(controller, invoker, waiter, filename, function, args: List[str
         waiter(controller, invoker)
 
     finally:
-        items = controller.get_probe_events() + controller.get_probe_logs()
+        # Stop the invoker's threads, waiting for them unless the run timed out
+        invoker.shutdown(wait=controller.all_stopped())
+        items = [*controller.get_probe_events(), *controller.get_probe_logs()]
         for p in sorted(items, key=lambda p: p.thread):
             if hasattr(p, "event"):
                 LOG.info(f"*** [{p.thread}] {p.event} {p.data}")
             else:
                 LOG.info(f"> [{p.thread}] {p.text}")
 
+    # Threads can also die after the session has finished (see wait_for_finish)
+    if invoker.exception:
+        raise ThreadDied(str(invoker.exception)) from invoker.exception
+
     LOG.info(
         "DONE (broken? %s) [%s]: %s",
         controller.broken,
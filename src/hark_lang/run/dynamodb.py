@@ -10,9 +10,9 @@ from .common import run_and_wait, wait_for_finish
 import pynamodb
 
 
-def run_ddb_local(filename, function, args, timeout=10):
+def run_ddb_local(filename, function, args, timeout=10, probe_mode=None):
     """Run with dynamodb and python threading"""
-    controller = ddb_controller.DataController.with_new_session()
+    controller = ddb_controller.DataController.with_new_session(probe_mode)
     invoker = hark_thread.Invoker(controller)
     waiter = partial(wait_for_finish, 1, timeout)
     try:
@@ -21,11 +21,13 @@ def run_ddb_local(filename, function, args, timeout=10):
         raise ControllerError("Database error: {exc}") from exc
 
 
-def run_ddb_processes(filename, function, args, timeout=10):
+def run_ddb_processes(filename, function, args, timeout=10, probe_mode=None):
     """Run with dynamodb and python multiprocessing"""
-    controller = ddb_controller.DataController.with_new_session()
+    controller = ddb_controller.DataController.with_new_session(probe_mode)
     invoker = mp.Invoker(controller)
-    waiter = partial(wait_for_finish, 1, timeout)
+    waiter = partial(
+        wait_for_finish, 1, timeout, poll_interval=ddb_controller.FINISHED_POLL_INTERVAL
+    )
     try:
         return run_and_wait(controller, invoker, waiter, filename, function, args)
     except pynamodb.exceptions.PynamoDBException as exc:
@@ -55,6 +55,7 @@ class CliHandler(HarkEventHandler):
                 wait_for_finish=event.get("wait_for_finish", True),
                 timeout=timeout,
                 code_override=event.get("code", None),
+                probe_mode=event.get("probe", None),
             )
         except UserResolvableError as exc:
             return dict(hark_ok=False, message=exc.msg, suggested_fix=exc.suggested_fix)
@@ -3,15 +3,31 @@ import os
 from functools import partial
 
 from ..controllers import local as local
+from ..controllers import shared
+from ..executors import multiprocess as mp
 from ..executors import thread as hark_thread
 from ..machine.types import to_py_type
 from .common import LOG, run_and_wait, wait_for_finish
 
 
-def run_local(filename, function, args, timeout_s=10):
+def run_local(
+    filename, function, args, timeout_s=10, probe_mode=None, max_workers=None
+):
     LOG.debug(f"PYTHONPATH: {os.getenv('PYTHONPATH')}")
-    controller = local.DataController()
-    invoker = hark_thread.Invoker(controller)
+    controller = local.DataController(probe_mode)
+    invoker = hark_thread.Invoker(controller, max_workers)
     check_period = 0.1
     waiter = partial(wait_for_finish, check_period, timeout_s)
     return run_and_wait(controller, invoker, waiter, filename, function, args)
+
+
+def run_local_processes(filename, function, args, timeout_s=10, probe_mode=None):
+    """Run with python multiprocessing, sharing data through a server process"""
+    controller = shared.DataController.with_new_session(probe_mode)
+    invoker = mp.Invoker(controller)
+    check_period = 0.1
+    waiter = partial(wait_for_finish, check_period, timeout_s)
+    try:
+        return run_and_wait(controller, invoker, waiter, filename, function, args)
+    finally:
+        controller.close()
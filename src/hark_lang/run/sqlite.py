@@ -0,0 +1,35 @@
+"""Run Hark with a SQLite storage backend"""
+import sqlite3
+from functools import partial
+
+from ..controllers import sqlite as sqlite_controller
+from ..executors import multiprocess as mp
+from ..executors import thread as hark_thread
+from ..machine.controller import ControllerError
+from .common import run_and_wait, wait_for_finish
+
+
+def run_sqlite_local(
+    filename, function, args, timeout=10, probe_mode=None, db_path=None
+):
+    """Run with SQLite and python threading"""
+    controller = sqlite_controller.DataController.with_new_session(probe_mode, db_path)
+    invoker = hark_thread.Invoker(controller)
+    waiter = partial(wait_for_finish, 0.1, timeout)
+    try:
+        return run_and_wait(controller, invoker, waiter, filename, function, args)
+    except sqlite3.Error as exc:
+        raise ControllerError(f"Database error: {exc}") from exc
+
+
+def run_sqlite_processes(
+    filename, function, args, timeout=10, probe_mode=None, db_path=None
+):
+    """Run with SQLite and python multiprocessing"""
+    controller = sqlite_controller.DataController.with_new_session(probe_mode, db_path)
+    invoker = mp.Invoker(controller)
+    waiter = partial(wait_for_finish, 0.1, timeout)
+    try:
+        return run_and_wait(controller, invoker, waiter, filename, function, args)
+    except sqlite3.Error as exc:
+        raise ControllerError(f"Database error: {exc}") from exc
@@ -0,0 +1,92 @@
+"""Test the Lambda invoker, with a stand-in for Lambda"""
+import threading
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError
+
+from hark_lang.executors import awslambda
+
+
+class Recorder:
+    """Record events, failing the first few invocations"""
+
+    def __init__(self, failures=0, code="TooManyRequestsException"):
+        self.failures = failures
+        self.code = code
+        self.events = []
+        self.lock = threading.Lock()
+
+    def __call__(self, event, context):
+        with self.lock:
+            self.events.append(event)
+
+
+class FlakyLambda(awslambda.LocalLambda):
+    def invoke(self, **kwargs):
+        with self.handler.lock:
+            if self.handler.failures:
+                self.handler.failures -= 1
+                error = {"Error": {"Code": self.handler.code}}
+                raise ClientError(error, "Invoke")
+        return super().invoke(**kwargs)
+
+
+@pytest.fixture
+def invoker(monkeypatch):
+    monkeypatch.setattr(awslambda, "RESUME_FN_NAME", "resume")
+    monkeypatch.setattr(awslambda, "RETRY_MIN_DELAY", 0.0001)
+    yield awslambda.Invoker(SimpleNamespace(session_id="abc"))
+    awslambda.set_lambda_client(None)
+
+
+def wait_for(recorder, count):
+    for _ in range(100):
+        with recorder.lock:
+            if len(recorder.events) >= count:
+                return recorder.events
+        threading.Event().wait(0.01)
+    return recorder.events
+
+
+def test_invoke_many(invoker):
+    recorder = Recorder()
+    awslambda.set_lambda_client(awslambda.LocalLambda(recorder))
+    invoker.invoke_many(list(range(50)))
+    events = wait_for(recorder, 50)
+    assert sorted(e["vmid"] for e in events) == list(range(50))
+    assert all(e["session_id"] == "abc" for e in events)
+
+
+def test_retry(invoker):
+    recorder = Recorder(failures=3)
+    awslambda.set_lambda_client(FlakyLambda(recorder))
+    invoker.invoke(7)
+    assert wait_for(recorder, 1) == [dict(session_id="abc", vmid=7)]
+
+
+def test_no_retry(invoker):
+    recorder = Recorder(failures=1, code="ResourceNotFoundException")
+    awslambda.set_lambda_client(FlakyLambda(recorder))
+    with pytest.raises(awslambda.InvokeError):
+        invoker.invoke(1)
+    assert recorder.failures == 0
+
+
+def test_give_up(invoker):
+    recorder = Recorder(failures=2 * awslambda.MAX_ATTEMPTS)
+    awslambda.set_lambda_client(FlakyLambda(recorder))
+    with pytest.raises(awslambda.InvokeError):
+        invoker.invoke_many([1, 2])
+    assert recorder.events == []
+
+
+def test_inline_budget(monkeypatch):
+    monkeypatch.setattr(awslambda, "RESUME_FN_NAME", "resume")
+    context = SimpleNamespace(remaining=10000)
+    context.get_remaining_time_in_millis = lambda: context.remaining
+    invoker = awslambda.Invoker(SimpleNamespace(session_id="abc"), context)
+    assert invoker.inline_continuations
+    context.remaining = 4000
+    assert not invoker.inline_continuations
+    assert not awslambda.Invoker(None).inline_continuations
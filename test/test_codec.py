@@ -0,0 +1,145 @@
+"""Test encoding machine data"""
+import json
+
+import pytest
+
+from hark_lang.exceptions import UnexpectedError, UserResolvableError
+from hark_lang.load import compile_text
+from hark_lang.machine import codec
+from hark_lang.machine import types as mt
+from hark_lang.machine.arec import ActivationRecord, Frame
+from hark_lang.machine.future import Future
+from hark_lang.machine.state import State
+
+VALUES = [
+    mt.TlNull(),
+    mt.TlTrue(),
+    mt.TlFalse(),
+    mt.TlInt(0),
+    mt.TlInt(-1),
+    mt.TlInt(2 ** 70),
+    mt.TlFloat(1.5),
+    mt.TlString(""),
+    mt.TlString("héllo"),
+    mt.TlSymbol("x"),
+    mt.TlFuturePtr(3),
+    mt.TlFunctionPtr("foo"),
+    mt.TlFunctionPtr("foo", 2),
+    mt.TlForeignPtr("bar", "mod.ule", "mod.ule.bar"),
+    mt.TlQuote(mt.TlList([mt.TlSymbol("a"), mt.TlInt(1)])),
+    mt.TlList(),
+    mt.TlList([mt.TlInt(1)]).appended(mt.TlInt(2)).rest(),
+    mt.TlHash(
+        {mt.TlString("a"): mt.TlList([mt.TlString("a")]), mt.TlInt(1): mt.TlNull()}
+    ),
+]
+
+CODECS = ["binary", "binary+zlib", "json"]
+
+
+@pytest.mark.parametrize("name", CODECS)
+@pytest.mark.parametrize("value", VALUES)
+def test_values(name, value):
+    data = codec.get_codec(name).encode(value)
+    assert codec.decode(data) == value
+
+
+def make_state():
+    state = State([mt.TlInt(1), mt.TlString("x")])
+    state.ip = 42
+    state.set_frames(
+        [
+            Frame(mt.TlFunctionPtr("main"), None, [mt.TlInt(3)], 7),
+            Frame(
+                mt.TlFunctionPtr("f"),
+                12,
+                [mt.TlString("x"), None, mt.TlList([mt.TlString("x")])],
+            ),
+        ]
+    )
+    state.error_msg = "oops"
+    return state
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_state(name):
+    state = make_state()
+    data = codec.get_codec(name).encode(state)
+    decoded = codec.decode(data)
+    assert decoded == state
+    assert decoded.bindings is decoded.frames[-1].bindings
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_arec_and_future(name):
+    c = codec.get_codec(name)
+    arec = ActivationRecord(
+        function=mt.TlFunctionPtr("f"),
+        vmid=1,
+        dynamic_chain=None,
+        call_site=None,
+        bindings=[mt.TlInt(1), None],
+        ref_count=2,
+    )
+    assert codec.decode(c.encode(arec)) == arec
+    future = Future(
+        continuations=[1, 2], chain=None, resolved=True, value=mt.TlInt(0), gathers=[3]
+    )
+    assert codec.decode(c.encode(future)).serialise() == future.serialise()
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_executable(name):
+    exe = compile_text("fn main(x) { y = [x, 1.5, 'a']; print(y); y }")
+    data = codec.get_codec(name).encode(exe)
+    decoded = codec.decode(data)
+    assert decoded.serialise() == exe.serialise()
+
+
+def test_binary_is_smaller():
+    state = make_state()
+    binary = codec.get_codec("binary").encode(state)
+    assert len(binary) < len(json.dumps(state.serialise()))
+
+
+def test_compression():
+    value = mt.TlList([mt.TlString(f"string {i % 3}") for i in range(1000)])
+    plain = codec.get_codec("binary").encode(value)
+    compressed = codec.get_codec("binary+zlib").encode(value)
+    assert compressed[3] == codec.COMPRESS_ZLIB
+    assert len(compressed) < len(plain)
+    assert codec.decode(compressed) == value
+    # Small data isn't compressed
+    assert codec.get_codec("binary+zlib").encode(mt.TlInt(1))[3] == codec.COMPRESS_NONE
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_slots(name):
+    slots = [None, mt.TlInt(1), mt.TlList([mt.TlString("a")])]
+    assert codec.decode(codec.get_codec(name).encode(slots)) == slots
+
+
+def test_unversioned_json():
+    # Stored as plain JSON before there were codecs - not readable any more
+    with pytest.raises(UnexpectedError):
+        codec.decode(json.dumps(make_state().serialise()).encode())
+
+
+def test_bad_data():
+    data = codec.get_codec().encode(mt.TlInt(1))
+    with pytest.raises(UnexpectedError):
+        codec.decode(data[:2] + b"\x63" + data[3:])
+    with pytest.raises(UnexpectedError):
+        codec.decode(data[:3] + b"\x07" + data[4:])
+    with pytest.raises(UnexpectedError):
+        codec.decode(data[:4] + b"\x0f")
+    json_data = codec.get_codec("json").encode(mt.TlInt(1))
+    with pytest.raises(UnexpectedError):
+        codec.decode(json_data[:4] + b'["nope", 1]')
+    with pytest.raises(UnexpectedError):
+        codec.decode(b"[1, 2]")
+
+
+def test_unknown_codec():
+    with pytest.raises(UserResolvableError):
+        codec.get_codec("morse")
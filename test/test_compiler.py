@@ -0,0 +1,49 @@
+"""Test compile-time name resolution"""
+import pytest
+
+import hark_lang.machine.instructionset as mi
+from hark_lang.hark_compiler.compiler import HarkCompileError
+from hark_lang.load import compile_text
+from hark_lang.machine.executable import Executable
+
+
+def function_code(exe, name):
+    """Get the instructions of a function in exe"""
+    identifier = exe.bindings[name].identifier
+    start = exe.locations[identifier]
+    ends = [loc for loc in exe.locations.values() if loc > start]
+    return exe.code[start : min(ends, default=len(exe.code))]
+
+
+def test_local_slots():
+    exe = compile_text("fn foo(a, b) { c = a + b; c }")
+    identifier = exe.bindings["foo"].identifier
+    assert exe.num_locals[identifier] == 3
+    code = function_code(exe, "foo")
+    assert not any(isinstance(i, mi.PushG) for i in code)
+    assert [i.operands[0] for i in code if isinstance(i, mi.BindL)] == [1, 0, 2]
+
+
+def test_global_before_definition():
+    exe = compile_text("fn foo() { bar() }\nfn bar() { 1 }")
+    code = function_code(exe, "foo")
+    assert any(isinstance(i, mi.PushG) and i.operands[0] == "bar" for i in code)
+
+
+def test_local_shadows_builtin():
+    exe = compile_text("fn foo(print) { print }")
+    code = function_code(exe, "foo")
+    assert any(isinstance(i, mi.PushL) for i in code)
+    assert not any(isinstance(i, mi.PushV) for i in code)
+
+
+def test_undefined():
+    with pytest.raises(HarkCompileError):
+        compile_text("fn foo() { bar() }")
+
+
+def test_serialise():
+    exe = compile_text("fn foo(a) { b = a; b }")
+    exe2 = Executable.deserialise(exe.serialise())
+    assert exe2.num_locals == exe.num_locals
+    assert exe2.code == exe.code
@@ -1,13 +1,20 @@
 """Test Controller features"""
+import threading
+from collections import OrderedDict
+
 import pytest
+import hark_lang.controllers.ddb as ddb_controller
 import hark_lang.controllers.ddb_model as db
 import hark_lang.machine.types as mt
 from hark_lang.controllers.ddb import DataController as DdbController
 from hark_lang.controllers.local import DataController as LocalController
+from hark_lang.load import compile_text
 from hark_lang.machine.arec import ActivationRecord
+from hark_lang.machine.controller import ControllerError
 from hark_lang.machine.future import Future
 from hark_lang.machine.probe import Probe
 from hark_lang.machine.state import State
+from hark_lang.machine.stdout_item import StdoutItem
 
 pytestmark = pytest.mark.ddblocal
 
@@ -47,6 +54,18 @@ def test_result(Controller):
     assert ctrl.result == "foo"
 
 
+def test_executable_reload(monkeypatch):
+    ctrl = NewDdbSession()
+    exe = compile_text("fn main() { 3 }")
+    ctrl.set_executable(exe)
+    assert DdbController.with_session_id(ctrl.session_id).executable is exe
+
+    monkeypatch.setattr(db, "_EXECUTABLES", OrderedDict())
+    loaded = DdbController.with_session_id(ctrl.session_id).executable
+    assert loaded is not exe and loaded.serialise() == exe.serialise()
+    assert DdbController.with_session_id(ctrl.session_id).executable is loaded
+
+
 @pytest.mark.parametrize("Controller", CONTROLLERS)
 def test_arec(Controller):
     ctrl = Controller()
@@ -75,6 +94,33 @@ def test_arec(Controller):
     assert rec2.ref_count == previous
 
 
+@pytest.mark.parametrize("Controller", CONTROLLERS)
+def test_arec_collected(Controller):
+    ctrl = Controller()
+
+    def new_rec(dynamic_chain):
+        return ActivationRecord(
+            function=mt.TlFunctionPtr("foo", None),
+            dynamic_chain=dynamic_chain,
+            vmid=0,
+            ref_count=1,
+            call_site=0,
+            bindings=[],
+        )
+
+    parent = ctrl.push_arec(0, new_rec(None))
+    child = ctrl.push_arec(0, new_rec(parent))
+    # Still referenced by the child
+    assert ctrl.pop_arec(parent).ref_count == 1
+    assert ctrl.get_arec(parent).ref_count == 1
+
+    ctrl.pop_arec(child)
+    ctrl.flush(0)
+    for ptr in (parent, child):
+        with pytest.raises((KeyError, ControllerError)):
+            ctrl.get_arec(ptr)
+
+
 @pytest.mark.parametrize("Controller", CONTROLLERS)
 def test_state(Controller):
     ctrl = Controller()
@@ -98,11 +144,116 @@ def test_probe(Controller):
     probe.log("foobar")
 
     ctrl.set_probe_data(t, probe)
-    logs = ctrl.get_probe_logs()
+    logs = list(ctrl.get_probe_logs())
     assert len(logs) == 1
     assert logs[0].text == "foobar"
 
 
+@pytest.mark.parametrize("Controller", CONTROLLERS)
+def test_stdout(Controller):
+    ctrl = Controller()
+    t1 = ctrl.new_thread()
+    t2 = ctrl.new_thread()
+    for i in range(30):
+        ctrl.write_stdout(StdoutItem(t1 if i % 3 else t2, f"{i}\n"))
+    ctrl.flush(t1)
+    output = list(ctrl.get_stdout())
+    assert len(output) == 30
+    for t in (t1, t2):
+        texts = [int(o.text) for o in output if o.thread == t]
+        assert texts == sorted(texts)
+
+
+def test_stdout_pages():
+    ctrl = NewDdbSession()
+    t = ctrl.new_thread()
+    for i in range(7):
+        ctrl.write_stdout(StdoutItem(t, f"{i}\n"))
+    after = None
+    pages = []
+    while True:
+        page, after = ctrl.get_page(db.STDOUT, after, limit=3)
+        pages.append([o["text"] for o in page])
+        if after is None:
+            break
+    assert [text for page in pages for text in page] == [f"{i}\n" for i in range(7)]
+    assert pages[0] == ["0\n", "1\n", "2\n"]
+
+
+def test_stdout_since():
+    ctrl = NewDdbSession()
+    t1 = ctrl.new_thread()
+    t2 = ctrl.new_thread()
+    ctrl.write_stdout(StdoutItem(t1, "a\n"))
+    ctrl.write_stdout(StdoutItem(t2, "b\n"))
+    output, cursor, caught_up = ctrl.get_stdout_since({})
+    assert [o["text"] for o in output] == ["a\n", "b\n"]
+    assert caught_up
+
+    ctrl.write_stdout(StdoutItem(t1, "c\n"))
+    output, cursor, _ = ctrl.get_stdout_since(cursor)
+    assert [o["text"] for o in output] == ["c\n"]
+    assert ctrl.get_stdout_since(cursor) == ([], cursor, True)
+
+
+def test_stdout_since_gap(monkeypatch):
+    ctrl = NewDdbSession()
+    t1 = ctrl.new_thread()
+    t2 = ctrl.new_thread()
+    ctrl.write_stdout(StdoutItem(t1, "a\n"))
+    ctrl.flush(t1)
+    # Reserve a number, as another writer would just before writing
+    ctrl._item(db.THREAD, t1).update(actions=[db.SessionItem.stdout_seq.add(1)])
+    ctrl.write_stdout(StdoutItem(t1, "c\n"))
+    ctrl.write_stdout(StdoutItem(t2, "b\n"))
+
+    # The gap holds back the rest of t1's output, but not t2's
+    output, cursor, caught_up = ctrl.get_stdout_since({})
+    assert [o["text"] for o in output] == ["a\n", "b\n"]
+    assert not caught_up
+    assert ctrl.get_stdout_since(cursor)[:2] == ([], cursor)
+
+    monkeypatch.setattr(ddb_controller, "STREAM_GAP_TIMEOUT", 0)
+    output, cursor, caught_up = ctrl.get_stdout_since(cursor)
+    assert [o["text"] for o in output] == ["c\n"]
+    assert caught_up
+
+
+@pytest.mark.parametrize("Controller", CONTROLLERS)
+def test_gather(Controller):
+    ctrl = Controller()
+    t, a, b = ctrl.new_thread(), ctrl.new_thread(), ctrl.new_thread()
+    for vmid in (a, b):
+        ctrl.set_future(vmid, Future())
+    ptrs = [mt.TlFuturePtr(a), mt.TlFuturePtr(b)]
+    ctrl.set_stopped(t, False)
+
+    # Both resolve while t is stopping, so it carries on
+    assert ctrl.gather(t, ptrs) == (False, None)
+    assert ctrl.resolve_future(a, mt.TlInt(1)) == []
+    assert ctrl.resolve_future(b, mt.TlInt(2)) == []
+    assert not ctrl.stop(t, True, gathering=True)
+    assert ctrl.gather(t, ptrs) == (True, [mt.TlInt(1), mt.TlInt(2)])
+
+    # The last one resolves after t has stopped, and continues it
+    c = ctrl.new_thread()
+    ctrl.set_future(c, Future())
+    assert ctrl.gather(t, ptrs + [mt.TlFuturePtr(c)]) == (False, None)
+    assert ctrl.stop(t, True, gathering=True)
+    assert ctrl.resolve_future(c, mt.TlInt(3)) == [t]
+
+
+def test_wait_finished():
+    ctrl = NewDdbSession()
+    t = ctrl.new_thread()
+    ctrl.set_stopped(t, False)
+    assert not ctrl.wait_finished(0.05)
+    assert not ctrl.wait_finished(0.05, poll_interval=0.01)
+    threading.Timer(0.05, ctrl.set_stopped, (t, True)).start()
+    assert ctrl.wait_finished(5)  # notified by set_stopped
+    assert ctrl.wait_finished(0, poll_interval=0.01)
+
+
 @pytest.mark.parametrize("Controller", CONTROLLERS)
 def test_future(Controller):
     ctrl = Controller()
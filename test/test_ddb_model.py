@@ -0,0 +1,81 @@
+"""Test the DynamoDB attributes (no database needed)"""
+import base64
+
+import pytest
+from botocore.exceptions import ClientError
+from pynamodb.exceptions import UpdateError
+
+from hark_lang.controllers import ddb_model as db
+from hark_lang.load import compile_text
+from hark_lang.machine import types as mt
+from hark_lang.machine.arec import Frame
+from hark_lang.machine.machine import TlMachine
+from hark_lang.machine.state import State
+
+
+def test_executable_cache():
+    exe = compile_text("fn main() { 1 }")
+    attr = db.MetaAttribute()
+    raw = attr.serialize(db.MetaAttribute(exe=exe, exe_hash=db.executable_hash(exe)))
+    loaded = attr.deserialize(raw).exe
+    assert loaded.serialise() == exe.serialise()
+    assert attr.deserialize(raw).exe is loaded
+    TlMachine.link(loaded)
+    # Not fetched (see get_meta)
+    del raw["exe"]
+    assert attr.deserialize(raw).exe.linked is not None
+
+
+@pytest.mark.parametrize("codec_name", ["binary", "json"])
+def test_data_attributes(monkeypatch, codec_name):
+    monkeypatch.setenv("HARK_CODEC", codec_name)
+    attr = db.HarkDataAttribute()
+    exe = compile_text("fn main() { 2 }")
+    assert attr.deserialize(attr.serialize(exe)).serialise() == exe.serialise()
+
+    state = State([mt.TlInt(1)])
+    state.set_frames([Frame(mt.TlFunctionPtr("main"), None, [mt.TlString("x")])])
+    assert attr.deserialize(attr.serialize(state)) == state
+    nested = base64.b64encode(attr.serialize(state)).decode()  # e.g. in a map
+    assert attr.deserialize(nested) == state
+    slots = [None, mt.TlInt(2)]
+    assert attr.deserialize(attr.serialize(slots)) == slots
+
+
+def conflict_error():
+    cause = ClientError(
+        {"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem"
+    )
+    return UpdateError("Failed", cause)
+
+
+def test_is_conflict():
+    assert db.is_conflict(conflict_error())
+    cause = ClientError({"Error": {"Code": "ValidationException"}}, "UpdateItem")
+    assert not db.is_conflict(UpdateError("Failed", cause))
+
+
+def test_retry(monkeypatch):
+    monkeypatch.setattr(db, "RETRY_MIN_DELAY", 0.0001)
+    attempts = []
+
+    def contended():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise db.Conflict("test")
+        return "done"
+
+    assert db.retry("test_retry", contended) == "done"
+    assert db.contention_stats()["test_retry"] == (3, 2)
+
+
+def test_retry_gives_up(monkeypatch):
+    monkeypatch.setattr(db, "RETRY_MIN_DELAY", 0.0001)
+    monkeypatch.setattr(db, "RETRY_MAX_DELAY", 0.0001)
+
+    def always():
+        raise db.Conflict("test")
+
+    with pytest.raises(db.Conflict):
+        db.retry("test_retry_gives_up", always)
+    assert db.CONFLICTS["test_retry_gives_up"] == db.RETRY_MAX_ATTEMPTS
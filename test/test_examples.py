@@ -1,6 +1,7 @@
 import logging
 import random
 import sys
+from functools import partial
 from pathlib import Path
 
 import pytest
@@ -8,14 +9,19 @@ import hark_lang.controllers.ddb_model as db
 import hark_lang.examples as hark_examples
 from hark_lang.machine.types import TlType, to_py_type, to_hark_type
 from hark_lang.run.dynamodb import run_ddb_local, run_ddb_processes
-from hark_lang.run.local import run_local
+from hark_lang.run.local import run_local, run_local_processes
+from hark_lang.run.sqlite import run_sqlite_local, run_sqlite_processes
 
 LOG = logging.getLogger(__name__)
 
 CALL_METHODS = [
     run_local,
+    pytest.param(partial(run_local, max_workers=1), id="run_local_one_worker"),
+    run_local_processes,
     pytest.param(run_ddb_local, marks=[pytest.mark.slow, pytest.mark.ddblocal]),
     pytest.param(run_ddb_processes, marks=[pytest.mark.slow, pytest.mark.ddblocal]),
+    run_sqlite_local,
+    run_sqlite_processes,
 ]
 
 # Find all examples dir and test them
@@ -32,6 +38,12 @@ def setup_module(module):
     sys.path.append(str(EXAMPLES_SUBDIR))
 
 
+@pytest.fixture(autouse=True)
+def sqlite_db(monkeypatch, tmp_path):
+    """Keep SQLite sessions in a temporary database"""
+    monkeypatch.setenv("HARK_SQLITE_DB", str(tmp_path / "hark.db"))
+
+
 @pytest.fixture(autouse=True)
 def session_db(pytestconfig):
     """Initialise the Hark sessions DynamoDB table"""
@@ -0,0 +1,52 @@
+"""Test machine probe modes"""
+import pytest
+
+import hark_lang.machine.types as mt
+from hark_lang.exceptions import UserResolvableError
+from hark_lang.machine.instructionset import PushV
+from hark_lang.machine.probe import Probe, parse_probe_mode
+
+
+def test_parse_modes():
+    assert parse_probe_mode("off") == ("off", 0)
+    assert parse_probe_mode("calls") == ("calls", 0)
+    assert parse_probe_mode("sampled") == ("sampled", 100)
+    assert parse_probe_mode("sampled:7") == ("sampled", 7)
+    assert parse_probe_mode("full") == ("full", 1)
+
+
+@pytest.mark.parametrize("spec", ["bogus", "calls:5", "sampled:x", "sampled:0", "sampled:-3"])
+def test_bad_modes(spec):
+    with pytest.raises(UserResolvableError):
+        parse_probe_mode(spec)
+
+
+def test_off():
+    probe = Probe(0, "off")
+    probe.event("call", function=mt.TlFunctionPtr("foo"))
+    probe.log("hello %s", mt.TlInt(1))
+    assert probe.events == []
+    assert probe.logs == []
+
+
+def test_deferred_formatting():
+    probe = Probe(3, "full")
+    instr = PushV(mt.TlInt(5))
+    probe.step(2, instr, [mt.TlString("a" * 50)])
+    probe.event("call", function=mt.TlFunctionPtr("foo"), n=2)
+    probe.log("got %s", mt.TlInt(1))
+
+    step, call = probe.events
+    assert step.thread == 3
+    assert step.event == "step"
+    assert step.data["ip"] == 2
+    assert step.data["instr"] == str(instr)
+    assert step.data["top_of_stack"].endswith("...")
+    assert call.data == {"function": "<TlFunctionPtr foo>", "n": 2}
+    assert probe.logs[0].text == "got 1"
+
+
+def test_env_default(monkeypatch):
+    monkeypatch.setenv("HARK_PROBE", "sampled:3")
+    assert Probe(0).step_interval == 3
+    assert Probe(0, "calls").step_interval == 0
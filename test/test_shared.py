@@ -0,0 +1,76 @@
+"""Test the shared memory controller"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import hark_lang.machine.types as mt
+from hark_lang.controllers.shared import DataController
+from hark_lang.load import compile_text
+from hark_lang.machine.controller import ControllerError
+from hark_lang.machine.future import Future
+from hark_lang.machine.state import State
+
+
+def test_connect():
+    ctrl = DataController.with_new_session()
+    exe = compile_text("fn main() { 1 }")
+    ctrl.set_executable(exe)
+    t = ctrl.new_thread()
+    ctrl.set_state(t, State([mt.TlInt(5)]))
+    ctrl.result = [1, "a"]
+
+    again = DataController.with_session_id(*ctrl.open_args[1:])
+    assert again.executable.serialise() == exe.serialise()
+    assert again.get_state(t) == State([mt.TlInt(5)])
+    assert again.result == [1, "a"]
+    assert again.get_thread_ids() == [t]
+
+
+def test_missing_session():
+    _, _, address, authkey = DataController.with_new_session().open_args
+    with pytest.raises(ControllerError):
+        DataController.with_session_id("nope", address, authkey)
+
+
+def test_close():
+    ctrl = DataController.with_new_session()
+    t = ctrl.new_thread()
+    ctrl.set_state(t, State([mt.TlInt(5)]))
+    ctrl.close()
+    assert ctrl.get_thread_ids() == [t]  # IDs aren't reused
+    with pytest.raises(KeyError):
+        ctrl.get_state(t)
+    with pytest.raises(ControllerError):
+        DataController.with_session_id(*ctrl.open_args[1:])
+
+
+def test_waiters():
+    ctrl = DataController.with_new_session()
+    t, waiter = ctrl.new_thread(), ctrl.new_thread()
+    ctrl.set_future(t, Future())
+    assert ctrl.get_or_wait(waiter, mt.TlFuturePtr(t)) == (False, None)
+    assert ctrl.get_future(t).continuations == [waiter]
+
+    assert ctrl.resolve_future(t, mt.TlInt(3)) == [waiter]
+    future = ctrl.get_future(t)
+    assert future.resolved and future.value == mt.TlInt(3)
+    assert future.continuations == []
+    assert ctrl.get_or_wait(waiter, mt.TlFuturePtr(t)) == (True, mt.TlInt(3))
+
+
+def _add_pending(args):
+    open_args, vmid = args
+    cls, *session_args = open_args
+    ctrl = cls.with_session_id(*session_args)
+    for _ in range(50):
+        ctrl.add_pending(vmid, 1)
+
+
+def test_processes():
+    ctrl = DataController.with_new_session()
+    t = ctrl.new_thread()
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(4, mp_context=context) as pool:
+        list(pool.map(_add_pending, [(ctrl.open_args, t)] * 4))
+    assert ctrl.add_pending(t, 0) == 200
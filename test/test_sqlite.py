@@ -0,0 +1,70 @@
+"""Test the SQLite controller"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import hark_lang.machine.types as mt
+from hark_lang.controllers.sqlite import DataController
+from hark_lang.load import compile_text
+from hark_lang.machine.controller import ControllerError
+from hark_lang.machine.future import Future
+from hark_lang.machine.state import State
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "hark.db")
+
+
+@pytest.mark.parametrize("codec_name", ["binary", "json"])
+def test_reopen(monkeypatch, db_path, codec_name):
+    monkeypatch.setenv("HARK_CODEC", codec_name)
+    ctrl = DataController.with_new_session(db_path=db_path)
+    exe = compile_text("fn main() { 1 }")
+    ctrl.set_executable(exe)
+    t = ctrl.new_thread()
+    ctrl.set_state(t, State([mt.TlInt(5)]))
+    ctrl.result = [1, "a"]
+
+    again = DataController.with_session_id(ctrl.session_id, db_path)
+    assert again.executable.serialise() == exe.serialise()
+    assert again.get_state(t) == State([mt.TlInt(5)])
+    assert again.result == [1, "a"]
+    assert again.get_thread_ids() == [t]
+
+
+def test_missing_session(db_path):
+    DataController.with_new_session(db_path=db_path)
+    with pytest.raises(ControllerError):
+        DataController.with_session_id("nope", db_path)
+
+
+def test_waiters(db_path):
+    ctrl = DataController.with_new_session(db_path=db_path)
+    t, waiter = ctrl.new_thread(), ctrl.new_thread()
+    ctrl.set_future(t, Future())
+    assert ctrl.get_or_wait(waiter, mt.TlFuturePtr(t)) == (False, None)
+    assert ctrl.get_future(t).continuations == [waiter]
+
+    assert ctrl.resolve_future(t, mt.TlInt(3)) == [waiter]
+    future = ctrl.get_future(t)
+    assert future.resolved and future.value == mt.TlInt(3)
+    assert future.continuations == []
+    assert ctrl.get_or_wait(waiter, mt.TlFuturePtr(t)) == (True, mt.TlInt(3))
+
+
+def _add_pending(args):
+    session_id, db_path, vmid = args
+    ctrl = DataController.with_session_id(session_id, db_path)
+    for _ in range(50):
+        ctrl.add_pending(vmid, 1)
+
+
+def test_processes(db_path):
+    ctrl = DataController.with_new_session(db_path=db_path)
+    t = ctrl.new_thread()
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(4, mp_context=context) as pool:
+        list(pool.map(_add_pending, [(ctrl.session_id, db_path, t)] * 4))
+    assert ctrl.add_pending(t, 0) == 200
@@ -0,0 +1,36 @@
+"""Test the Python thread executor"""
+import pytest
+
+from hark_lang.controllers import local
+from hark_lang.executors import thread
+from hark_lang.run.common import ThreadDied, run_and_wait, wait_for_finish
+
+from .test_examples import EXAMPLES_SUBDIR
+
+CHAINING = str(EXAMPLES_SUBDIR / "chaining.hk")
+
+
+def run(invoker):
+    waiter = lambda c, i: wait_for_finish(0.1, 2, c, i)
+    return run_and_wait(invoker.data_controller, invoker, waiter, CHAINING, "main", [])
+
+
+def test_pool_stopped():
+    invoker = thread.Invoker(local.DataController())
+    assert run(invoker) == 4
+    # The run shut the pool down
+    with pytest.raises(RuntimeError):
+        invoker.invoke(1)
+
+
+def test_thread_died(monkeypatch):
+    run_inline = thread.run_inline
+
+    def run_only_main(vmid, invoker):
+        if vmid != 0:
+            raise ValueError("oops")
+        run_inline(vmid, invoker)
+
+    monkeypatch.setattr(thread, "run_inline", run_only_main)
+    with pytest.raises(ThreadDied):
+        run(thread.Invoker(local.DataController()))
@@ -20,6 +20,45 @@ def test_true():
     assert original == deser
 
 
+def test_atomics_are_singletons():
+    assert TlNull() is TlNull()
+    assert TlTrue() is not TlFalse()
+    assert TlType.deserialise(TlTrue().serialise()) is TlTrue()
+    assert TlTrue() != TlFalse()
+    assert TlNull() != TlList()
+
+
+def test_equality_and_hashing():
+    a = TlFunctionPtr("foo", 1)
+    assert a == TlFunctionPtr("foo", 1)
+    assert a != TlFunctionPtr("foo", 2)
+    assert TlFuturePtr(2) == TlFuturePtr(2)
+    assert TlFuturePtr(2) != TlInt(2)
+    assert TlQuote(TlSymbol("x")) == TlQuote(TlSymbol("x"))
+    assert TlList([TlInt(1)]) != TlList([TlInt(1), TlInt(2)])
+    assert TlHash({TlString("a"): TlList()}) == TlHash({TlString("a"): TlList()})
+    h = TlHash({TlNull(): TlInt(1), a: TlInt(2), TlFuturePtr(3): TlInt(3)})
+    assert h[TlNull()] == TlInt(1)
+    assert h[TlFunctionPtr("foo", 1)] == TlInt(2)
+    assert h[TlFuturePtr(3)] == TlInt(3)
+
+
+def test_compact_values():
+    assert TlInt(5) is TlInt(5)
+    assert TlInt(100000) == TlInt(100000)
+    assert TlInt(5).value == 5 and type(TlInt(5).value) is int
+    for obj in [TlInt(1), TlString("a"), TlFunctionPtr("f"), TlList(), TlHash()]:
+        assert not hasattr(obj, "__dict__")
+
+
+def test_future_falsy_value():
+    from hark_lang.machine.future import Future
+
+    for value in [TlInt(0), TlList()]:
+        future = Future(resolved=True, value=value)
+        assert Future.deserialise(future.serialise()).value == value
+
+
 def test_literals():
     int_a = TlInt(5)
     int_b = TlInt(3)
@@ -43,6 +82,47 @@ def test_hashes():
     assert h == deser
 
 
+def test_hash_sharing():
+    a = TlHash({TlString("x"): TlInt(1)})
+    b = a.set(TlString("y"), TlInt(2))
+    c = b.set(TlString("x"), TlInt(3))
+    assert a == TlHash({TlString("x"): TlInt(1)})
+    assert list(b.items()) == [(TlString("x"), TlInt(1)), (TlString("y"), TlInt(2))]
+    assert list(c.items()) == [(TlString("x"), TlInt(3)), (TlString("y"), TlInt(2))]
+    assert to_json_and_back(c) == c
+    assert TlString("z") not in c
+
+
+class Collider:
+    """A key with a deliberately bad hash"""
+
+    def __init__(self, n):
+        self.n = n
+
+    def __hash__(self):
+        return self.n % 3
+
+    def __eq__(self, other):
+        return isinstance(other, Collider) and self.n == other.n
+
+
+def test_hamt():
+    from hark_lang.machine.hamt import Hamt
+
+    keys = list(range(2000)) + [Collider(n) for n in range(20)]
+    expected = {}
+    h = Hamt()
+    versions = []
+    for i, k in enumerate(keys + keys[::7]):
+        h = h.set(k, i)
+        expected[k] = i
+        versions.append((h, dict(expected)))
+    for old, exp in versions[::97]:
+        assert len(old) == len(exp)
+        assert dict(old.items()) == exp
+        assert all(old[k] == v for k, v in exp.items())
+
+
 def test_lists():
     inner = TlList([TlInt(1), TlInt(31)])
     l = TlList([TlInt(1), TlInt(31), TlString("bla"), inner])
@@ -53,14 +133,31 @@ def test_lists():
 def test_list():
     list_a = TlList([TlInt(1), TlInt(2), TlInt(3)])
     assert len(list_a) == 3
-    list_a.append(TlInt(789))
-    assert len(list_a) == 4
-    deser = to_json_and_back(list_a)
+    list_b = list_a.appended(TlInt(789))
+    assert len(list_a) == 3
+    assert len(list_b) == 4
+    deser = to_json_and_back(list_b)
     print(deser)
     assert deser[0] == TlInt(1)
     assert deser[3] == TlInt(789)
 
 
+def test_list_sharing():
+    a = TlList([TlInt(1), TlInt(2)])
+    b = a.appended(TlInt(3))
+    c = a.appended(TlInt(4))  # a no longer owns the end, so this copies
+    d = b.rest().prepended(TlInt(0))
+    e = a.prepended(TlInt(5))
+    assert a == [TlInt(1), TlInt(2)]
+    assert b == [TlInt(1), TlInt(2), TlInt(3)]
+    assert c == [TlInt(1), TlInt(2), TlInt(4)]
+    assert d == [TlInt(0), TlInt(2), TlInt(3)]
+    assert e == [TlInt(5), TlInt(1), TlInt(2)]
+    assert b._back is a._back
+    assert to_json_and_back(d) == d
+    assert TlList().rest() == TlList()
+
+
 def test_quote():
     obj = TlQuote(TlList([TlInt(1), TlString("foo")]))
     deser = to_json_and_back(obj)